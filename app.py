@@ -6,18 +6,25 @@ import os
 import json
 import traceback
 from urllib.error import HTTPError
-from config import VIDEO_DIR, MOCK_DATA_DIR
+from werkzeug.wsgi import wrap_file
+from werkzeug.http import http_date
+from config import EXECUTION_MODE, VIDEO_DIR, MOCK_DATA_DIR, VIDEO_SENDFILE_MODE, VIDEO_ACCEL_REDIRECT_PREFIX, VIDEO_CHUNK_SIZE, VIDEO_MIMETYPE_CACHE_SIZE, VIDEO_MAX_RANGES
 from database.models import init_db
 from database import operations
 from utils.logging import setup_logger
 from core.crawler import get_anime_list, get_anime_detail, search_anime
-from tasks.scheduler import init_scheduler
-import re
+from tasks.scheduler import init_scheduler, notify_task_changed
+from tasks.download_scheduler import download_scheduler, submit_task, bump_task, lease_owner, PRIORITY_NORMAL
+from tasks.liveness import liveness, start_monitor
+from utils.domain_health import domain_health
+from utils.http_range import resolve_ranges, if_range_matches, RangeFile
 import mimetypes
-import time
 import signal
 import threading
 import sys
+import uuid
+import calendar
+from functools import lru_cache
 
 # 配置日志
 logger = setup_logger(__name__)
@@ -26,64 +33,10 @@ logger = setup_logger(__name__)
 app = Flask(__name__)
 
 # 全局变量
-running_tasks = {}  # 记录正在运行的任务
-task_lock = threading.Lock()  # 任务锁
-watchdog_timer = None  # 看门狗定时器
-WATCHDOG_TIMEOUT = 300  # 看门狗超时时间（秒）
 ffmpeg_initialized = False  # static_ffmpeg初始化状态标记
 ffmpeg_init_lock = threading.Lock()  # static_ffmpeg初始化锁
 is_shutting_down = False  # 关闭标志
 
-def feed_watchdog():
-    """重置看门狗定时器"""
-    global watchdog_timer
-    if watchdog_timer:
-        watchdog_timer.cancel()
-    watchdog_timer = threading.Timer(WATCHDOG_TIMEOUT, handle_watchdog_timeout)
-    watchdog_timer.daemon = True
-    watchdog_timer.start()
-
-def handle_watchdog_timeout():
-    """处理看门狗超时"""
-    global is_shutting_down
-    if is_shutting_down:
-        return
-        
-    logger.warning("看门狗超时，检查运行中的任务...")
-    with task_lock:
-        for task_id in list(running_tasks.keys()):
-            logger.warning(f"任务 {task_id} 可能已经停止响应")
-            operations.update_task_status(task_id, 'terminated')
-            del running_tasks[task_id]
-
-def monitor_tasks():
-    """监控任务状态的后台线程"""
-    global is_shutting_down
-    while not is_shutting_down:
-        try:
-            with task_lock:
-                for task_id in list(running_tasks.keys()):
-                    if is_shutting_down:
-                        break
-                    # 检查任务是否仍在运行
-                    task = operations.get_task(task_id)
-                    if task and task['status'] == 'running':
-                        # 任务仍在运行，喂狗
-                        feed_watchdog()
-                    else:
-                        # 任务已经停止，从运行列表中移除
-                        logger.info(f"任务 {task_id} 已完成或停止")
-                        del running_tasks[task_id]
-        except Exception as e:
-            if not is_shutting_down:
-                logger.error(f"监控任务时出错: {str(e)}")
-        
-        # 每5秒检查一次
-        for _ in range(5):  # 分解等待时间,便于快速响应关闭
-            if is_shutting_down:
-                break
-            time.sleep(1)
-
 def cleanup_tasks():
     """清理所有运行中的任务"""
     global is_shutting_down
@@ -91,19 +44,16 @@ def cleanup_tasks():
     
     logger.info("开始清理任务...")
     try:
-        # 取消看门狗定时器
-        if watchdog_timer:
-            watchdog_timer.cancel()
-        
-        # 标记所有运行中的任务为终止状态
-        with task_lock:
-            for task_id in list(running_tasks.keys()):
-                try:
-                    logger.info(f"正在终止任务 {task_id}")
-                    operations.update_task_status(task_id, 'terminated')
-                    del running_tasks[task_id]
-                except Exception as e:
-                    logger.error(f"终止任务 {task_id} 时出错: {str(e)}")
+        # 标记所有运行中的任务为终止状态，并释放本进程持有的租约
+        owner = lease_owner()
+        for task_id in liveness.task_ids():
+            try:
+                logger.info(f"正在终止任务 {task_id}")
+                operations.update_task_status(task_id, 'terminated')
+                operations.release_task_lease(task_id, owner)
+                liveness.unregister(task_id)
+            except Exception as e:
+                logger.error(f"终止任务 {task_id} 时出错: {str(e)}")
                     
         logger.info("任务清理完成")
     except Exception as e:
@@ -160,10 +110,12 @@ def init_app():
         # 初始化数据库
         init_db()
         
-        # 检查并处理异常终止的任务
+        # 检查并处理异常终止的任务，worker模式下任务由其他进程执行，不在这里处理
         try:
             # 获取所有状态为"running"的任务
-            running_tasks_db = operations.get_tasks_by_status('running')
+            running_tasks_db = operations.get_tasks_by_status('running') if EXECUTION_MODE == 'inline' else []
+            # 持有租约的任务可能正在其他节点执行，租约过期后由调度器回收
+            running_tasks_db = [task for task in running_tasks_db if not task.get('lease_owner')]
             if running_tasks_db:
                 logger.warning(f"发现 {len(running_tasks_db)} 个异常终止的任务")
                 for task in running_tasks_db:
@@ -173,10 +125,8 @@ def init_app():
         except Exception as e:
             logger.error(f"处理异常终止任务时出错: {str(e)}")
         
-        # 启动任务监控线程
-        monitor_thread = threading.Thread(target=monitor_tasks)
-        monitor_thread.daemon = True
-        monitor_thread.start()
+        # 启动停滞剧集监控线程
+        start_monitor()
         
         # 设置信号处理器（只在主线程中设置）
         if threading.current_thread() is threading.main_thread():
@@ -194,186 +144,237 @@ def init_app():
 # 初始化应用
 init_app()
 
-# 添加视频文件访问路径
-@app.route('/video/<path:filename>')
-def serve_video(filename):
-    """提供视频文件访问，支持范围请求"""
-    logger.info(f"请求视频文件: {filename}")
-    
-    # 检查文件是否存在
-    video_path = os.path.join(VIDEO_DIR, filename)
-    if not os.path.exists(video_path):
-        logger.error(f"视频文件不存在: {filename}")
-        return "视频文件不存在", 404
-    
-    # 获取文件大小
-    file_size = os.path.getsize(video_path)
-    logger.info(f"视频文件大小: {file_size} 字节")
-    
-    # 基于文件内容检测真实的MIME类型
+def _guess_content_type_by_ext(filename):
+    """基于文件后缀判断MIME类型"""
     file_ext = os.path.splitext(filename)[1].lower()
-    content_type = None
+    if file_ext == '.mp4':
+        return 'video/mp4'
+    elif file_ext == '.webm':
+        return 'video/webm'
+    elif file_ext == '.ogg':
+        return 'video/ogg'
+    elif file_ext == '.m3u8':
+        return 'application/vnd.apple.mpegurl'
+    elif file_ext == '.ts':
+        return 'video/mp2t'
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+@lru_cache(maxsize=VIDEO_MIMETYPE_CACHE_SIZE)
+def _detect_content_type(video_path, inode, mtime_ns):
+    """
+    基于文件内容检测真实的MIME类型
     
-    # 检查文件头部来判断真实类型
+    结果按(路径, inode, 修改时间)缓存，文件被替换或修改后会重新检测
+    
+    Args:
+        video_path: 文件路径
+        inode: 文件inode，仅用作缓存键
+        mtime_ns: 文件修改时间(纳秒)，仅用作缓存键
+        
+    Returns:
+        字符串，MIME类型
+    """
     try:
         with open(video_path, 'rb') as f:
             header = f.read(188)  # 读取前188个字节 (MPEG-TS包长度)
-            
-            # 检查MPEG-TS标记 (0x47 同步字节)
-            # MPEG-TS文件通常以0x47开头，每188字节一个包
-            if header[0] == 0x47 and (len(header) >= 188 and header[188-1] == 0x47):
-                content_type = 'video/mp2t'
-                logger.info("文件头检测为MPEG-TS格式")
-            # 检查MP4文件头 (ftyp...)
-            elif len(header) >= 8 and header[4:8] == b'ftyp':
-                content_type = 'video/mp4'
-                logger.info("文件头检测为MP4格式")
-            # 检查WebM文件头 (1A 45 DF A3 - EBML开头)
-            elif len(header) >= 4 and header[0:4] == b'\x1a\x45\xdf\xa3':
-                content_type = 'video/webm'
-                logger.info("文件头检测为WebM格式")
-            # 检查Ogg文件头 (OggS...)
-            elif len(header) >= 4 and header[0:4] == b'OggS':
-                content_type = 'video/ogg'
-                logger.info("文件头检测为Ogg格式")
-            # 检查MKV文件头 (也是以EBML开头)
-            elif len(header) >= 4 and header[0:4] == b'\x1a\x45\xdf\xa3':
-                content_type = 'video/x-matroska'
-                logger.info("文件头检测为MKV格式")
-            # 检查是否为HLS流媒体 (.m3u8文本文件)
-            elif len(header) >= 7 and header.startswith(b'#EXTM3U'):
-                content_type = 'application/vnd.apple.mpegurl'
-                logger.info("文件头检测为HLS流媒体")
-            # 如果以上都不匹配，则尝试使用文件后缀判断
-            else:
-                # 基于文件后缀判断
-                if file_ext == '.mp4':
-                    content_type = 'video/mp4'
-                elif file_ext == '.webm':
-                    content_type = 'video/webm'
-                elif file_ext == '.ogg':
-                    content_type = 'video/ogg'
-                elif file_ext == '.m3u8':
-                    content_type = 'application/vnd.apple.mpegurl'
-                elif file_ext == '.ts':
-                    content_type = 'video/mp2t'
-                else:
-                    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
-                
-                logger.info(f"基于文件后缀判断为: {content_type}")
     except Exception as e:
         # 如果检测失败，回退到使用后缀判断
         logger.error(f"检测文件类型出错: {str(e)}")
-        if file_ext == '.mp4':
-            content_type = 'video/mp4'
-        elif file_ext == '.webm':
-            content_type = 'video/webm'
-        elif file_ext == '.ogg':
-            content_type = 'video/ogg'
-        elif file_ext == '.m3u8':
-            content_type = 'application/vnd.apple.mpegurl'
-        elif file_ext == '.ts':
-            content_type = 'video/mp2t'
-        else:
-            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return _guess_content_type_by_ext(video_path)
+    
+    # 检查MPEG-TS标记 (0x47 同步字节)
+    # MPEG-TS文件通常以0x47开头，每188字节一个包
+    if len(header) >= 188 and header[0] == 0x47 and header[188-1] == 0x47:
+        return 'video/mp2t'
+    # 检查MP4文件头 (ftyp...)
+    elif len(header) >= 8 and header[4:8] == b'ftyp':
+        return 'video/mp4'
+    # 检查WebM/MKV文件头 (1A 45 DF A3 - EBML开头)
+    elif len(header) >= 4 and header[0:4] == b'\x1a\x45\xdf\xa3':
+        return 'video/webm'
+    # 检查Ogg文件头 (OggS...)
+    elif len(header) >= 4 and header[0:4] == b'OggS':
+        return 'video/ogg'
+    # 检查是否为HLS流媒体 (.m3u8文本文件)
+    elif len(header) >= 7 and header.startswith(b'#EXTM3U'):
+        return 'application/vnd.apple.mpegurl'
+    # 如果以上都不匹配，则尝试使用文件后缀判断
+    return _guess_content_type_by_ext(video_path)
+
+def _file_body(video_path, start, end):
+    """
+    创建从start到end(包含)的文件响应体
+    
+    交给WSGI服务器的wsgi.file_wrapper，gunicorn等服务器会用os.sendfile
+    直接从内核发送文件，不经过Python复制；RangeFile保证只发送请求的范围
     
-    logger.info(f"最终使用的视频文件类型: {content_type}")
+    Args:
+        video_path: 文件路径
+        start: 起始字节
+        end: 结束字节(包含)
+        
+    Returns:
+        可迭代的响应体
+    """
+    f = RangeFile(open(video_path, 'rb'), start, end - start + 1)
+    return wrap_file(request.environ, f, buffer_size=VIDEO_CHUNK_SIZE)
+
+def _iter_file_range(video_path, start, end):
+    """
+    分块读取文件中从start到end(包含)的内容
+    
+    Args:
+        video_path: 文件路径
+        start: 起始字节
+        end: 结束字节(包含)
+        
+    Returns:
+        生成器，逐块产生文件内容
+    """
+    with open(video_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(VIDEO_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+# 添加视频文件访问路径
+@app.route('/video/<path:filename>')
+def serve_video(filename):
+    """提供视频文件访问，支持范围请求、多段范围请求和条件请求"""
+    # 检查文件是否存在
+    video_path = os.path.join(VIDEO_DIR, filename)
+    try:
+        stat_result = os.stat(video_path)
+    except OSError:
+        logger.error(f"视频文件不存在: {filename}")
+        return "视频文件不存在", 404
+    
+    file_size = stat_result.st_size
+    content_type = _detect_content_type(video_path, stat_result.st_ino, stat_result.st_mtime_ns)
     content_disposition = f'inline; filename="{os.path.basename(filename)}"'
     
     # 如果检测到MPEG-TS格式，考虑修改Content-Disposition以使用.ts扩展名
+    file_ext = os.path.splitext(filename)[1].lower()
     if content_type == 'video/mp2t' and file_ext != '.ts':
-        base_name = os.path.basename(filename)
-        name_without_ext = os.path.splitext(base_name)[0]
+        name_without_ext = os.path.splitext(os.path.basename(filename))[0]
         content_disposition = f'inline; filename="{name_without_ext}.ts"'
-        logger.info(f"调整内容处置头为TS格式: {content_disposition}")
     
-    # 处理范围请求
-    range_header = request.headers.get('Range', None)
+    # 由前端nginx/apache直接发送文件，它们会自行处理范围请求
+    if VIDEO_SENDFILE_MODE in ('x-accel', 'x-sendfile'):
+        resp = Response(mimetype=content_type)
+        if VIDEO_SENDFILE_MODE == 'x-accel':
+            resp.headers['X-Accel-Redirect'] = VIDEO_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + filename.lstrip('/')
+        else:
+            resp.headers['X-Sendfile'] = os.path.abspath(video_path)
+        resp.headers.add('Accept-Ranges', 'bytes')
+        resp.headers.add('Access-Control-Allow-Origin', '*')
+        resp.headers.add('Cache-Control', 'public, max-age=86400')
+        resp.headers.add('Content-Disposition', content_disposition)
+        return resp
+    
+    # 强ETag和Last-Modified，文件被替换或修改后都会变化
+    etag = f'{stat_result.st_ino:x}-{file_size:x}-{stat_result.st_mtime_ns:x}'
+    last_modified = int(stat_result.st_mtime)
     
-    # 定义流式传输的生成器函数
-    def generate(start, end):
-        # 增加大块读取的缓冲区
-        chunk_size = 1024 * 1024  # 1MB
-        
-        with open(video_path, 'rb') as f:
-            f.seek(start)
-            remaining = end - start + 1
-            while remaining > 0:
-                read_size = min(chunk_size, remaining)
-                data = f.read(read_size)
-                if not data:
-                    break
-                remaining -= len(data)
-                yield data
+    def add_common_headers(resp):
+        resp.set_etag(etag)
+        resp.headers.add('Last-Modified', http_date(last_modified))
+        resp.headers.add('Accept-Ranges', 'bytes')
+        resp.headers.add('Access-Control-Allow-Origin', '*')
+        resp.headers.add('Cache-Control', 'public, max-age=86400')
+        resp.headers.add('Content-Disposition', content_disposition)
+        return resp
     
-    # 如果是范围请求
-    if range_header:
-        logger.info(f"处理范围请求: {range_header}")
-        byte_start, byte_end = 0, file_size - 1
-        
-        # 解析Range头
-        match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-        if match:
-            groups = match.groups()
-            if groups[0]:
-                byte_start = int(groups[0])
-            if groups[1]:
-                byte_end = int(groups[1])
-            else:
-                byte_end = file_size - 1
-        
-        # 确保范围有效
-        if byte_start >= file_size:
-            logger.error(f"请求范围无效: {byte_start}-{byte_end}, 文件大小: {file_size}")
+    # 条件请求：If-None-Match优先于If-Modified-Since
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since:
+        not_modified = last_modified <= calendar.timegm(request.if_modified_since.utctimetuple())
+    else:
+        not_modified = False
+    if not_modified:
+        return add_common_headers(Response(status=304))
+    
+    # 处理范围请求，If-Range不匹配时忽略Range返回完整内容
+    ranges = None
+    if (request.range and request.range.units == 'bytes'
+            and if_range_matches(request.if_range, request.headers.get('If-Range'), etag, last_modified)):
+        ranges = resolve_ranges(request.range.ranges, file_size)
+        if not ranges:
+            logger.error(f"请求范围无效: {request.headers.get('Range')}, 文件大小: {file_size}")
             return Response(
                 status=416,  # Range Not Satisfiable
                 headers={
                     'Content-Range': f'bytes */{file_size}'
                 }
             )
-        
-        # 限制结束位置不超过文件大小
-        byte_end = min(byte_end, file_size - 1)
-        
-        # 计算实际长度
+        if len(ranges) > VIDEO_MAX_RANGES:
+            # 范围过多时直接返回完整内容
+            ranges = None
+    
+    # 单个范围
+    if ranges and len(ranges) == 1:
+        byte_start, byte_end = ranges[0]
         content_length = byte_end - byte_start + 1
-        logger.info(f"返回部分内容: {byte_start}-{byte_end}/{file_size}, 大小: {content_length} 字节")
+        logger.debug(f"返回部分内容: {filename} {byte_start}-{byte_end}/{file_size}")
         
-        # 创建响应
         resp = Response(
-            generate(byte_start, byte_end),
+            _file_body(video_path, byte_start, byte_end),
             206,  # Partial Content
             mimetype=content_type,
             direct_passthrough=True
         )
-        
-        # 设置响应头
         resp.headers.add('Content-Range', f'bytes {byte_start}-{byte_end}/{file_size}')
-        resp.headers.add('Accept-Ranges', 'bytes')
         resp.headers.add('Content-Length', str(content_length))
-        resp.headers.add('Access-Control-Allow-Origin', '*')
-        resp.headers.add('Cache-Control', 'public, max-age=86400')
-        resp.headers.add('Content-Disposition', content_disposition)
+        return add_common_headers(resp)
+    
+    # 多个范围，返回multipart/byteranges
+    if ranges:
+        boundary = uuid.uuid4().hex
+        parts = []
+        content_length = 0
+        for byte_start, byte_end in ranges:
+            part_header = (
+                f'--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {byte_start}-{byte_end}/{file_size}\r\n\r\n'
+            ).encode('latin-1')
+            parts.append((part_header, byte_start, byte_end))
+            content_length += len(part_header) + (byte_end - byte_start + 1) + 2
+        closing = f'--{boundary}--\r\n'.encode('latin-1')
+        content_length += len(closing)
+        logger.debug(f"返回多段内容: {filename} {len(ranges)} 段")
+        
+        def generate_multipart():
+            for part_header, byte_start, byte_end in parts:
+                yield part_header
+                yield from _iter_file_range(video_path, byte_start, byte_end)
+                yield b'\r\n'
+            yield closing
         
-        return resp
+        resp = Response(
+            generate_multipart(),
+            206,  # Partial Content
+            content_type=f'multipart/byteranges; boundary={boundary}',
+            direct_passthrough=True
+        )
+        resp.headers.add('Content-Length', str(content_length))
+        return add_common_headers(resp)
     
     # 不是范围请求，返回全部内容
-    logger.info(f"返回完整内容: {file_size} 字节")
+    logger.debug(f"返回完整内容: {filename} {file_size} 字节")
     resp = Response(
-        generate(0, file_size - 1),
+        _file_body(video_path, 0, file_size - 1),
         200,
         mimetype=content_type,
         direct_passthrough=True
     )
-    
-    # 设置响应头
-    resp.headers.add('Accept-Ranges', 'bytes')
     resp.headers.add('Content-Length', str(file_size))
-    resp.headers.add('Access-Control-Allow-Origin', '*')
-    resp.headers.add('Cache-Control', 'public, max-age=86400')
-    resp.headers.add('Content-Disposition', content_disposition)
-    
-    return resp
+    return add_common_headers(resp)
 
 # 初始化数据库
 init_db()
@@ -488,23 +489,22 @@ def api_search_anime():
 # API接口：获取任务列表
 @app.route('/api/tasks', methods=['GET'])
 def api_tasks_list():
+    limit = request.args.get('limit', None, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    status = request.args.get('status', None) or None
+    
     try:
-        # 从数据库获取任务列表
-        tasks = operations.get_tasks()
-        if tasks is None:
-            tasks = []
-            
-        # 为每个任务获取动漫标题
+        if limit is not None:
+            limit = max(1, min(limit, 500))
+        offset = max(0, offset)
+        
+        # 一次查询获取任务、动漫标题和剧集下载统计
+        tasks, total = operations.get_tasks_page(limit=limit, offset=offset, status=status)
         for task in tasks:
-            anime_id = task.get('anime_id')
-            if anime_id:
-                anime = operations.get_anime_by_site_id(anime_id)
-                if anime:
-                    task['anime_title'] = anime.get('title', '未知动漫')
-                else:
-                    task['anime_title'] = '未知动漫'
-        
-        return jsonify({"success": True, "data": tasks})
+            if not task.get('anime_title'):
+                task['anime_title'] = '未知动漫'
+        
+        return jsonify({"success": True, "data": tasks, "total": total, "limit": limit, "offset": offset})
     except Exception as e:
         logger.error(f"获取任务列表出错: {str(e)}")
         logger.error(traceback.format_exc())
@@ -514,19 +514,13 @@ def api_tasks_list():
 @app.route('/api/tasks/<int:task_id>', methods=['GET'])
 def api_task_detail(task_id):
     try:
-        # 从数据库获取任务详情
-        task = operations.get_task(task_id)
+        # 从数据库获取任务详情，包含动漫标题和剧集下载统计
+        task = operations.get_task_summary(task_id)
         if task is None:
             return jsonify({"success": False, "error": "任务不存在"}), 404
         
-        # 获取动漫标题
-        anime_id = task.get('anime_id')
-        if anime_id:
-            anime = operations.get_anime_by_site_id(anime_id)
-            if anime:
-                task['anime_title'] = anime.get('title', '未知动漫')
-            else:
-                task['anime_title'] = '未知动漫'
+        if not task.get('anime_title'):
+            task['anime_title'] = '未知动漫'
         
         return jsonify({"success": True, "data": task})
     except Exception as e:
@@ -543,21 +537,9 @@ def api_execute_task(task_id):
         if task is None:
             return jsonify({"success": False, "error": "任务不存在"}), 404
         
-        # 导入并调用任务执行器
-        from tasks.executor import execute_task
-        import threading
-        
-        # 将任务状态改为running
-        operations.update_task_status(task_id, 'running')
-        
-        # 记录任务到运行列表
-        with task_lock:
-            running_tasks[task_id] = True
-        
-        # 创建新线程异步执行任务
-        task_thread = threading.Thread(target=execute_task, args=(task_id,))
-        task_thread.daemon = True
-        task_thread.start()
+        # 交给全局下载调度器异步执行，任务开始执行时才标记为running
+        if not submit_task(task_id, PRIORITY_NORMAL):
+            return jsonify({"success": True, "message": "任务已在下载队列中"})
         
         return jsonify({"success": True, "message": "任务已开始执行"})
     except Exception as e:
@@ -565,6 +547,31 @@ def api_execute_task(task_id):
         logger.error(traceback.format_exc())
         return jsonify({"success": False, "error": f"执行任务出错: {str(e)}"}), 500
 
+# API接口：提升任务优先级
+@app.route('/api/tasks/<int:task_id>/priority', methods=['POST'])
+def api_bump_task(task_id):
+    try:
+        if not bump_task(task_id):
+            return jsonify({"success": False, "error": "任务不在下载队列中"}), 404
+        
+        return jsonify({"success": True, "message": "任务优先级已提升"})
+    except Exception as e:
+        logger.error(f"提升任务优先级出错: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": f"提升任务优先级出错: {str(e)}"}), 500
+
+# API接口：下载队列状态
+@app.route('/api/downloads/queue', methods=['GET'])
+def api_download_queue():
+    if EXECUTION_MODE == 'worker':
+        return jsonify({"success": True, "data": {"jobs": operations.get_job_counts()}})
+    return jsonify({"success": True, "data": {**download_scheduler.stats(), "liveness": liveness.snapshot()}})
+
+# API接口：镜像域名健康状态
+@app.route('/api/domains', methods=['GET'])
+def api_domain_health():
+    return jsonify({"success": True, "data": domain_health.snapshot()})
+
 # API接口：删除任务
 @app.route('/api/tasks/<int:task_id>', methods=['DELETE'])
 def api_delete_task(task_id):
@@ -576,6 +583,7 @@ def api_delete_task(task_id):
         
         # 删除任务
         if operations.delete_task(task_id):
+            notify_task_changed(task_id)
             return jsonify({"success": True, "message": "任务已删除"})
         else:
             return jsonify({"success": False, "error": "删除任务失败"}), 500
@@ -649,12 +657,16 @@ def api_create_task():
             start_episode=task_data.get('start_episode', 1),
             end_episode=task_data.get('end_episode'),
             is_periodic=task_data.get('is_periodic', False),
-            daily_update_time=task_data.get('daily_update_time', 0)
+            daily_update_time=task_data.get('daily_update_time', 0),
+            jitter_window=task_data.get('jitter_window')
         )
         
         if not task_id:
             return jsonify({"success": False, "error": "创建任务失败"}), 500
         
+        # 周期任务加入调度器的运行计划
+        notify_task_changed(task_id)
+        
         # 获取新创建的任务，包含动漫标题
         task = operations.get_task(task_id)
         if task:
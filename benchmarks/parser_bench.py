@@ -0,0 +1,268 @@
+"""
+页面解析基准测试
+
+使用corpus目录中保存的页面样本离线运行列表、详情、搜索、播放接口和播放页解析，
+make_request被替换为直接返回样本内容，不访问网络，也不经过页面缓存。
+每个样本输出每秒解析页数、单页内存分配峰值，并与expected目录中的结果逐项比较。
+
+用法(在项目根目录执行)：
+    python benchmarks/parser_bench.py
+    python benchmarks/parser_bench.py --backend all --iterations 200
+    python benchmarks/parser_bench.py --case detail_full --update-expected
+
+样本说明见corpus/manifest.json，kind取值：
+    anime_list   core.crawler._fetch_anime_list
+    anime_detail core.crawler._fetch_anime_detail
+    search       core.crawler._fetch_search_results
+    episode_api  core.crawler._fetch_episode_video
+    video_url    core.parser.extract_video_url
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tracemalloc
+from contextlib import contextmanager
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, 'corpus')
+EXPECTED_DIR = os.path.join(CORPUS_DIR, 'expected')
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from core import crawler, parser  # noqa: E402
+
+# 样本中的相对路径统一拼接到该地址，结果不随配置中的域名变化
+BENCH_BASE_URL = 'https://bench.local'
+
+class FakeResponse:
+    """模拟requests的响应对象，只提供解析代码用到的属性"""
+
+    def __init__(self, text):
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.status_code = 200
+
+    def json(self):
+        return json.loads(self.text)
+
+@contextmanager
+def mocked_network(text):
+    """
+    在上下文内把crawler中的make_request和get_base_url替换为返回样本内容
+
+    Args:
+        text: 样本内容
+    """
+    result = {"status_code": 200, "response": FakeResponse(text)}
+    original = (crawler.make_request, crawler.get_base_url)
+    crawler.make_request = lambda *args, **kwargs: result
+    crawler.get_base_url = lambda: BENCH_BASE_URL
+    try:
+        yield
+    finally:
+        crawler.make_request, crawler.get_base_url = original
+
+def build_runner(case, text):
+    """
+    根据样本类型生成无参数的解析函数
+
+    Args:
+        case: manifest中的样本描述
+        text: 样本内容
+
+    Returns:
+        函数，调用后返回解析结果
+    """
+    kind = case['kind']
+    args = case.get('args', {})
+    if kind == 'anime_list':
+        return lambda: crawler._fetch_anime_list(args.get('page', 1))
+    if kind == 'anime_detail':
+        return lambda: crawler._fetch_anime_detail(args['anime_id'])
+    if kind == 'search':
+        return lambda: crawler._fetch_search_results(args['keyword'])
+    if kind == 'episode_api':
+        return lambda: crawler._fetch_episode_video(args['anime_id'], args['episode_number'])
+    if kind == 'video_url':
+        return lambda: parser.extract_video_url(text)
+    raise ValueError(f"未知的样本类型: {kind}")
+
+def load_cases(names=None):
+    """
+    读取样本清单
+
+    Args:
+        names: 只运行的样本名称列表，为空时运行全部
+
+    Returns:
+        列表，包含样本描述和样本内容
+    """
+    with open(os.path.join(CORPUS_DIR, 'manifest.json'), encoding='utf-8') as f:
+        cases = json.load(f)
+    if names:
+        unknown = set(names) - {case['name'] for case in cases}
+        if unknown:
+            raise SystemExit(f"未知的样本: {', '.join(sorted(unknown))}")
+        cases = [case for case in cases if case['name'] in names]
+    for case in cases:
+        with open(os.path.join(CORPUS_DIR, case['fixture']), encoding='utf-8') as f:
+            case['text'] = f.read()
+    return cases
+
+def expected_path(case):
+    """获取样本期望结果文件路径"""
+    return os.path.join(EXPECTED_DIR, f"{case['name']}.json")
+
+def diff_result(expected, actual, path='$'):
+    """
+    比较期望结果和实际结果
+
+    Args:
+        expected: 期望结果
+        actual: 实际结果
+        path: 当前比较位置，用于输出差异
+
+    Returns:
+        列表，包含差异描述，最多返回前几条
+    """
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        diffs = []
+        for key in sorted(set(expected) | set(actual)):
+            if key not in actual:
+                diffs.append(f"{path}.{key}: 缺少字段")
+            elif key not in expected:
+                diffs.append(f"{path}.{key}: 多出字段")
+            else:
+                diffs.extend(diff_result(expected[key], actual[key], f"{path}.{key}"))
+        return diffs[:5]
+    if isinstance(expected, list) and isinstance(actual, list):
+        diffs = []
+        if len(expected) != len(actual):
+            diffs.append(f"{path}: 数量 {len(actual)}，期望 {len(expected)}")
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            diffs.extend(diff_result(e, a, f"{path}[{i}]"))
+        return diffs[:5]
+    if expected != actual:
+        return [f"{path}: {actual!r}，期望 {expected!r}"]
+    return []
+
+def measure(runner, iterations):
+    """
+    测量解析速度和内存分配
+
+    Args:
+        runner: 解析函数
+        iterations: 计时的重复次数
+
+    Returns:
+        元组，(解析结果, 每秒页数, 单页内存分配峰值字节数)
+    """
+    # 预热，同时得到用于比较的结果
+    result = runner()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        runner()
+    elapsed = time.perf_counter() - start
+
+    # tracemalloc会显著拖慢执行，单独运行一次统计分配峰值
+    tracemalloc.start()
+    try:
+        runner()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    pages_per_sec = iterations / elapsed if elapsed > 0 else float('inf')
+    return result, pages_per_sec, peak
+
+def run(cases, backend, iterations, update_expected=False):
+    """
+    使用指定解析器运行所有样本
+
+    Args:
+        cases: 样本列表
+        backend: 解析器名称，lxml或html.parser
+        iterations: 每个样本的计时重复次数
+        update_expected: 是否用本次结果覆盖期望结果
+
+    Returns:
+        列表，每个样本的测量结果字典
+    """
+    parser._parser_backend = backend
+    reports = []
+    for case in cases:
+        with mocked_network(case['text']):
+            result, pages_per_sec, peak = measure(build_runner(case, case['text']), iterations)
+
+        path = expected_path(case)
+        if update_expected:
+            with open(path, 'w', encoding='utf-8', newline='\n') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+                f.write('\n')
+            diffs = []
+        elif os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                diffs = diff_result(json.load(f), result)
+        else:
+            diffs = ["缺少期望结果，使用--update-expected生成"]
+
+        reports.append({
+            'name': case['name'],
+            'kind': case['kind'],
+            'backend': backend,
+            'bytes': len(case['text'].encode('utf-8')),
+            'pages_per_sec': round(pages_per_sec, 1),
+            'peak_kib': round(peak / 1024, 1),
+            'ok': not diffs,
+            'diffs': diffs
+        })
+    return reports
+
+def print_reports(reports):
+    """以表格形式输出测量结果"""
+    print(f"{'样本':<20}{'类型':<14}{'解析器':<13}{'大小KiB':>9}{'页/秒':>10}{'峰值KiB':>10}  结果")
+    for report in reports:
+        status = 'OK' if report['ok'] else 'FAIL'
+        print(f"{report['name']:<20}{report['kind']:<14}{report['backend']:<13}"
+              f"{report['bytes'] / 1024:>9.1f}{report['pages_per_sec']:>10.1f}{report['peak_kib']:>10.1f}  {status}")
+        for diff in report['diffs']:
+            print(f"    {diff}")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='离线页面解析基准测试')
+    arg_parser.add_argument('--iterations', type=int, default=50, help='每个样本的计时重复次数')
+    arg_parser.add_argument('--backend', choices=['lxml', 'html.parser', 'all'], default=None,
+                            help='使用的解析器，默认与运行时相同')
+    arg_parser.add_argument('--case', action='append', dest='cases', help='只运行指定样本，可重复')
+    arg_parser.add_argument('--update-expected', action='store_true', help='用本次结果覆盖期望结果')
+    arg_parser.add_argument('--json', dest='json_path', help='把测量结果写入JSON文件')
+    arg_parser.add_argument('--verbose', action='store_true', help='保留解析过程中的日志')
+    args = arg_parser.parse_args()
+
+    if not args.verbose:
+        # 解析代码每一项都会记录日志，计时时关闭以免日志输出成为主要开销；
+        # 无法解析的样本本身会记录错误日志，解析是否正确以期望结果比较为准
+        logging.disable(logging.CRITICAL)
+
+    if args.backend == 'all':
+        backends = ['lxml', 'html.parser']
+    else:
+        backends = [args.backend or parser._get_parser_backend()]
+
+    cases = load_cases(args.cases)
+    reports = []
+    for backend in backends:
+        reports.extend(run(cases, backend, args.iterations, args.update_expected and backend == backends[0]))
+    print_reports(reports)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+    return 0 if all(report['ok'] for report in reports) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
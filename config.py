@@ -2,6 +2,7 @@
 全局配置文件
 """
 import os
+import socket
 import logging
 
 # 基础目录
@@ -9,12 +10,23 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # 数据库配置
 DB_PATH = os.path.join(BASE_DIR, 'anime_crawler.db')
+DB_BUSY_TIMEOUT = 30  # 数据库被锁定时的最长等待时间(秒)
+DB_CACHED_STATEMENTS = 256  # 每个连接缓存的预编译语句数量
 
 # 视频存储配置
 VIDEO_DIR = os.path.join(BASE_DIR, 'video')
 if not os.path.exists(VIDEO_DIR):
     os.makedirs(VIDEO_DIR)
 
+# 视频文件服务配置
+# none: 由应用发送文件(支持wsgi.file_wrapper的服务器会使用sendfile)
+# x-accel: 返回X-Accel-Redirect交给nginx发送; x-sendfile: 返回X-Sendfile交给apache发送
+VIDEO_SENDFILE_MODE = 'none'
+VIDEO_ACCEL_REDIRECT_PREFIX = '/protected-video'  # nginx中指向VIDEO_DIR的internal location
+VIDEO_CHUNK_SIZE = 1024 * 1024  # 分块读取文件时的块大小
+VIDEO_MIMETYPE_CACHE_SIZE = 4096  # 文件类型检测结果的缓存数量
+VIDEO_MAX_RANGES = 16  # 单个请求允许的最大范围数，超过时返回完整内容
+
 # 日志配置
 LOG_LEVEL = logging.INFO
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -41,6 +53,79 @@ USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:90.0) Gecko/20100101 Firefox/90.0'
 ]
 
+# HTTP连接池配置
+# 每个主机共享一个会话，连接池大小应不小于并发下载线程数
+HTTP_POOL_CONNECTIONS = 10  # 每个会话缓存的连接池数量
+HTTP_POOL_MAXSIZE = 64  # 每个连接池保持的最大长连接数
+HTTP_POOL_BLOCK = False  # 连接池耗尽时是否阻塞等待
+
+# 请求限速配置(按主机的令牌桶)
+RATE_LIMIT_RATE = 1.0  # 每个主机每秒允许的请求数
+RATE_LIMIT_BURST = 3  # 每个主机允许的最大突发请求数
+RATE_LIMIT_BACKOFF_BASE = 5  # 收到429/503后的初始退避时间(秒)
+RATE_LIMIT_BACKOFF_MAX = 120  # 最大退避时间(秒)
+RATE_LIMIT_RETRY_AFTER_MAX = 300  # 服务器给出的Retry-After最多遵守的秒数
+
+# 镜像域名健康状态和熔断配置
+DOMAIN_HEALTH_EWMA_ALPHA = 0.3  # 响应时间和错误率加权平均中新样本的权重
+DOMAIN_FAILURE_THRESHOLD = 3  # 连续失败多少次后熔断该域名
+DOMAIN_COOLDOWN = 60  # 首次熔断的时长(秒)，探测失败后加倍
+DOMAIN_COOLDOWN_MAX = 600  # 熔断时长上限(秒)
+DOMAIN_LATENCY_PRIOR = 1.0  # 所有域名都没有测量数据时按此响应时间(秒)评分，否则使用已测量域名的平均值
+
+# m3u8分片下载配置
+M3U8_ENGINE = 'thread'  # 分片下载引擎: thread(每集一个线程池) 或 asyncio(全局单事件循环)
+M3U8_ASYNC_LIMIT_PER_HOST = 64  # asyncio引擎每个主机的最大连接数
+M3U8_ASYNC_READ_BUFFER = 1024 * 1024  # asyncio引擎每次读取的字节数
+M3U8_ASYNC_SLOT_POLL_INTERVAL = 0.05  # asyncio引擎等待全局分片名额时的轮询间隔(秒)
+M3U8_RESUME = True  # 重新下载剧集时保留已完成的分片，只下载缺失或不完整的分片
+M3U8_SEGMENT_CHECKSUM = False  # 是否在清单中记录分片sha256并在续传时校验
+M3U8_VARIANT_POLICY = 'highest'  # 主播放列表的子流选择: highest(不超过限制的最高画质) 或 lowest(最低带宽)
+M3U8_MAX_HEIGHT = 1080  # 选择子流时的最大分辨率高度，0表示不限制
+M3U8_MAX_BANDWIDTH = 0  # 选择子流时的最大带宽(bit/s)，0表示不限制
+M3U8_RANGE_CHUNK_SIZE = 8 * 1024 * 1024  # EXT-X-BYTERANGE分片合并后单次Range请求的最大字节数
+M3U8_RANGE_MERGE_GAP = 64 * 1024  # 两个字节范围间隔不超过该值时合并为一次请求
+MAX_SEGMENT_CONCURRENCY = 64  # 所有剧集共享的同时下载分片数，thread和asyncio引擎共用
+SEGMENT_THREADS_PER_EPISODE = 16  # thread引擎每集的线程数，只限制单集排队等待全局名额的分片数
+
+# 任务执行配置
+DOWNLOAD_WORKERS = 3  # 全局同时下载的剧集数
+TASK_PLANNER_WORKERS = 2  # 同时确定剧集范围的任务数
+EPISODE_RESOLVE_AHEAD = 2  # 提前解析视频地址的剧集数
+SCHEDULER_RESYNC_INTERVAL = 3600  # 调度器从数据库重建运行计划的间隔(秒)，防止遗漏其他进程的修改
+PERIODIC_JITTER_WINDOW = 1800  # 周期任务默认的随机延后窗口(秒)，分散同一时刻的更新
+PERIODIC_MAX_CONCURRENT = 2  # 同时运行的周期任务上限，超出的任务排队等待
+
+# 执行模式配置
+EXECUTION_MODE = 'inline'  # inline: 在Web进程内下载; worker: 写入任务队列，由worker.py进程下载
+WORKER_PROCESSES = 2  # worker.py启动的进程数，每个进程同时执行一个任务
+WORKER_POLL_INTERVAL = 2  # worker进程没有作业时轮询队列的间隔(秒)
+
+# 多节点租约配置
+NODE_ID = os.environ.get('NODE_ID') or socket.gethostname()  # 节点标识，多个节点共享数据库时必须互不相同
+LEASE_DURATION = 120  # 任务和作业租约的有效期(秒)，超过未续约视为节点失效
+LEASE_HEARTBEAT_INTERVAL = 30  # 续约间隔(秒)，应明显小于LEASE_DURATION
+
+# 任务存活监控配置
+LIVENESS_CHECK_INTERVAL = 10  # 检查剧集是否停滞的间隔(秒)
+EPISODE_STALL_TIMEOUT = 300  # 剧集开始下载后超过该秒数没有写入任何数据时判定为停滞(只报告，不中断下载)
+
+# 页面解析结果缓存配置
+PAGE_CACHE_SIZE = 512  # 每类页面在内存中缓存的最大条目数
+PAGE_CACHE_DETAIL_TTL = 600  # 动漫详情缓存的新鲜时间(秒)
+PAGE_CACHE_SEARCH_TTL = 300  # 搜索结果缓存的新鲜时间(秒)
+PAGE_CACHE_LIST_TTL = 300  # 动漫列表缓存的新鲜时间(秒)
+PAGE_CACHE_STALE_TTL = 3600  # 过期后仍直接返回并在后台刷新的时间(秒)
+PAGE_CACHE_PERSIST = False  # 是否把缓存写入数据库，重启后仍可使用
+
+# HTTP条件请求缓存配置(列表、详情和搜索页)
+HTTP_CACHE_ENABLED = True  # 是否保存页面的ETag/Last-Modified并发起条件请求
+HTTP_CACHE_DIR = os.path.join(BASE_DIR, 'http_cache')  # 页面响应保存目录
+
+# 下载进度写入配置
+PROGRESS_FLUSH_INTERVAL = 3  # 进度有变化时最长的数据库写入间隔(秒)
+PROGRESS_FLUSH_STEP = 5  # 进度变化达到该百分比时尽快写入
+
 # 示例数据目录
 MOCK_DATA_DIR = os.path.join(BASE_DIR, "mock_data")
 
@@ -11,16 +11,29 @@ import ssl
 import urllib.parse
 import os
 import json
-from bs4 import BeautifulSoup
-from config import BASE_DOMAINS, BASE_URL, USER_AGENTS
+from core.parser import (
+    make_soup, VOD_ID_RE, SHOW_ID_RE, EPISODE_ID_RE, VOD_LINK_RE, PLAY_LINK_RE,
+    ALIAS_SELECTOR, INFO_SPANS_SELECTOR, UPDATE_INFO_SELECTOR, INTRO_TAB_SELECTOR
+)
+from config import BASE_DOMAINS, BASE_URL, USER_AGENTS, PAGE_CACHE_DETAIL_TTL, PAGE_CACHE_SEARCH_TTL, PAGE_CACHE_LIST_TTL
 from utils.logging import setup_logger
 from database import operations
 from utils.network import make_request, get_base_url, get_domain, get_random_ua
 from utils.video import download_video
+from utils.cache import TTLCache, normalize_url
+from utils.singleflight import SingleFlight
+from utils.http_cache import parsed_memo
 
 logger = setup_logger(__name__)
 
-def get_anime_list(page=1):
+# 页面解析结果缓存，键为规范化后的页面URL
+list_cache = TTLCache('anime_list', PAGE_CACHE_LIST_TTL)
+detail_cache = TTLCache('anime_detail', PAGE_CACHE_DETAIL_TTL)
+search_cache = TTLCache('search', PAGE_CACHE_SEARCH_TTL)
+# 剧集播放地址不缓存，只合并同一集并发的解析请求
+episode_flight = SingleFlight('episode_video')
+
+def _fetch_anime_list(page=1):
     """
     获取动漫列表
     
@@ -34,18 +47,23 @@ def get_anime_list(page=1):
     
     # 构建请求URL，网站URL格式为/list或/list?page=1
     url = "/list" if page == 1 else f"/list?page={page}"
-    result = make_request(url)
+    result = make_request(url, conditional=True)
     
     if not result or result["status_code"] != 200 or not result["response"]:
         logger.error(f"获取动漫列表失败，页码: {page}")
         return None
     
+    # 页面内容没有变化时不再解析
+    cached = parsed_memo.lookup(url, result)
+    if cached is not None:
+        return cached
+    
     try:
         # 解析HTML
         html_content = result["response"].text
         logger.info(f"网页内容摘要: {html_content[:200].replace(chr(10), ' ')}...")
         
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = make_soup(html_content)
         anime_list = []
         
         # 找到最新更新区域
@@ -77,7 +95,7 @@ def get_anime_list(page=1):
                         href = a_tag.get("href", "")
                         
                         # 从链接中提取ID，格式为/vod/数字.html
-                        anime_id_match = re.search(r'/vod/(\d+)\.html', href)
+                        anime_id_match = VOD_ID_RE.search(href)
                         if not anime_id_match:
                             continue
                             
@@ -121,7 +139,7 @@ def get_anime_list(page=1):
                 # 如果我们找到了动漫列表，返回结果
                 if anime_list:
                     logger.info(f"成功提取 {len(anime_list)} 个动漫信息")
-                    return anime_list
+                    return parsed_memo.store(url, result, anime_list)
                 else:
                     # 如果主要方法失败，尝试备用选择器
                     logger.warning("使用备用选择器查找动漫列表")
@@ -144,7 +162,7 @@ def get_anime_list(page=1):
                                         href = a_tag.get("href", "")
                                         if "/vod/" in href:
                                             # 找到了有效链接
-                                            anime_id_match = re.search(r'/vod/(\d+)\.html', href)
+                                            anime_id_match = VOD_ID_RE.search(href)
                                             if not anime_id_match:
                                                 continue
                                                 
@@ -193,12 +211,11 @@ def get_anime_list(page=1):
                         
                         if anime_list:
                             logger.info(f"通过备用方法成功提取 {len(anime_list)} 个动漫信息")
-                            return anime_list
+                            return parsed_memo.store(url, result, anime_list)
                             
                         # 如果还是没有找到，直接解析HTML文本
                         logger.warning("直接从HTML中解析动漫列表")
-                        vod_pattern = r'href="/vod/(\d+)\.html".*?title="([^"]+)"'
-                        vod_matches = re.findall(vod_pattern, html_content)
+                        vod_matches = VOD_LINK_RE.findall(html_content)
                         
                         if vod_matches:
                             for anime_id, title in vod_matches:
@@ -212,7 +229,7 @@ def get_anime_list(page=1):
                                 logger.info(f"正则表达式解析到动漫: {title}, ID: {anime_id}")
                             
                             logger.info(f"通过正则表达式成功提取 {len(anime_list)} 个动漫信息")
-                            return anime_list
+                            return parsed_memo.store(url, result, anime_list)
                         
                     logger.error("所有方法都未能找到动漫列表")
                     return None
@@ -222,6 +239,20 @@ def get_anime_list(page=1):
         logger.error(traceback.format_exc())
         return None
 
+def get_anime_list(page=1, refresh=False):
+    """
+    获取动漫列表，优先使用缓存
+    
+    Args:
+        page: 页码，默认为1
+        refresh: 是否忽略缓存重新抓取
+        
+    Returns:
+        列表，包含动漫信息字典
+    """
+    url = "/list" if page == 1 else f"/list?page={page}"
+    return list_cache.get_or_load(normalize_url(url), lambda: _fetch_anime_list(page), refresh)
+
 def extract_anime_id(href):
     """
     从链接中提取动漫ID
@@ -236,12 +267,12 @@ def extract_anime_id(href):
         return None
         
     # 使用正则表达式从URL中提取ID
-    match = re.search(r'/show/([\w\d]+)(?:\.html)?', href)
+    match = SHOW_ID_RE.search(href)
     if match:
         return match.group(1)
     return None
 
-def get_anime_detail(anime_id):
+def _fetch_anime_detail(anime_id):
     """
     获取动漫详情
     
@@ -254,18 +285,23 @@ def get_anime_detail(anime_id):
     logger.info(f"获取动漫详情，ID: {anime_id}")
     
     url = f"/vod/{anime_id}.html"
-    result = make_request(url)
+    result = make_request(url, conditional=True)
     
     if not result or result["status_code"] != 200 or not result["response"]:
         logger.error(f"获取动漫详情失败，ID: {anime_id}")
         return None
     
+    # 页面内容没有变化时不再解析
+    cached = parsed_memo.lookup(url, result)
+    if cached is not None:
+        return cached
+    
     try:
         # 解析HTML
         html_content = result["response"].text
         logger.info(f"网页内容摘要: {html_content[:200].replace(chr(10), ' ')}...")
         
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = make_soup(html_content)
         
         # 获取标题 - 从h1.names元素
         title = ""
@@ -324,12 +360,12 @@ def get_anime_detail(anime_id):
         info_div = soup.select_one(".small[style*='color: #666']")
         if info_div:
             # 获取别名
-            alias_div = info_div.select_one("div.mb-2:-soup-contains('别名')")
+            alias_div = ALIAS_SELECTOR.select_one(info_div)
             if alias_div:
                 alias = alias_div.text.replace('别名：', '').strip()
             
             # 获取地区和年代
-            info_spans = info_div.select("span:-soup-contains('地区'), span:-soup-contains('年代'), span:-soup-contains('类型')")
+            info_spans = INFO_SPANS_SELECTOR.select(info_div)
             for span in info_spans:
                 span_text = span.text.strip()
                 if '地区' in span_text:
@@ -378,14 +414,14 @@ def get_anime_detail(anime_id):
         
         # 获取更新信息
         update_info = ""
-        update_div = soup.select_one("div[style*='color: red']:-soup-contains('更新')")
+        update_div = UPDATE_INFO_SELECTOR.select_one(soup)
         if update_div:
             update_info = update_div.text.strip()
         
         # 获取描述
         description = ""
         # 首先尝试获取介绍内容，位于"动漫介绍"标签之后
-        intro_tab = soup.select_one(".menu-tabs li:-soup-contains('动漫介绍')")
+        intro_tab = INTRO_TAB_SELECTOR.select_one(soup)
         if intro_tab:
             # 获取下一个div，它通常包含介绍内容
             description_div = intro_tab.find_parent("div").find_next_sibling("div")
@@ -415,7 +451,7 @@ def get_anime_detail(anime_id):
             play_url = item.get("href", "")
             
             # 从URL中提取集数ID
-            ep_id_match = re.search(r'ep(\d+)\.html', play_url)
+            ep_id_match = EPISODE_ID_RE.search(play_url)
             ep_id = ep_id_match.group(1) if ep_id_match else ""
             
             # 处理相对路径
@@ -440,7 +476,7 @@ def get_anime_detail(anime_id):
                 play_url = item.get("href", "")
                 
                 # 从URL中提取集数ID
-                ep_id_match = re.search(r'ep(\d+)\.html', play_url)
+                ep_id_match = EPISODE_ID_RE.search(play_url)
                 ep_id = ep_id_match.group(1) if ep_id_match else ""
                 
                 # 处理相对路径
@@ -457,18 +493,17 @@ def get_anime_detail(anime_id):
         
         # 如果仍然没有播放列表，尝试从HTML中提取
         if not play_list:
-            play_url_pattern = r'href="(/vod-play/\d+/ep\d+\.html)"[^>]*>([^<]+)<'
-            play_matches = re.findall(play_url_pattern, html_content)
+            play_matches = PLAY_LINK_RE.findall(html_content)
             
             if play_matches:
-                for url, title in play_matches:
+                for play_path, title in play_matches:
                     # 从URL中提取集数ID
-                    ep_id_match = re.search(r'ep(\d+)\.html', url)
+                    ep_id_match = EPISODE_ID_RE.search(play_path)
                     ep_id = ep_id_match.group(1) if ep_id_match else ""
                     
                     play_info = {
                         "episode": title.strip(),
-                        "url": f"{get_base_url()}{url}",
+                        "url": f"{get_base_url()}{play_path}",
                         "id": ep_id
                     }
                     play_list.append(play_info)
@@ -501,14 +536,28 @@ def get_anime_detail(anime_id):
         anime_detail["episodes"] = episodes
         
         logger.info(f"成功获取动漫详情: {title}, 播放列表数量: {len(play_list)}")
-        return anime_detail
+        return parsed_memo.store(url, result, anime_detail)
         
     except Exception as e:
         logger.error(f"解析动漫详情出错: {str(e)}")
         logger.error(traceback.format_exc())
         return None
 
-def search_anime(keyword):
+def get_anime_detail(anime_id, refresh=False):
+    """
+    获取动漫详情，优先使用缓存
+    
+    Args:
+        anime_id: 动漫ID
+        refresh: 是否忽略缓存重新抓取，需要最新剧集列表时使用
+        
+    Returns:
+        字典，包含动漫详情信息
+    """
+    url = f"/vod/{anime_id}.html"
+    return detail_cache.get_or_load(normalize_url(url), lambda: _fetch_anime_detail(anime_id), refresh)
+
+def _fetch_search_results(keyword):
     """
     搜索动漫
     
@@ -522,18 +571,23 @@ def search_anime(keyword):
     
     encoded_keyword = urllib.parse.quote(keyword)
     url = f"/search?q={encoded_keyword}"
-    result = make_request(url)
+    result = make_request(url, conditional=True)
     
     if not result or result["status_code"] != 200 or not result["response"]:
         logger.error(f"搜索动漫失败，关键词: {keyword}")
         return None
     
+    # 页面内容没有变化时不再解析
+    cached = parsed_memo.lookup(url, result)
+    if cached is not None:
+        return cached
+    
     try:
         # 解析HTML
         html_content = result["response"].text
         logger.info(f"搜索结果网页内容摘要: {html_content[:200].replace(chr(10), ' ')}...")
         
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = make_soup(html_content)
         search_result = []
         
         # 尝试多种可能的选择器来处理不同的搜索结果页面布局
@@ -557,7 +611,7 @@ def search_anime(keyword):
                             
                         href = a_tag.get("href", "")
                         # 从链接中提取ID，格式为/vod/数字.html
-                        anime_id_match = re.search(r'/vod/(\d+)\.html', href)
+                        anime_id_match = VOD_ID_RE.search(href)
                         if not anime_id_match:
                             continue
                             
@@ -609,8 +663,7 @@ def search_anime(keyword):
         # 如果仍未找到结果，尝试正则表达式方法
         if not search_result:
             logger.warning("使用正则表达式解析搜索结果")
-            vod_pattern = r'href="/vod/(\d+)\.html".*?title="([^"]+)"'
-            vod_matches = re.findall(vod_pattern, html_content)
+            vod_matches = VOD_LINK_RE.findall(html_content)
             
             if vod_matches:
                 for anime_id, title in vod_matches:
@@ -625,18 +678,40 @@ def search_anime(keyword):
         
         if search_result:
             logger.info(f"搜索成功，共找到 {len(search_result)} 个结果")
-            return search_result
         else:
             logger.warning(f"未找到任何匹配关键词 '{keyword}' 的动漫")
-            return []
+        return parsed_memo.store(url, result, search_result)
     
     except Exception as e:
         logger.error(f"解析搜索结果出错: {str(e)}")
         logger.error(traceback.format_exc())
         return None
 
-def get_episode_video(anime_id, episode_number, task_id):
-    """获取视频播放地址"""
+def search_anime(keyword, refresh=False):
+    """
+    搜索动漫，优先使用缓存
+    
+    Args:
+        keyword: 搜索关键词
+        refresh: 是否忽略缓存重新搜索
+        
+    Returns:
+        列表，包含搜索结果的动漫信息字典
+    """
+    url = f"/search?q={urllib.parse.quote(keyword)}"
+    return search_cache.get_or_load(normalize_url(url), lambda: _fetch_search_results(keyword), refresh)
+
+def _fetch_episode_video(anime_id, episode_number):
+    """
+    请求播放接口解析剧集的视频播放地址
+    
+    Args:
+        anime_id: 动漫ID
+        episode_number: 剧集号
+        
+    Returns:
+        字典，包含status_code和url
+    """
     try:
        
         api_url = f"/_get_plays/{anime_id}/ep{episode_number}"
@@ -652,7 +727,7 @@ def get_episode_video(anime_id, episode_number, task_id):
        
         if not api_result["response"]:
             logger.error(f"无法获取视频API数据: {api_url}")
-            return {"status_code": 500, "url": None, "local_path": None}
+            return {"status_code": 500, "url": None}
             
         # 解析API响应
         try:
@@ -680,7 +755,7 @@ def get_episode_video(anime_id, episode_number, task_id):
             # 如果没有提取到视频URL，尝试从html_content中提取
             if not video_url and isinstance(api_data, dict) and 'html_content' in api_data:
                 html_content = api_data['html_content']
-                soup = BeautifulSoup(html_content, 'html.parser')
+                soup = make_soup(html_content)
                 
                 # 查找所有的a.swa标签
                 for a_tag in soup.select('a.swa'):
@@ -692,7 +767,7 @@ def get_episode_video(anime_id, episode_number, task_id):
             
             if not video_url:
                 logger.error(f"无法从API响应中提取视频URL")
-                return {"status_code": 200, "url": None, "local_path": None}
+                return {"status_code": 200, "url": None}
             
             # 确保URL是完整的HTTP/HTTPS URL
             if video_url.startswith('//'):
@@ -704,21 +779,14 @@ def get_episode_video(anime_id, episode_number, task_id):
                 video_url = get_base_url() + video_url
             
             logger.info(f"成功获取视频URL: {video_url}")
-            
-            # 下载视频到本地
-            local_path = download_video(video_url, anime_id, episode_number, task_id)
-            if local_path:
-                # 返回本地路径作为播放地址
-                return {"status_code": 200, "url": video_url, "local_path": f"/video/{anime_id}/{os.path.basename(local_path)}"}
-            
-            return {"status_code": 200, "url": video_url, "local_path": None}
+            return {"status_code": 200, "url": video_url}
             
         except Exception as e:
             logger.error(f"解析API响应失败: {str(e)}")
             logger.error(traceback.format_exc())
             
             # 尝试直接从iframe中提取视频URL，作为后备方案
-            soup = BeautifulSoup(page_html, 'html.parser')
+            soup = make_soup(api_result["response"].text)
             
             # 尝试查找视频iframe
             iframe = soup.select_one('iframe[name="p-frame"]')
@@ -728,17 +796,56 @@ def get_episode_video(anime_id, episode_number, task_id):
                     video_url = 'https:' + video_url
                 
                 logger.info(f"从iframe中提取到视频URL: {video_url}")
-                
-                # 下载视频到本地
-                local_path = download_video(video_url, anime_id, episode_number)
-                if local_path:
-                    # 返回本地路径作为播放地址
-                    return {"status_code": 200, "url": video_url, "local_path": f"/video/{anime_id}/{os.path.basename(local_path)}"}
-                
-                return {"status_code": 200, "url": video_url, "local_path": None}
+                return {"status_code": 200, "url": video_url}
             
-            return {"status_code": 500, "url": None, "local_path": None}
+            return {"status_code": 500, "url": None}
             
+    except Exception as e:
+        logger.error(f"获取视频地址失败: {str(e)}")
+        logger.error(traceback.format_exc())
+        return {"status_code": 500, "url": None}
+
+def resolve_episode_video(anime_id, episode_number):
+    """
+    解析剧集的视频播放地址，不下载视频，同一集并发的解析共用一次请求
+    
+    Args:
+        anime_id: 动漫ID
+        episode_number: 剧集号
+        
+    Returns:
+        字典，包含status_code和url
+    """
+    url = f"/_get_plays/{anime_id}/ep{episode_number}"
+    return episode_flight.do(normalize_url(url), lambda: _fetch_episode_video(anime_id, episode_number))
+
+def download_episode_video(video_url, anime_id, episode_number, task_id):
+    """
+    下载已解析出地址的剧集视频
+    
+    Args:
+        video_url: 视频URL
+        anime_id: 动漫ID
+        episode_number: 剧集号
+        task_id: 任务ID
+        
+    Returns:
+        字典，包含status_code、url和local_path
+    """
+    local_path = download_video(video_url, anime_id, episode_number, task_id)
+    if local_path:
+        # 返回本地路径作为播放地址
+        return {"status_code": 200, "url": video_url, "local_path": f"/video/{anime_id}/{os.path.basename(local_path)}"}
+    
+    return {"status_code": 200, "url": video_url, "local_path": None}
+
+def get_episode_video(anime_id, episode_number, task_id):
+    """获取视频播放地址并下载到本地"""
+    try:
+        video_info = resolve_episode_video(anime_id, episode_number)
+        if video_info["status_code"] != 200 or not video_info["url"]:
+            return {**video_info, "local_path": None}
+        return download_episode_video(video_info["url"], anime_id, episode_number, task_id)
     except Exception as e:
         logger.error(f"获取视频地址失败: {str(e)}")
         logger.error(traceback.format_exc())
@@ -1,14 +1,73 @@
 """
 网页解析模块
+
+所有页面通过make_soup解析：优先使用lxml构建文档树，lxml未安装或解析出错时回退到html.parser。
+常用的正则表达式和含:-soup-contains的CSS选择器在模块加载时预编译，避免在循环中重复编译
 """
 import re
 import json
 import logging
+import soupsieve
 from bs4 import BeautifulSoup
 from utils.logging import setup_logger
 
 logger = setup_logger(__name__)
 
+# 预编译的正则表达式
+VOD_ID_RE = re.compile(r'/vod/(\d+)\.html')
+SHOW_ID_RE = re.compile(r'/show/([\w\d]+)(?:\.html)?')
+EPISODE_ID_RE = re.compile(r'ep(\d+)\.html')
+VOD_LINK_RE = re.compile(r'href="/vod/(\d+)\.html".*?title="([^"]+)"')
+PLAY_LINK_RE = re.compile(r'href="(/vod-play/\d+/ep\d+\.html)"[^>]*>([^<]+)<')
+PLAYER_BASE_URL_RE = re.compile(r'PlayerBase\s*=\s*{\s*url\s*:\s*[\'"](.*?)[\'"]')
+PLAYER_DATA_URL_RE = re.compile(r'player_data\s*=\s*{\s*.*?\s*url\s*:\s*[\'"](.*?)[\'"]', re.DOTALL)
+M3U8_SRC_RE = re.compile(r'src="(https?://[^"]+\.m3u8)"')
+PLAYER_DATA_JSON_RE = re.compile(r'var\s+player_data\s*=\s*({.*?});', re.DOTALL)
+URLS_M3U8_RE = re.compile(r'var\s+urls\s*=\s*[\'"](https?://[^"\']+\.m3u8)[\'"]')
+
+# 预编译的CSS选择器，soupsieve每次select都要解析选择器字符串，含:-soup-contains的选择器解析开销较大
+ALIAS_SELECTOR = soupsieve.compile("div.mb-2:-soup-contains('别名')")
+INFO_SPANS_SELECTOR = soupsieve.compile("span:-soup-contains('地区'), span:-soup-contains('年代'), span:-soup-contains('类型')")
+UPDATE_INFO_SELECTOR = soupsieve.compile("div[style*='color: red']:-soup-contains('更新')")
+INTRO_TAB_SELECTOR = soupsieve.compile(".menu-tabs li:-soup-contains('动漫介绍')")
+
+_parser_backend = None
+
+def _get_parser_backend():
+    """
+    确定可用的解析器，只检测一次
+    
+    Returns:
+        字符串，lxml或html.parser
+    """
+    global _parser_backend
+    if _parser_backend is None:
+        try:
+            import lxml  # noqa: F401
+            _parser_backend = 'lxml'
+        except ImportError:
+            logger.warning("lxml未安装，使用html.parser解析网页，可使用'pip install lxml'安装")
+            _parser_backend = 'html.parser'
+    return _parser_backend
+
+def make_soup(html_content):
+    """
+    解析HTML，优先使用lxml，失败时回退到html.parser
+    
+    Args:
+        html_content: 网页HTML内容
+        
+    Returns:
+        BeautifulSoup对象
+    """
+    backend = _get_parser_backend()
+    if backend != 'html.parser':
+        try:
+            return BeautifulSoup(html_content, backend)
+        except Exception as e:
+            logger.warning(f"使用{backend}解析失败，回退到html.parser: {str(e)}")
+    return BeautifulSoup(html_content, 'html.parser')
+
 def extract_video_url(html_content):
     """
     从HTML内容中提取视频URL
@@ -25,28 +84,28 @@ def extract_video_url(html_content):
     try:
         # 尝试使用正则表达式查找视频URL
         # 查找PlayerBase变量中的URL
-        match = re.search(r'PlayerBase\s*=\s*{\s*url\s*:\s*[\'"](.*?)[\'"]', html_content)
+        match = PLAYER_BASE_URL_RE.search(html_content)
         if match:
             return match.group(1)
         
         # 查找player_data变量中的URL
-        match = re.search(r'player_data\s*=\s*{\s*.*?\s*url\s*:\s*[\'"](.*?)[\'"]', html_content, re.DOTALL)
+        match = PLAYER_DATA_URL_RE.search(html_content)
         if match:
             return match.group(1)
         
         # 查找m3u8链接
-        match = re.search(r'src="(https?://[^"]+\.m3u8)"', html_content)
+        match = M3U8_SRC_RE.search(html_content)
         if match:
             return match.group(1)
         
         # 查找iframe中的src
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = make_soup(html_content)
         iframe = soup.find('iframe')
         if iframe and iframe.has_attr('src'):
             return iframe['src']
         
         # 尝试查找JSON数据
-        match = re.search(r'var\s+player_data\s*=\s*({.*?});', html_content, re.DOTALL)
+        match = PLAYER_DATA_JSON_RE.search(html_content)
         if match:
             try:
                 player_data = json.loads(match.group(1))
@@ -75,7 +134,7 @@ def parse_player_page(html_content):
         return None
     
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = make_soup(html_content)
         
         # 获取视频标题
         title_tag = soup.select_one("h1.title")
@@ -112,12 +171,12 @@ def extract_m3u8_url(player_url_content):
     
     try:
         # 尝试查找m3u8链接
-        match = re.search(r'var\s+urls\s*=\s*[\'"](https?://[^"\']+\.m3u8)[\'"]', player_url_content)
+        match = URLS_M3U8_RE.search(player_url_content)
         if match:
             return match.group(1)
         
         # 尝试查找source标签
-        soup = BeautifulSoup(player_url_content, 'html.parser')
+        soup = make_soup(player_url_content)
         source = soup.find('source')
         if source and source.has_attr('src'):
             src = source['src']
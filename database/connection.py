@@ -0,0 +1,74 @@
+"""
+数据库连接管理
+
+每个线程复用一个长期打开的sqlite连接，并统一设置WAL日志、同步级别和忙等待超时
+"""
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from config import DB_PATH, DB_BUSY_TIMEOUT, DB_CACHED_STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+def _connect():
+    """
+    创建并配置新的数据库连接
+    
+    Returns:
+        sqlite3.Connection实例
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT, cached_statements=DB_CACHED_STATEMENTS)
+    # WAL模式下读写互不阻塞，多线程同时读写时不再频繁出现database is locked
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    return conn
+
+def get_connection():
+    """
+    获取当前线程的数据库连接，不存在则创建
+    
+    Returns:
+        sqlite3.Connection实例
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+    return conn
+
+def close_connection():
+    """关闭当前线程的数据库连接"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
+@contextmanager
+def db_cursor(commit=False, row_factory=None):
+    """
+    获取当前线程连接上的游标，出错时回滚未提交的修改
+    
+    Args:
+        commit: 代码块正常结束时是否提交事务
+        row_factory: 游标的行工厂，如sqlite3.Row
+        
+    Yields:
+        sqlite3.Cursor实例
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    if row_factory is not None:
+        cursor.row_factory = row_factory
+    try:
+        yield cursor
+        if commit:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
@@ -0,0 +1,183 @@
+"""
+数据库结构迁移
+
+用sqlite的user_version记录当前结构版本，按顺序执行尚未应用的迁移，每个迁移在单独的事务中完成
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+def check_and_add_column(cursor, table, column, type_def):
+    """
+    检查表是否有指定列，如果没有则添加
+    
+    Args:
+        cursor: 数据库游标
+        table: 表名
+        column: 列名
+        type_def: 列类型定义
+        
+    Returns:
+        布尔值，表示是否添加了新列
+    """
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = [col[1] for col in cursor.fetchall()]
+    
+    if column not in columns:
+        logger.info(f"为表 {table} 添加列 {column}")
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {type_def}")
+        return True
+    return False
+
+def _add_legacy_columns(cursor):
+    """补齐早期版本数据库缺少的列"""
+    check_and_add_column(cursor, 'task_results', 'download_progress', 'INTEGER DEFAULT 0')
+    check_and_add_column(cursor, 'task_results', 'file_size', 'INTEGER DEFAULT 0')
+    check_and_add_column(cursor, 'task_results', 'file_path', 'TEXT')
+    check_and_add_column(cursor, 'task_results', 'cache_url', 'TEXT')
+    check_and_add_column(cursor, 'tasks', 'last_run', 'INTEGER')
+
+def _add_query_indexes(cursor):
+    """为常用查询添加索引，并保证每个任务的每一集只有一条结果记录"""
+    # 清理重复的剧集结果，只保留最新的一条
+    cursor.execute("""
+    DELETE FROM task_results
+    WHERE id NOT IN (
+        SELECT MAX(id) FROM task_results GROUP BY task_id, episode_number
+    )
+    """)
+    if cursor.rowcount > 0:
+        logger.info(f"清理重复的剧集结果记录: {cursor.rowcount} 条")
+    
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_task_results_task_episode
+    ON task_results (task_id, episode_number)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_task_results_completed
+    ON task_results (task_id, episode_number)
+    WHERE download_progress = 100
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_animes_site_id ON animes (site_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_episodes_anime_episode ON episodes (anime_id, episode_number)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status)")
+
+def _add_task_listing_indexes(cursor):
+    """为任务列表的排序和按状态分页添加索引"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks (updated_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_updated_at ON tasks (status, updated_at)")
+
+def _add_schedule_index(cursor):
+    """为调度器启动时读取周期任务计划添加覆盖索引"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_periodic_next_run ON tasks (is_periodic, next_run)")
+
+def _add_jitter_window(cursor):
+    """添加周期任务的随机延后窗口列"""
+    check_and_add_column(cursor, 'tasks', 'jitter_window', 'INTEGER')
+
+def _add_jobs_table(cursor):
+    """添加worker进程使用的任务执行队列"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_id INTEGER NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 10,
+        status TEXT NOT NULL DEFAULT 'queued',
+        worker TEXT,
+        created_at INTEGER,
+        started_at INTEGER,
+        finished_at INTEGER
+    )
+    """)
+    # 同一任务最多只有一个排队或执行中的作业
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_task
+    ON jobs (task_id) WHERE status IN ('queued', 'running')
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_priority ON jobs (status, priority, id)")
+
+def _add_lease_columns(cursor):
+    """添加多节点共享任务表所需的租约列"""
+    for table in ('tasks', 'jobs'):
+        check_and_add_column(cursor, table, 'lease_owner', 'TEXT')
+        check_and_add_column(cursor, table, 'lease_expires', 'INTEGER')
+        check_and_add_column(cursor, table, 'heartbeat_at', 'INTEGER')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_lease_owner ON tasks (lease_owner)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_lease_expires ON tasks (lease_expires)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lease_owner ON jobs (lease_owner)")
+
+def _add_page_cache_table(cursor):
+    """添加页面解析结果的持久化缓存表"""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS page_cache (
+        namespace TEXT NOT NULL,
+        cache_key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        stored_at REAL NOT NULL,
+        PRIMARY KEY (namespace, cache_key)
+    )
+    """)
+
+def _drop_redundant_completed_index(cursor):
+    """删除与唯一索引列相同的已完成剧集部分索引，查询已由唯一索引覆盖"""
+    cursor.execute("DROP INDEX IF EXISTS idx_task_results_completed")
+
+# 迁移列表: (版本号, 说明, 迁移函数)，只能在末尾追加
+MIGRATIONS = [
+    (1, '补齐早期版本缺少的列', _add_legacy_columns),
+    (2, '添加查询索引和剧集结果唯一约束', _add_query_indexes),
+    (3, '添加任务列表分页索引', _add_task_listing_indexes),
+    (4, '添加周期任务调度索引', _add_schedule_index),
+    (5, '添加周期任务随机延后窗口', _add_jitter_window),
+    (6, '添加任务执行队列表', _add_jobs_table),
+    (7, '添加任务和作业的租约列', _add_lease_columns),
+    (8, '添加页面缓存表', _add_page_cache_table),
+    (9, '删除多余的已完成剧集索引', _drop_redundant_completed_index),
+]
+
+def get_schema_version(conn):
+    """
+    获取数据库当前的结构版本
+    
+    Args:
+        conn: 数据库连接
+        
+    Returns:
+        整数，结构版本号
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations(conn):
+    """
+    执行所有尚未应用的迁移
+    
+    Args:
+        conn: 数据库连接
+        
+    Returns:
+        整数，迁移后的结构版本号
+    """
+    if conn.in_transaction:
+        conn.commit()
+    
+    version = get_schema_version(conn)
+    for target, description, migrate in MIGRATIONS:
+        if target <= version:
+            continue
+        
+        logger.info(f"执行数据库迁移 {target}: {description}")
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            migrate(cursor)
+            cursor.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"数据库迁移 {target} 失败")
+            raise
+        finally:
+            cursor.close()
+        version = target
+    
+    return version
@@ -1,10 +1,9 @@
 """
 数据库模型定义
 """
-import sqlite3
-import time
-from config import DB_PATH
 import logging
+from database.connection import get_connection
+from database.migrations import run_migrations
 
 logger = logging.getLogger(__name__)
 
@@ -12,7 +11,7 @@ def init_db():
     """
     初始化数据库表结构
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     try:
         cursor = conn.cursor()
         # 创建动漫表
@@ -78,41 +77,12 @@ def init_db():
         )
         ''')
         
-        # 检查是否需要更新表结构（添加新字段）
-        check_and_add_column(cursor, 'task_results', 'download_progress', 'INTEGER DEFAULT 0')
-        check_and_add_column(cursor, 'task_results', 'file_size', 'INTEGER DEFAULT 0')
-        check_and_add_column(cursor, 'task_results', 'file_path', 'TEXT')
-        check_and_add_column(cursor, 'task_results', 'cache_url', 'TEXT')
-        
-        # 检查task表是否需要更新（添加last_run字段）
-        check_and_add_column(cursor, 'tasks', 'last_run', 'INTEGER')
-        
         conn.commit()
+        
+        # 按版本执行表结构迁移（新增列、索引等）
+        version = run_migrations(conn)
+        logger.info(f"数据库结构版本: {version}")
         logger.info("数据库初始化完成")
     except Exception as e:
         logger.error(f"初始化数据库失败: {str(e)}")
         conn.rollback()
-    finally:
-        conn.close()
-
-def check_and_add_column(cursor, table, column, type_def):
-    """
-    检查表是否有指定列，如果没有则添加
-    
-    Args:
-        cursor: 数据库游标
-        table: 表名
-        column: 列名
-        type_def: 列类型定义
-        
-    Returns:
-        布尔值，表示是否添加了新列
-    """
-    cursor.execute(f"PRAGMA table_info({table})")
-    columns = [col[1] for col in cursor.fetchall()]
-    
-    if column not in columns:
-        logger.info(f"为表 {table} 添加列 {column}")
-        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {type_def}")
-        return True
-    return False 
\ No newline at end of file
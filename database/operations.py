@@ -3,8 +3,10 @@
 """
 import sqlite3
 import time
+import random
 import logging
-from config import DB_PATH
+from config import PERIODIC_JITTER_WINDOW
+from database.connection import db_cursor
 from datetime import datetime, timedelta,timezone
 logger = logging.getLogger(__name__)
 
@@ -23,38 +25,34 @@ def save_anime(site_id, title, description, cover_url, total_episodes):
         整数，数据库中的动漫ID
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with db_cursor(commit=True) as cursor:
+            current_time = int(time.time())
         
-        current_time = int(time.time())
+            # 检查是否已存在
+            cursor.execute("SELECT id FROM animes WHERE site_id = ?", (site_id,))
+            result = cursor.fetchone()
         
-        # 检查是否已存在
-        cursor.execute("SELECT id FROM animes WHERE site_id = ?", (site_id,))
-        result = cursor.fetchone()
-        
-        if result:
-            # 更新现有记录
-            cursor.execute("""
-            UPDATE animes SET 
-                title = ?, 
-                description = ?, 
-                cover_url = ?, 
-                total_episodes = ?,
-                updated_at = ?
-            WHERE site_id = ?
-            """, (title, description, cover_url, total_episodes, current_time, site_id))
-            anime_id = result[0]
-        else:
-            # 插入新记录
-            cursor.execute("""
-            INSERT INTO animes (site_id, title, description, cover_url, total_episodes, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (site_id, title, description, cover_url, total_episodes, current_time, current_time))
-            anime_id = cursor.lastrowid
+            if result:
+                # 更新现有记录
+                cursor.execute("""
+                UPDATE animes SET 
+                    title = ?, 
+                    description = ?, 
+                    cover_url = ?, 
+                    total_episodes = ?,
+                    updated_at = ?
+                WHERE site_id = ?
+                """, (title, description, cover_url, total_episodes, current_time, site_id))
+                anime_id = result[0]
+            else:
+                # 插入新记录
+                cursor.execute("""
+                INSERT INTO animes (site_id, title, description, cover_url, total_episodes, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (site_id, title, description, cover_url, total_episodes, current_time, current_time))
+                anime_id = cursor.lastrowid
         
-        conn.commit()
-        conn.close()
-        return anime_id
+            return anime_id
     except Exception as e:
         logger.error(f"保存动漫信息失败: {str(e)}")
         return None
@@ -73,44 +71,80 @@ def save_episode(anime_db_id, episode_number, title, video_url):
         整数，数据库中的剧集ID
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with db_cursor(commit=True) as cursor:
+            current_time = int(time.time())
         
-        current_time = int(time.time())
-        
-        # 检查是否已存在
-        cursor.execute("""
-        SELECT id FROM episodes 
-        WHERE anime_id = ? AND episode_number = ?
-        """, (anime_db_id, episode_number))
-        result = cursor.fetchone()
-        
-        if result:
-            # 更新现有记录
+            # 检查是否已存在
             cursor.execute("""
-            UPDATE episodes SET 
-                title = ?, 
-                video_url = ?,
-                updated_at = ?
+            SELECT id FROM episodes 
             WHERE anime_id = ? AND episode_number = ?
-            """, (title, video_url, current_time, anime_db_id, episode_number))
-            episode_id = result[0]
-        else:
-            # 插入新记录
-            cursor.execute("""
-            INSERT INTO episodes (anime_id, episode_number, title, video_url, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """, (anime_db_id, episode_number, title, video_url, current_time, current_time))
-            episode_id = cursor.lastrowid
+            """, (anime_db_id, episode_number))
+            result = cursor.fetchone()
+        
+            if result:
+                # 更新现有记录
+                cursor.execute("""
+                UPDATE episodes SET 
+                    title = ?, 
+                    video_url = ?,
+                    updated_at = ?
+                WHERE anime_id = ? AND episode_number = ?
+                """, (title, video_url, current_time, anime_db_id, episode_number))
+                episode_id = result[0]
+            else:
+                # 插入新记录
+                cursor.execute("""
+                INSERT INTO episodes (anime_id, episode_number, title, video_url, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """, (anime_db_id, episode_number, title, video_url, current_time, current_time))
+                episode_id = cursor.lastrowid
         
-        conn.commit()
-        conn.close()
-        return episode_id
+            return episode_id
     except Exception as e:
         logger.error(f"保存剧集信息失败: {str(e)}")
         return None
 
-def create_task(anime_id, start_episode, end_episode=None, is_periodic=False, daily_update_time=0):
+def compute_next_run(daily_update_time, now=None, grace=600, jitter_window=0):
+    """
+    计算周期任务的下次运行时间(北京时间每日固定时刻加随机延后)
+    
+    Args:
+        daily_update_time: 每日更新时间(秒)
+        now: 当前时间戳，默认为当前时间
+        grace: 今天的更新时间过去不超过该秒数时仍安排在今天
+        jitter_window: 在更新时间之后随机延后的最大秒数
+        
+    Returns:
+        整数，下次运行时间戳
+    """
+    if now is None:
+        now = int(time.time())
+    tz_beijing = timezone(timedelta(hours=8))
+    zero_time = datetime.fromtimestamp(now, tz_beijing).replace(hour=0, minute=0, second=0, microsecond=0)
+    today_update_time = int((zero_time + timedelta(seconds=daily_update_time or 0)).timestamp())
+    
+    #今天时间已经过去了,那么制定明天计划,否则制定今天计划
+    if now >= today_update_time + grace:
+        today_update_time += 86400
+    if jitter_window and jitter_window > 0:
+        today_update_time += random.randint(0, int(jitter_window))
+    return today_update_time
+
+def get_jitter_window(jitter_window):
+    """
+    获取任务实际使用的随机延后窗口
+    
+    Args:
+        jitter_window: 任务设置的窗口，None表示使用默认配置
+        
+    Returns:
+        整数，窗口秒数
+    """
+    if jitter_window is None:
+        return PERIODIC_JITTER_WINDOW
+    return max(0, int(jitter_window))
+
+def create_task(anime_id, start_episode, end_episode=None, is_periodic=False, daily_update_time=0, jitter_window=None):
     """
     创建缓存任务
     
@@ -120,44 +154,35 @@ def create_task(anime_id, start_episode, end_episode=None, is_periodic=False, da
         end_episode: 结束集数
         is_periodic: 是否周期性任务
         daily_update_time: 每日更新时间(秒)
+        jitter_window: 每次运行随机延后的最大秒数，None表示使用默认配置
         
     Returns:
         整数，任务ID
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        current_time = int(time.time())
-        tz_beijing = timezone(timedelta(hours=8))
-        zero_time = datetime.now(tz_beijing).replace(hour=0, minute=0, second=0, microsecond=0)
-        today_update_time = int((zero_time + timedelta(seconds=daily_update_time)).timestamp())
-        
-        if(current_time >= today_update_time + 600):
-            next_run = today_update_time + 86400
-        else:
-            next_run = today_update_time
-        
-        cursor.execute("""
-        INSERT INTO tasks 
-        (anime_id, start_episode, end_episode, is_periodic, daily_update_time, status, next_run, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            anime_id, 
-            start_episode, 
-            end_episode, 
-            1 if is_periodic else 0, 
-            daily_update_time,
-            'pending',
-            next_run if is_periodic else None,
-            current_time,
-            current_time
-        ))
-        
-        task_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return task_id
+        with db_cursor(commit=True) as cursor:
+            current_time = int(time.time())
+            next_run = compute_next_run(daily_update_time, current_time, jitter_window=get_jitter_window(jitter_window))
+        
+            cursor.execute("""
+            INSERT INTO tasks 
+            (anime_id, start_episode, end_episode, is_periodic, daily_update_time, jitter_window, status, next_run, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                anime_id, 
+                start_episode, 
+                end_episode, 
+                1 if is_periodic else 0, 
+                daily_update_time,
+                jitter_window,
+                'pending',
+                next_run if is_periodic else None,
+                current_time,
+                current_time
+            ))
+        
+            task_id = cursor.lastrowid
+            return task_id
     except Exception as e:
         logger.error(f"创建任务失败: {str(e)}")
         return None
@@ -170,28 +195,93 @@ def get_tasks():
         列表，包含所有任务
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM tasks ORDER BY updated_at DESC")
-        tasks = cursor.fetchall()
-        
-        # 将tuple转换为dict
-        column_names = [description[0] for description in cursor.description]
-        result = []
-        for task in tasks:
-            result.append(dict(zip(column_names, task)))
-        #如果动漫处于更新状态，则将动漫task_results表中所有task_id相同的记录的下载进度添加到result中
-        for task in result:
-            if task['status'] == 'updating':
-                task['download_progress'] = get_download_progress(task['id'], task['episode_number'])
-        
-        conn.close()
-        return result
+        with db_cursor() as cursor:
+            cursor.execute("SELECT * FROM tasks ORDER BY updated_at DESC")
+            tasks = cursor.fetchall()
+        
+            # 将tuple转换为dict
+            column_names = [description[0] for description in cursor.description]
+            result = []
+            for task in tasks:
+                result.append(dict(zip(column_names, task)))
+            #如果动漫处于更新状态，则将动漫task_results表中所有task_id相同的记录的下载进度添加到result中
+            for task in result:
+                if task['status'] == 'updating':
+                    task['download_progress'] = get_download_progress(task['id'], task['episode_number'])
+        
+            return result
     except Exception as e:
         logger.error(f"获取任务列表失败: {str(e)}")
         return []
 
+# 任务列表查询：先分页再关联动漫标题并汇总剧集下载结果，避免逐个任务查询
+_TASK_SUMMARY_SQL = """
+WITH page AS (
+    SELECT * FROM tasks
+    {where}
+    ORDER BY updated_at DESC
+    LIMIT ? OFFSET ?
+)
+SELECT 
+    page.*,
+    a.title AS anime_title,
+    COUNT(tr.id) AS result_count,
+    COALESCE(SUM(tr.download_progress = 100), 0) AS completed_count,
+    COALESCE(SUM(tr.download_progress = -1), 0) AS failed_count
+FROM page
+LEFT JOIN animes a ON a.site_id = page.anime_id
+LEFT JOIN task_results tr ON tr.task_id = page.id
+GROUP BY page.id
+ORDER BY page.updated_at DESC
+"""
+
+def get_tasks_page(limit=None, offset=0, status=None):
+    """
+    分页获取任务列表，附带动漫标题和剧集下载统计
+    
+    Args:
+        limit: 每页数量，None表示不分页
+        offset: 偏移量
+        status: 按任务状态过滤，None表示全部
+        
+    Returns:
+        元组(任务列表, 符合条件的任务总数)
+    """
+    try:
+        with db_cursor(row_factory=sqlite3.Row) as cursor:
+            where = "WHERE status = ?" if status else ""
+            params = (status,) if status else ()
+            
+            cursor.execute(f"SELECT COUNT(*) FROM tasks {where}", params)
+            total = cursor.fetchone()[0]
+            
+            cursor.execute(_TASK_SUMMARY_SQL.format(where=where), params + (-1 if limit is None else limit, offset))
+            tasks = [dict(row) for row in cursor.fetchall()]
+            
+            return tasks, total
+    except Exception as e:
+        logger.error(f"分页获取任务列表失败: {str(e)}")
+        return [], 0
+
+def get_task_summary(task_id):
+    """
+    获取任务详情，附带动漫标题和剧集下载统计
+    
+    Args:
+        task_id: 任务ID
+        
+    Returns:
+        字典，任务详情，不存在时返回None
+    """
+    try:
+        with db_cursor(row_factory=sqlite3.Row) as cursor:
+            cursor.execute(_TASK_SUMMARY_SQL.format(where="WHERE id = ?"), (task_id, 1, 0))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+    except Exception as e:
+        logger.error(f"获取任务详情失败: {str(e)}")
+        return None
+
 def get_task(task_id):
     """
     获取任务详情
@@ -203,22 +293,18 @@ def get_task(task_id):
         字典，任务详情
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-        task = cursor.fetchone()
+        with db_cursor() as cursor:
+            cursor.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
+            task = cursor.fetchone()
         
-        if not task:
-            conn.close()
-            return None
+            if not task:
+                return None
         
-        # 将tuple转换为dict
-        column_names = [description[0] for description in cursor.description]
-        result = dict(zip(column_names, task))
+            # 将tuple转换为dict
+            column_names = [description[0] for description in cursor.description]
+            result = dict(zip(column_names, task))
         
-        conn.close()
-        return result
+            return result
     except Exception as e:
         logger.error(f"获取任务详情失败: {str(e)}")
         return None
@@ -235,21 +321,17 @@ def update_task_status(task_id, status):
         布尔值，是否成功
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        current_time = int(time.time())
+        with db_cursor(commit=True) as cursor:
+            current_time = int(time.time())
         
-        cursor.execute("""
-        UPDATE tasks SET 
-            status = ?, 
-            updated_at = ?
-        WHERE id = ?
-        """, (status, current_time, task_id))
+            cursor.execute("""
+            UPDATE tasks SET 
+                status = ?, 
+                updated_at = ?
+            WHERE id = ?
+            """, (status, current_time, task_id))
         
-        conn.commit()
-        conn.close()
-        return True
+            return True
     except Exception as e:
         logger.error(f"更新任务状态失败: {str(e)}")
         return False
@@ -266,25 +348,40 @@ def update_task_next_run(task_id, next_run):
         布尔值，是否成功
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with db_cursor(commit=True) as cursor:
+            current_time = int(time.time())
         
-        current_time = int(time.time())
-        
-        cursor.execute("""
-        UPDATE tasks SET 
-            next_run = ?, 
-            updated_at = ?
-        WHERE id = ?
-        """, (next_run, current_time, task_id))
+            cursor.execute("""
+            UPDATE tasks SET 
+                next_run = ?, 
+                updated_at = ?
+            WHERE id = ?
+            """, (next_run, current_time, task_id))
         
-        conn.commit()
-        conn.close()
-        return True
+            return True
     except Exception as e:
         logger.error(f"更新任务下次运行时间失败: {str(e)}")
         return False
 
+def get_periodic_schedule():
+    """
+    获取所有周期任务的下次运行时间，只读取索引覆盖的列
+    
+    Returns:
+        列表，包含(任务ID, 下次运行时间戳)
+    """
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("""
+            SELECT id, next_run FROM tasks
+            WHERE is_periodic = 1 AND next_run IS NOT NULL
+            ORDER BY next_run
+            """)
+            return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"获取周期任务计划失败: {str(e)}")
+        return []
+
 def update_download_progress(task_id, episode_number, progress, file_path=None, file_size=None):
     """
     更新下载进度
@@ -300,64 +397,34 @@ def update_download_progress(task_id, episode_number, progress, file_path=None,
         布尔值，是否成功
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        print(f"更新下载进度: task_id={task_id}, episode_number={episode_number}, progress={progress}, file_path={file_path}, file_size={file_size}")
-        
-        current_time = int(time.time())
-        
-        # 检查是否存在记录
-        cursor.execute("""
-        SELECT id FROM task_results
-        WHERE task_id = ? AND episode_number = ?
-        """, (task_id, episode_number))
+        with db_cursor(commit=True) as cursor:
+            print(f"更新下载进度: task_id={task_id}, episode_number={episode_number}, progress={progress}, file_path={file_path}, file_size={file_size}")
         
-        result = cursor.fetchone()
+            current_time = int(time.time())
         
-        if result:
-            # 下载完成时更新file_path和file_size
+            # 下载完成时写入file_path、file_size和缓存URL，普通进度更新只修改进度
             if progress == 100 and file_path:
+                status = 'completed'
                 # 生成完整的缓存URL
-                cache_url = f"/video/{file_path}" if file_path else None
-                
-                cursor.execute("""
-                UPDATE task_results SET 
-                    download_progress = ?,
-                    file_path = ?,
-                    file_size = ?,
-                    cache_url = ?,
-                    updated_at = ?
-                WHERE task_id = ? AND episode_number = ?
-                """, (progress, file_path, file_size, cache_url, current_time, task_id, episode_number))
+                cache_url = f"/video/{file_path}"
             else:
-                # 普通进度更新
-                cursor.execute("""
-                UPDATE task_results SET 
-                    download_progress = ?,
-                    updated_at = ?
-                WHERE task_id = ? AND episode_number = ?
-                """, (progress, current_time, task_id, episode_number))
-        else:
-            # 创建新记录
-            if progress == 100 and file_path:
-                # 生成完整的缓存URL
-                cache_url = f"/video/{file_path}" if file_path else None
-                
-                cursor.execute("""
-                INSERT INTO task_results 
-                (task_id, episode_number, status, download_progress, file_path, file_size, cache_url, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (task_id, episode_number, 'completed', progress, file_path, file_size, cache_url, current_time, current_time))
-            else:
-                cursor.execute("""
-                INSERT INTO task_results 
-                (task_id, episode_number, status, download_progress, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """, (task_id, episode_number, 'downloading', progress, current_time, current_time))
+                status = 'downloading'
+                file_path = file_size = cache_url = None
         
-        conn.commit()
-        conn.close()
-        return True
+            # 依赖(task_id, episode_number)唯一索引，一条语句完成插入或更新
+            cursor.execute("""
+            INSERT INTO task_results 
+            (task_id, episode_number, status, download_progress, file_path, file_size, cache_url, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(task_id, episode_number) DO UPDATE SET 
+                download_progress = excluded.download_progress,
+                file_path = COALESCE(excluded.file_path, task_results.file_path),
+                file_size = COALESCE(excluded.file_size, task_results.file_size),
+                cache_url = COALESCE(excluded.cache_url, task_results.cache_url),
+                updated_at = excluded.updated_at
+            """, (task_id, episode_number, status, progress, file_path, file_size, cache_url, current_time, current_time))
+        
+            return True
     except Exception as e:
         logger.error(f"更新下载进度失败: {str(e)}")
         return False
@@ -373,22 +440,18 @@ def get_anime_by_site_id(site_id):
         字典，动漫信息
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        with db_cursor() as cursor:
+            cursor.execute("SELECT * FROM animes WHERE site_id = ?", (site_id,))
+            anime = cursor.fetchone()
         
-        cursor.execute("SELECT * FROM animes WHERE site_id = ?", (site_id,))
-        anime = cursor.fetchone()
+            if not anime:
+                return None
         
-        if not anime:
-            conn.close()
-            return None
+            # 将tuple转换为dict
+            column_names = [description[0] for description in cursor.description]
+            result = dict(zip(column_names, anime))
         
-        # 将tuple转换为dict
-        column_names = [description[0] for description in cursor.description]
-        result = dict(zip(column_names, anime))
-        
-        conn.close()
-        return result
+            return result
     except Exception as e:
         logger.error(f"获取动漫信息失败: {str(e)}")
         return None
@@ -404,18 +467,14 @@ def delete_task(task_id):
         布尔值，是否成功
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # 删除任务相关的结果记录
-        cursor.execute("DELETE FROM task_results WHERE task_id = ?", (task_id,))
+        with db_cursor(commit=True) as cursor:
+            # 删除任务相关的结果记录
+            cursor.execute("DELETE FROM task_results WHERE task_id = ?", (task_id,))
         
-        # 删除任务
-        cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+            # 删除任务
+            cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
         
-        conn.commit()
-        conn.close()
-        return True
+            return True
     except Exception as e:
         logger.error(f"删除任务失败: {str(e)}")
         return False
@@ -432,20 +491,17 @@ def get_download_progress(task_id, episode_number):
         整数，下载进度(0-100)，None表示没有记录
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-        SELECT download_progress FROM task_results
-        WHERE task_id = ? AND episode_number = ?
-        """, (task_id, episode_number))
+        with db_cursor() as cursor:
+            cursor.execute("""
+            SELECT download_progress FROM task_results
+            WHERE task_id = ? AND episode_number = ?
+            """, (task_id, episode_number))
         
-        result = cursor.fetchone()
-        conn.close()
+            result = cursor.fetchone()
         
-        if result:
-            return result[0]
-        return None
+            if result:
+                return result[0]
+            return None
     except Exception as e:
         logger.error(f"获取下载进度失败: {str(e)}")
         return None
@@ -463,38 +519,19 @@ def update_download_size(task_id, episode_number, file_size):
         布尔值，是否成功
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        current_time = int(time.time())
+        with db_cursor(commit=True) as cursor:
+            current_time = int(time.time())
         
-        # 检查是否存在记录
-        cursor.execute("""
-        SELECT id FROM task_results
-        WHERE task_id = ? AND episode_number = ?
-        """, (task_id, episode_number))
-        
-        result = cursor.fetchone()
-        
-        if result:
-            # 更新已有记录
-            cursor.execute("""
-            UPDATE task_results SET 
-                file_size = ?,
-                updated_at = ?
-            WHERE task_id = ? AND episode_number = ?
-            """, (file_size, current_time, task_id, episode_number))
-        else:
-            # 创建新记录
             cursor.execute("""
             INSERT INTO task_results 
             (task_id, episode_number, status, download_progress, file_size, created_at, updated_at)
             VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(task_id, episode_number) DO UPDATE SET 
+                file_size = excluded.file_size,
+                updated_at = excluded.updated_at
             """, (task_id, episode_number, 'downloading', 0, file_size, current_time, current_time))
         
-        conn.commit()
-        conn.close()
-        return True
+            return True
     except Exception as e:
         logger.error(f"更新文件大小失败: {str(e)}")
         return False
@@ -510,28 +547,24 @@ def get_task_by_anime_id(anime_id):
         字典，最新的任务信息
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-        SELECT * FROM tasks 
-        WHERE anime_id = ? 
-        ORDER BY created_at DESC 
-        LIMIT 1
-        """, (anime_id,))
+        with db_cursor() as cursor:
+            cursor.execute("""
+            SELECT * FROM tasks 
+            WHERE anime_id = ? 
+            ORDER BY created_at DESC 
+            LIMIT 1
+            """, (anime_id,))
         
-        task = cursor.fetchone()
+            task = cursor.fetchone()
         
-        if not task:
-            conn.close()
-            return None
+            if not task:
+                return None
         
-        # 将tuple转换为dict
-        column_names = [description[0] for description in cursor.description]
-        result = dict(zip(column_names, task))
+            # 将tuple转换为dict
+            column_names = [description[0] for description in cursor.description]
+            result = dict(zip(column_names, task))
         
-        conn.close()
-        return result
+            return result
     except Exception as e:
         logger.error(f"根据动漫ID获取任务失败: {str(e)}")
         return None
@@ -548,19 +581,15 @@ def update_task_last_run(task_id, timestamp):
         布尔值，是否成功
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-        UPDATE tasks SET 
-            last_run = ?,
-            updated_at = ?
-        WHERE id = ?
-        """, (timestamp, int(time.time()), task_id))
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("""
+            UPDATE tasks SET 
+                last_run = ?,
+                updated_at = ?
+            WHERE id = ?
+            """, (timestamp, int(time.time()), task_id))
         
-        conn.commit()
-        conn.close()
-        return True
+            return True
     except Exception as e:
         logger.error(f"更新任务最后执行时间失败: {str(e)}")
         return False
@@ -573,55 +602,51 @@ def get_downloaded_videos():
         列表，包含已下载的视频信息
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row  # 使用Row工厂，可以按名称访问列
-        cursor = conn.cursor()
-        
-        # 查询已下载的视频
-        # 关联task_results、animes和tasks表，获取完整的视频信息
-        cursor.execute("""
-        SELECT 
-            tr.id, tr.task_id, tr.episode_number, tr.download_progress, tr.file_path, tr.file_size, tr.cache_url,
-            t.anime_id, a.title as anime_title
-        FROM 
-            task_results tr
-        JOIN 
-            tasks t ON tr.task_id = t.id
-        JOIN 
-            animes a ON t.anime_id = a.site_id
-        WHERE 
-            tr.download_progress = 100 AND tr.file_path IS NOT NULL
-        ORDER BY 
-            a.title, tr.episode_number
-        """)
-        
-        results = cursor.fetchall()
-        
-        # 将结果转换为字典列表
-        videos = []
-        for row in results:
-            # 生成正确的缓存URL
-            cache_url = None
-            if row['file_path']:
-                # 如果数据库中已有完整URL，则使用它
-                if row['cache_url'] and row['cache_url'].startswith('/video/'):
-                    cache_url = row['cache_url']
-                else:
-                    # 否则根据file_path构建URL
-                    cache_url = f"/video/{row['file_path']}"
+        with db_cursor(row_factory=sqlite3.Row) as cursor:
+            # 查询已下载的视频
+            # 关联task_results、animes和tasks表，获取完整的视频信息
+            cursor.execute("""
+            SELECT 
+                tr.id, tr.task_id, tr.episode_number, tr.download_progress, tr.file_path, tr.file_size, tr.cache_url,
+                t.anime_id, a.title as anime_title
+            FROM 
+                task_results tr
+            JOIN 
+                tasks t ON tr.task_id = t.id
+            JOIN 
+                animes a ON t.anime_id = a.site_id
+            WHERE 
+                tr.download_progress = 100 AND tr.file_path IS NOT NULL
+            ORDER BY 
+                a.title, tr.episode_number
+            """)
+        
+            results = cursor.fetchall()
+        
+            # 将结果转换为字典列表
+            videos = []
+            for row in results:
+                # 生成正确的缓存URL
+                cache_url = None
+                if row['file_path']:
+                    # 如果数据库中已有完整URL，则使用它
+                    if row['cache_url'] and row['cache_url'].startswith('/video/'):
+                        cache_url = row['cache_url']
+                    else:
+                        # 否则根据file_path构建URL
+                        cache_url = f"/video/{row['file_path']}"
             
-            videos.append({
-                'id': row['id'],
-                'task_id': row['task_id'],
-                'anime_id': row['anime_id'],
-                'anime_title': row['anime_title'],
-                'episode_number': row['episode_number'],
-                'cache_url': cache_url,
-                'file_size': row['file_size']
-            })
-        
-        conn.close()
-        return videos
+                videos.append({
+                    'id': row['id'],
+                    'task_id': row['task_id'],
+                    'anime_id': row['anime_id'],
+                    'anime_title': row['anime_title'],
+                    'episode_number': row['episode_number'],
+                    'cache_url': cache_url,
+                    'file_size': row['file_size']
+                })
+        
+            return videos
     except Exception as e:
         logger.error(f"获取已下载视频列表失败: {str(e)}")
         logger.exception(e)
@@ -638,27 +663,369 @@ def get_tasks_by_status(status):
         列表，任务列表
     """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-        SELECT * FROM tasks 
-        WHERE status = ?
-        ORDER BY created_at DESC
-        """, (status,))
+        with db_cursor() as cursor:
+            cursor.execute("""
+            SELECT * FROM tasks 
+            WHERE status = ?
+            ORDER BY created_at DESC
+            """, (status,))
         
-        tasks = cursor.fetchall()
+            tasks = cursor.fetchall()
         
-        if not tasks:
-            conn.close()
-            return []
+            if not tasks:
+                return []
             
-        # 将tuple转换为dict
-        column_names = [description[0] for description in cursor.description]
-        result = [dict(zip(column_names, task)) for task in tasks]
+            # 将tuple转换为dict
+            column_names = [description[0] for description in cursor.description]
+            result = [dict(zip(column_names, task)) for task in tasks]
         
-        conn.close()
-        return result
+            return result
     except Exception as e:
         logger.error(f"获取任务列表失败: {str(e)}")
-        return [] 
\ No newline at end of file
+        return [] 
+
+def enqueue_job(task_id, priority):
+    """
+    把任务加入执行队列，由worker进程执行
+    
+    Args:
+        task_id: 任务ID
+        priority: 优先级，数值越小越先执行
+        
+    Returns:
+        整数，作业ID；任务已在队列中时只提高其优先级并返回None
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("""
+            INSERT OR IGNORE INTO jobs (task_id, priority, status, created_at)
+            VALUES (?, ?, 'queued', ?)
+            """, (task_id, priority, int(time.time())))
+            if cursor.rowcount:
+                return cursor.lastrowid
+            
+            cursor.execute("""
+            UPDATE jobs SET priority = MIN(priority, ?)
+            WHERE task_id = ? AND status = 'queued'
+            """, (priority, task_id))
+            return None
+    except Exception as e:
+        logger.error(f"任务加入执行队列失败: {str(e)}")
+        return None
+
+def update_job_priority(task_id, priority):
+    """
+    提高排队中作业的优先级
+    
+    Args:
+        task_id: 任务ID
+        priority: 新的优先级
+        
+    Returns:
+        布尔值，任务是否有排队中的作业
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("""
+            UPDATE jobs SET priority = MIN(priority, ?)
+            WHERE task_id = ? AND status = 'queued'
+            """, (priority, task_id))
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"更新作业优先级失败: {str(e)}")
+        return False
+
+def claim_job(worker, lease_duration):
+    """
+    领取优先级最高的排队作业，或租约已过期的执行中作业(原worker已失效)，
+    多个进程或节点同时领取时不会重复
+    
+    Args:
+        worker: worker标识，同时作为租约持有者
+        lease_duration: 租约有效期(秒)
+        
+    Returns:
+        字典，作业信息；没有可领取的作业时返回None
+    """
+    try:
+        with db_cursor(commit=True, row_factory=sqlite3.Row) as cursor:
+            current_time = int(time.time())
+            # 立即获取写锁，保证查询和更新之间不会被其他进程领取
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+            SELECT * FROM jobs
+            WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?)
+            ORDER BY priority, id
+            LIMIT 1
+            """, (current_time,))
+            job = cursor.fetchone()
+            if not job:
+                return None
+            
+            if job['status'] == 'running':
+                logger.warning(f"回收租约过期的作业 {job['id']}, 原worker: {job['lease_owner']}")
+            
+            cursor.execute("""
+            UPDATE jobs SET 
+                status = 'running', 
+                worker = ?, 
+                started_at = ?,
+                lease_owner = ?,
+                lease_expires = ?,
+                heartbeat_at = ?
+            WHERE id = ?
+            """, (worker, current_time, worker, current_time + lease_duration, current_time, job['id']))
+            
+            job = dict(job)
+            job.update(status='running', worker=worker, started_at=current_time, lease_owner=worker,
+                       lease_expires=current_time + lease_duration, heartbeat_at=current_time)
+            return job
+    except Exception as e:
+        logger.error(f"领取作业失败: {str(e)}")
+        return None
+
+def finish_job(job_id, worker, status='done'):
+    """
+    标记作业执行结束，租约已被其他worker回收时不做修改
+    
+    Args:
+        job_id: 作业ID
+        worker: 持有租约的worker标识
+        status: 结束状态，done或failed
+        
+    Returns:
+        布尔值，是否成功
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("""
+            UPDATE jobs SET status = ?, finished_at = ?, lease_owner = NULL, lease_expires = NULL
+            WHERE id = ? AND lease_owner = ?
+            """, (status, int(time.time()), job_id, worker))
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"更新作业状态失败: {str(e)}")
+        return False
+
+def acquire_task_lease(task_id, owner, lease_duration):
+    """
+    获取任务的执行租约，租约空闲、已过期或已由owner持有时成功
+    
+    Args:
+        task_id: 任务ID
+        owner: 租约持有者
+        lease_duration: 租约有效期(秒)
+        
+    Returns:
+        布尔值，是否获得租约
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            current_time = int(time.time())
+            cursor.execute("""
+            UPDATE tasks SET 
+                lease_owner = ?, 
+                lease_expires = ?, 
+                heartbeat_at = ?
+            WHERE id = ? AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?)
+            """, (owner, current_time + lease_duration, current_time, task_id, owner, current_time))
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"获取任务租约失败: {str(e)}")
+        return False
+
+def release_task_lease(task_id, owner):
+    """
+    释放owner持有的任务租约
+    
+    Args:
+        task_id: 任务ID
+        owner: 租约持有者
+        
+    Returns:
+        布尔值，是否成功
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("""
+            UPDATE tasks SET lease_owner = NULL, lease_expires = NULL
+            WHERE id = ? AND lease_owner = ?
+            """, (task_id, owner))
+            return True
+    except Exception as e:
+        logger.error(f"释放任务租约失败: {str(e)}")
+        return False
+
+def renew_leases(owner, lease_duration):
+    """
+    续约owner持有的所有任务和作业租约
+    
+    Args:
+        owner: 租约持有者
+        lease_duration: 租约有效期(秒)
+        
+    Returns:
+        整数，续约的租约数
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            current_time = int(time.time())
+            params = (current_time + lease_duration, current_time, owner)
+            cursor.execute("UPDATE tasks SET lease_expires = ?, heartbeat_at = ? WHERE lease_owner = ?", params)
+            renewed = cursor.rowcount
+            cursor.execute("""
+            UPDATE jobs SET lease_expires = ?, heartbeat_at = ? 
+            WHERE lease_owner = ? AND status = 'running'
+            """, params)
+            return renewed + cursor.rowcount
+    except Exception as e:
+        logger.error(f"续约失败: {str(e)}")
+        return 0
+
+def get_expired_task_leases():
+    """
+    获取租约已过期但仍处于运行状态的任务，即执行节点已失效的任务
+    
+    Returns:
+        列表，包含(任务ID, 原租约持有者)
+    """
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("""
+            SELECT id, lease_owner FROM tasks
+            WHERE lease_expires < ? AND lease_owner IS NOT NULL AND status = 'running'
+            """, (int(time.time()),))
+            return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"获取过期租约失败: {str(e)}")
+        return []
+
+def advance_next_run(task_id, expected_next_run, next_run):
+    """
+    在下次运行时间仍为expected_next_run时把它更新为next_run，
+    多个节点同时调度同一个到期任务时只有一个节点成功
+    
+    Args:
+        task_id: 任务ID
+        expected_next_run: 调度器读取到的下次运行时间
+        next_run: 新的下次运行时间
+        
+    Returns:
+        布尔值，是否由本节点完成更新
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("""
+            UPDATE tasks SET 
+                next_run = ?, 
+                updated_at = ?
+            WHERE id = ? AND next_run = ?
+            """, (next_run, int(time.time()), task_id, expected_next_run))
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"更新任务下次运行时间失败: {str(e)}")
+        return False
+
+def get_job_statuses(job_ids):
+    """
+    批量获取作业状态
+    
+    Args:
+        job_ids: 作业ID列表
+        
+    Returns:
+        字典，键为作业ID，值为作业状态；查询失败时返回空字典
+    """
+    if not job_ids:
+        return {}
+    try:
+        with db_cursor() as cursor:
+            placeholders = ','.join('?' * len(job_ids))
+            cursor.execute(f"SELECT id, status FROM jobs WHERE id IN ({placeholders})", list(job_ids))
+            return dict(cursor.fetchall())
+    except Exception as e:
+        logger.error(f"获取作业状态失败: {str(e)}")
+        return {}
+
+def get_job_counts():
+    """
+    统计执行队列中各状态的作业数
+    
+    Returns:
+        字典，键为作业状态，值为数量
+    """
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            return dict(cursor.fetchall())
+    except Exception as e:
+        logger.error(f"统计作业数量失败: {str(e)}")
+        return {}
+
+def get_page_cache(namespace, cache_key):
+    """
+    读取持久化的页面缓存
+    
+    Args:
+        namespace: 缓存名称
+        cache_key: 缓存键
+        
+    Returns:
+        元组，包含(写入时间, JSON字符串)；不存在时返回None
+    """
+    try:
+        with db_cursor() as cursor:
+            cursor.execute("""
+            SELECT stored_at, value FROM page_cache
+            WHERE namespace = ? AND cache_key = ?
+            """, (namespace, cache_key))
+            return cursor.fetchone()
+    except Exception as e:
+        logger.error(f"读取页面缓存失败: {str(e)}")
+        return None
+
+def save_page_cache(namespace, cache_key, value, stored_at):
+    """
+    写入持久化的页面缓存
+    
+    Args:
+        namespace: 缓存名称
+        cache_key: 缓存键
+        value: JSON字符串
+        stored_at: 写入时间戳
+        
+    Returns:
+        布尔值，是否成功
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("""
+            INSERT INTO page_cache (namespace, cache_key, value, stored_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(namespace, cache_key) DO UPDATE SET
+                value = excluded.value,
+                stored_at = excluded.stored_at
+            """, (namespace, cache_key, value, stored_at))
+            return True
+    except Exception as e:
+        logger.error(f"写入页面缓存失败: {str(e)}")
+        return False
+
+def delete_page_cache(namespace, cache_key):
+    """
+    删除持久化的页面缓存
+    
+    Args:
+        namespace: 缓存名称
+        cache_key: 缓存键
+        
+    Returns:
+        布尔值，是否成功
+    """
+    try:
+        with db_cursor(commit=True) as cursor:
+            cursor.execute("DELETE FROM page_cache WHERE namespace = ? AND cache_key = ?", (namespace, cache_key))
+            return True
+    except Exception as e:
+        logger.error(f"删除页面缓存失败: {str(e)}")
+        return False
\ No newline at end of file
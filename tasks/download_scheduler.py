@@ -0,0 +1,376 @@
+"""
+全局下载调度模块
+
+进程内所有任务的剧集都放入同一个优先级队列，由固定数量的工作线程下载：
+- 优先级数值越小越先执行，手动提升优先级的任务会插到队列最前面
+- 同一优先级内按任务轮转，每个任务的第N集排在其他任务的第N+1集之前
+- 视频地址由单个解析线程按队列顺序提前解析
+
+EXECUTION_MODE为worker时任务写入数据库的jobs队列，由worker.py进程领取执行；
+inline模式下执行前先获取任务租约，多个节点共享数据库时同一任务只会在一个节点执行
+"""
+import os
+import time
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (DOWNLOAD_WORKERS, EPISODE_RESOLVE_AHEAD, TASK_PLANNER_WORKERS, EXECUTION_MODE, NODE_ID, LEASE_DURATION,
+                    WORKER_POLL_INTERVAL)
+from database import operations
+from utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+# 任务优先级，数值越小越优先
+PRIORITY_HIGH = 0  # 手动提升，例如用户正在等待观看
+PRIORITY_NORMAL = 10  # 通过接口手动执行
+PRIORITY_PERIODIC = 20  # 定时任务
+
+class EpisodeJob:
+    """队列中的单个剧集下载作业"""
+
+    def __init__(self, task_id, episode_number, round_index, seq, resolve, download):
+        """
+        初始化剧集作业
+
+        Args:
+            task_id: 任务ID
+            episode_number: 剧集编号
+            round_index: 该剧集在任务内的顺序，用于任务间轮转
+            seq: 全局提交顺序
+            resolve: 解析视频地址的函数，参数为剧集编号
+            download: 下载函数，参数为剧集编号和解析结果的Future，返回是否成功
+        """
+        self.task_id = task_id
+        self.episode_number = episode_number
+        self.round_index = round_index
+        self.seq = seq
+        self.resolve = resolve
+        self.download = download
+        self.resolve_future = None
+
+class _TaskState:
+    """调度器内单个任务的状态"""
+
+    def __init__(self, priority, on_finish=None):
+        self.priority = priority
+        self.submitted = False
+        self.remaining = 0
+        self.success = 0
+        self.on_done = None
+        self.on_finish = on_finish
+
+class DownloadScheduler:
+    """进程内唯一的剧集下载调度器"""
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, resolve_ahead=EPISODE_RESOLVE_AHEAD, planners=TASK_PLANNER_WORKERS):
+        """
+        初始化调度器
+
+        Args:
+            workers: 同时下载的剧集数
+            resolve_ahead: 每次取出作业时提前解析的后续剧集数
+            planners: 同时确定剧集范围的任务数
+        """
+        self.workers = workers
+        self.resolve_ahead = resolve_ahead
+        self.planners = planners
+        self._heap = []
+        self._tasks = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._resolver = None
+        self._planner = None
+
+    def _ensure_started(self):
+        """启动工作线程，调用方需持有锁"""
+        if self._threads:
+            return
+        self._resolver = ThreadPoolExecutor(max_workers=1, thread_name_prefix='episode-resolver')
+        self._planner = ThreadPoolExecutor(max_workers=self.planners, thread_name_prefix='task-planner')
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'download-worker-{i}')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _entry(self, job):
+        """生成作业在堆中的排序项"""
+        return (self._tasks[job.task_id].priority, job.round_index, job.seq, job)
+
+    def submit_task(self, task_id, priority=PRIORITY_NORMAL, on_finish=None):
+        """
+        提交任务，由规划线程确定剧集后放入下载队列
+
+        Args:
+            task_id: 任务ID
+            priority: 任务优先级
+            on_finish: 任务离开调度器后调用的函数，参数为任务ID
+
+        Returns:
+            布尔值，任务已在调度器中时返回False(只会提高其优先级)
+        """
+        with self._cond:
+            if task_id in self._tasks:
+                self._set_priority(task_id, priority)
+                logger.info(f"任务 {task_id} 已在下载队列中")
+                return False
+            self._tasks[task_id] = _TaskState(priority, on_finish)
+            self._ensure_started()
+        self._planner.submit(self._plan_task, task_id)
+        logger.info(f"任务 {task_id} 已加入下载队列, 优先级: {priority}")
+        return True
+
+    def _plan_task(self, task_id):
+        """在规划线程中执行任务，没有提交任何剧集时释放任务状态"""
+        from tasks.executor import execute_task
+        try:
+            execute_task(task_id)
+        finally:
+            with self._cond:
+                state = self._tasks.get(task_id)
+                if not state or state.submitted:
+                    return
+                del self._tasks[task_id]
+            self._notify_finish(task_id, state)
+
+    @staticmethod
+    def _notify_finish(task_id, state):
+        """调用任务离开调度器的回调"""
+        if state.on_finish is None:
+            return
+        try:
+            state.on_finish(task_id)
+        except Exception as e:
+            logger.error(f"任务 {task_id} 结束回调出错: {str(e)}")
+
+    def submit_episodes(self, task_id, episode_numbers, resolve, download, on_done):
+        """
+        把任务的剧集放入下载队列
+
+        Args:
+            task_id: 任务ID
+            episode_numbers: 需要下载的剧集编号列表，不能为空
+            resolve: 解析视频地址的函数，参数为剧集编号
+            download: 下载函数，参数为剧集编号和解析结果的Future，返回是否成功
+            on_done: 所有剧集结束后调用的函数，参数为成功的剧集数
+        """
+        with self._cond:
+            state = self._tasks.get(task_id)
+            if state is None:
+                # 未经submit_task直接执行的任务
+                state = self._tasks[task_id] = _TaskState(PRIORITY_NORMAL)
+                self._ensure_started()
+            state.submitted = True
+            state.remaining = len(episode_numbers)
+            state.on_done = on_done
+            for round_index, episode_number in enumerate(episode_numbers):
+                job = EpisodeJob(task_id, episode_number, round_index, next(self._seq), resolve, download)
+                heapq.heappush(self._heap, self._entry(job))
+            self._cond.notify_all()
+
+    def _set_priority(self, task_id, priority):
+        """提高任务优先级并重排队列，调用方需持有锁"""
+        state = self._tasks[task_id]
+        if priority >= state.priority:
+            return
+        state.priority = priority
+        self._heap = [self._entry(entry[-1]) for entry in self._heap]
+        heapq.heapify(self._heap)
+
+    def bump(self, task_id, priority=PRIORITY_HIGH):
+        """
+        提升任务优先级，其剩余剧集会排在其他任务之前
+
+        Args:
+            task_id: 任务ID
+            priority: 新的优先级
+
+        Returns:
+            布尔值，任务不在调度器中时返回False
+        """
+        with self._cond:
+            if task_id not in self._tasks:
+                return False
+            self._set_priority(task_id, priority)
+        logger.info(f"任务 {task_id} 优先级已提升为 {priority}")
+        return True
+
+    def _start_resolve(self, job):
+        """开始解析作业的视频地址，已开始的不会重复解析，调用方需持有锁"""
+        if job.resolve_future is None:
+            job.resolve_future = self._resolver.submit(job.resolve, job.episode_number)
+
+    def _run(self):
+        """工作线程主循环"""
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                job = heapq.heappop(self._heap)[-1]
+                self._start_resolve(job)
+                # 按队列顺序提前解析后续剧集
+                for entry in heapq.nsmallest(self.resolve_ahead, self._heap):
+                    self._start_resolve(entry[-1])
+
+            success = False
+            try:
+                success = job.download(job.episode_number, job.resolve_future)
+            except Exception as e:
+                logger.error(f"剧集下载作业出错: 任务 {job.task_id}, 剧集 {job.episode_number}, 错误: {str(e)}")
+            finally:
+                self._job_done(job, success)
+
+    def _job_done(self, job, success):
+        """记录作业结束，任务的最后一集结束时调用完成回调"""
+        with self._cond:
+            state = self._tasks[job.task_id]
+            state.remaining -= 1
+            if success:
+                state.success += 1
+            if state.remaining > 0:
+                return
+            del self._tasks[job.task_id]
+        try:
+            state.on_done(state.success)
+        except Exception as e:
+            logger.error(f"任务 {job.task_id} 完成回调出错: {str(e)}")
+        self._notify_finish(job.task_id, state)
+
+    def stats(self):
+        """
+        获取调度器状态
+
+        Returns:
+            字典，包含排队的剧集数和各任务的优先级与剩余剧集数
+        """
+        with self._cond:
+            return {
+                'queued_episodes': len(self._heap),
+                'workers': self.workers,
+                'tasks': {
+                    task_id: {'priority': state.priority, 'remaining': state.remaining}
+                    for task_id, state in self._tasks.items()
+                }
+            }
+
+class JobWatcher:
+    """worker模式下轮询作业状态，作业执行结束(done/failed)后调用提交时的回调"""
+
+    def __init__(self, interval=WORKER_POLL_INTERVAL):
+        """
+        初始化作业监视器
+
+        Args:
+            interval: 轮询作业状态的间隔(秒)
+        """
+        self.interval = interval
+        self._watches = {}  # {作业ID: (任务ID, 回调)}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self, job_id, task_id, on_finish):
+        """
+        监视作业，结束后调用on_finish(task_id)
+
+        Args:
+            job_id: 作业ID
+            task_id: 任务ID
+            on_finish: 回调函数
+        """
+        with self._lock:
+            self._watches[job_id] = (task_id, on_finish)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='job-watcher')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def poll(self):
+        """检查一次所有监视中的作业，返回仍在监视的作业数"""
+        with self._lock:
+            job_ids = list(self._watches)
+        statuses = operations.get_job_statuses(job_ids)
+        finished = []
+        with self._lock:
+            for job_id in job_ids:
+                # 查询失败时没有结果，下次继续检查；作业记录被删除时同样视为结束
+                if statuses and statuses.get(job_id) not in ('queued', 'running'):
+                    finished.append((job_id, self._watches.pop(job_id)))
+            remaining = len(self._watches)
+        for job_id, (task_id, on_finish) in finished:
+            logger.info(f"作业 {job_id} 已结束, 任务ID: {task_id}, 状态: {statuses.get(job_id)}")
+            try:
+                on_finish(task_id)
+            except Exception as e:
+                logger.error(f"任务 {task_id} 结束回调出错: {str(e)}")
+        return remaining
+
+    def _run(self):
+        """后台轮询循环"""
+        while True:
+            time.sleep(self.interval)
+            self.poll()
+
+# 全局调度器实例
+download_scheduler = DownloadScheduler()
+job_watcher = JobWatcher()
+
+def lease_owner():
+    """
+    获取当前进程的租约持有者标识
+    
+    Returns:
+        字符串，格式为 节点标识:进程号
+    """
+    return f"{NODE_ID}:{os.getpid()}"
+
+def submit_task(task_id, priority=PRIORITY_NORMAL, on_finish=None):
+    """
+    提交任务：inline模式获取租约后交给本进程的下载调度器，worker模式写入任务队列
+    
+    Args:
+        task_id: 任务ID
+        priority: 任务优先级
+        on_finish: 任务结束后调用的函数，参数为任务ID
+        
+    Returns:
+        布尔值，任务已在本节点或其他节点执行时返回False
+    """
+    if EXECUTION_MODE != 'worker':
+        owner = lease_owner()
+        if not operations.acquire_task_lease(task_id, owner, LEASE_DURATION):
+            logger.info(f"任务 {task_id} 正由其他节点执行")
+            return False
+        
+        def release(finished_task_id):
+            operations.release_task_lease(finished_task_id, owner)
+            if on_finish is not None:
+                on_finish(finished_task_id)
+        
+        return download_scheduler.submit_task(task_id, priority, release)
+    
+    job_id = operations.enqueue_job(task_id, priority)
+    if job_id is None:
+        return False
+    # 任务由worker进程执行，作业结束后才调用回调，调用方的并发上限在worker模式下同样有效
+    if on_finish is not None:
+        job_watcher.watch(job_id, task_id, on_finish)
+    logger.info(f"任务 {task_id} 已写入执行队列, 作业ID: {job_id}, 优先级: {priority}")
+    return True
+
+def bump_task(task_id, priority=PRIORITY_HIGH):
+    """
+    提升任务优先级
+    
+    Args:
+        task_id: 任务ID
+        priority: 新的优先级
+        
+    Returns:
+        布尔值，任务不在队列中时返回False
+    """
+    if EXECUTION_MODE != 'worker':
+        return download_scheduler.bump(task_id, priority)
+    return operations.update_job_priority(task_id, priority)
@@ -1,22 +1,156 @@
 """
 任务执行器模块
 """
-import time
 import traceback
+from functools import partial
 from database import operations
 from utils.logging import setup_logger
-from core.crawler import get_anime_detail, get_episode_video
+from tasks.download_scheduler import download_scheduler
+from tasks.liveness import liveness
+from core.crawler import get_anime_detail, resolve_episode_video, download_episode_video
 
 # 配置日志
 logger = setup_logger(__name__)
 
+def _plan_episodes(task_id, task):
+    """
+    确定任务需要处理的剧集范围
+    
+    Args:
+        task_id: 任务ID
+        task: 任务信息
+        
+    Returns:
+        元组，包含(起始集数, 结束集数)，无需下载时返回None
+    """
+    anime_id = task['anime_id']
+    start_episode = task['start_episode']
+    end_episode = task['end_episode']
+    #如果是指定剧集,则直接拉取拒接详情
+    #如果是非指定剧集,则拉取当前的所有剧集生成结束剧集
+    if start_episode is None:
+        start_episode = 1
+    if end_episode is None:
+        # 需要最新的剧集列表，不使用缓存
+        anime_detail = get_anime_detail(anime_id, refresh=True)
+        if not anime_detail:
+            logger.error(f"无法获取动漫详情: {anime_id}")
+            operations.update_task_status(task_id, 'failed')
+            return None
+            
+        # 确定要下载的剧集范围
+        episodes = anime_detail.get('episodes', [])
+        if not episodes:
+            logger.warning(f"动漫没有剧集: {anime_id}")
+            operations.update_task_status(task_id, 'completed')
+            return None
+            
+        # 如果没有指定结束集数，使用最后一集
+        if end_episode is None or end_episode > len(episodes):
+            end_episode = len(episodes)
+        
+    # 确保起始集数有效
+    if start_episode < 1:
+        start_episode = 1
+    
+    return start_episode, end_episode
+
+def _resolve_episode(anime_id, episode_number):
+    """
+    解析剧集视频地址，由调度器的解析线程按队列顺序提前执行
+    
+    Args:
+        anime_id: 动漫ID
+        episode_number: 剧集号
+        
+    Returns:
+        字典，包含status_code和url
+    """
+    logger.info(f"解析剧集: {anime_id}/{episode_number}")
+    return resolve_episode_video(anime_id, episode_number)
+
+def _download_episode(task_id, anime_id, episode_number, resolve_future):
+    """
+    等待剧集地址解析完成后下载视频，在调度器的工作线程中执行
+    
+    Args:
+        task_id: 任务ID
+        anime_id: 动漫ID
+        episode_number: 剧集号
+        resolve_future: 解析地址的Future
+        
+    Returns:
+        布尔值，表示是否下载成功
+    """
+    try:
+        video_info = resolve_future.result()
+        if not video_info or video_info.get('status_code') != 200 or not video_info.get('url'):
+            logger.error(f"获取视频地址失败: {anime_id}/{episode_number}")
+            operations.update_download_progress(task_id, episode_number, -1)
+            return False
+        
+        # 解析可能要等待较长时间，解析完成后才开始计算停滞时间
+        liveness.episode_started(task_id, episode_number)
+        logger.info(f"处理剧集: {anime_id}/{episode_number}")
+        video_info = download_episode_video(video_info['url'], anime_id, episode_number, task_id)
+        
+        # 检查是否已经下载成功
+        if video_info.get('local_path'):
+            logger.info(f"视频已成功下载: {video_info['local_path']}")
+            return True
+            
+        # 如果没有成功下载，记录失败状态
+        logger.error(f"视频下载失败: {anime_id}/{episode_number}")
+        operations.update_download_progress(task_id, episode_number, -1)
+        return False
+        
+    except Exception as e:
+        logger.error(f"处理剧集失败: {anime_id}/{episode_number}, 错误: {str(e)}")
+        logger.error(traceback.format_exc())
+        operations.update_download_progress(task_id, episode_number, -1)
+        return False
+    finally:
+        liveness.episode_finished(task_id, episode_number)
+
+def _release_task(task_id):
+    """
+    从存活登记表中移除任务
+    
+    Args:
+        task_id: 任务ID
+    """
+    liveness.unregister(task_id)
+
+def _finish_task(task_id, total_episodes, success_count):
+    """
+    根据成功率确定任务状态
+    
+    Args:
+        task_id: 任务ID
+        total_episodes: 总集数
+        success_count: 成功的集数
+    """
+    try:
+        if success_count == total_episodes:
+            operations.update_task_status(task_id, 'completed')
+        elif success_count > 0:
+            operations.update_task_status(task_id, 'partial')
+        else:
+            operations.update_task_status(task_id, 'failed')
+            
+        logger.info(f"任务执行完成: {task_id}, 总集数: {total_episodes}, 成功: {success_count}")
+    finally:
+        _release_task(task_id)
+
 def execute_task(task_id):
     """
-    执行下载任务
+    执行下载任务：确定剧集范围后把未完成的剧集交给全局下载调度器，
+    所有剧集结束后由调度器回调更新任务状态
     
     Args:
         task_id: 任务ID
     """
+    submitted = False
     try:
         # 获取任务信息
         task = operations.get_task(task_id)
@@ -25,90 +159,43 @@ def execute_task(task_id):
             return
 
         logger.info(f"开始执行任务 {task_id}")
+        # 在确定剧集范围前标记为运行中，之后的最终状态由_finish_task写入
+        operations.update_task_status(task_id, 'running')
+        liveness.register(task_id)
         
-        # 获取动漫详情
         anime_id = task['anime_id']
-        start_episode = task['start_episode']
-        end_episode = task['end_episode']
-        #如果是指定剧集,则直接拉取拒接详情
-        #如果是非指定剧集,则拉取当前的所有剧集生成结束剧集
-        if start_episode is None:
-            start_episode = 1
-        if end_episode is None:
-            anime_detail = get_anime_detail(anime_id)
-            if not anime_detail:
-                logger.error(f"无法获取动漫详情: {anime_id}")
-                operations.update_task_status(task_id, 'failed')
-                return
-                
-            # 确定要下载的剧集范围
-            episodes = anime_detail.get('episodes', [])
-            if not episodes:
-                logger.warning(f"动漫没有剧集: {anime_id}")
-                operations.update_task_status(task_id, 'completed')
-                return
-                
-            # 如果没有指定结束集数，使用最后一集
-            if end_episode is None or end_episode > len(episodes):
-                end_episode = len(episodes)
-        # 获取动漫详情和剧集列表
-       
-            
-        # 确保起始集数有效
-        if start_episode < 1:
-            start_episode = 1
-       
+        plan = _plan_episodes(task_id, task)
+        if not plan:
+            return
+        start_episode, end_episode = plan
             
         # 记录总共需要下载的剧集数
         total_episodes = end_episode - start_episode + 1
         success_count = 0
         
-        # 遍历并处理每一集
+        # 跳过已下载完成的剧集
+        pending_episodes = []
         for episode_number in range(start_episode, end_episode + 1):
-            
-                
-            logger.info(f"处理剧集: {anime_id}/{episode_number}")
-            
-            try:
-                if operations.get_download_progress(task_id, episode_number)  == 100:
-                    logger.info(f"剧集 {anime_id}/{episode_number} 已下载")
-                    success_count += 1
-                    continue
-                # 获取视频地址
-                video_info = get_episode_video(anime_id, episode_number, task_id)
-                
-                if not video_info or video_info.get('status_code') != 200:
-                    logger.error(f"获取视频地址失败: {anime_id}/{episode_number}")
-                    operations.update_download_progress(task_id, episode_number, -1)
-                    continue
-                    
-                # 检查是否已经下载成功
-                if video_info.get('local_path'):
-                    logger.info(f"视频已成功下载: {video_info['local_path']}")
-                    success_count += 1
-                    continue
-                    
-                # 如果没有成功下载，记录失败状态
-                logger.error(f"视频下载失败: {anime_id}/{episode_number}")
-                operations.update_download_progress(task_id, episode_number, -1)
-                    
-            except Exception as e:
-                logger.error(f"处理剧集失败: {anime_id}/{episode_number}, 错误: {str(e)}")
-                logger.error(traceback.format_exc())
-                operations.update_download_progress(task_id, episode_number, -1)
-                
-            # 避免请求频率过高
-            time.sleep(3)
-            
-        # 根据成功率确定任务状态
-        if success_count == total_episodes:
-            operations.update_task_status(task_id, 'completed')
-        elif success_count > 0:
-            operations.update_task_status(task_id, 'partial')
-        else:
-            operations.update_task_status(task_id, 'failed')
-            
-        logger.info(f"任务执行完成: {task_id}, 总集数: {total_episodes}, 成功: {success_count}")
+            if operations.get_download_progress(task_id, episode_number) == 100:
+                logger.info(f"剧集 {anime_id}/{episode_number} 已下载")
+                success_count += 1
+            else:
+                pending_episodes.append(episode_number)
+        
+        if not pending_episodes:
+            submitted = True
+            _finish_task(task_id, total_episodes, success_count)
+            return
+        
+        download_scheduler.submit_episodes(
+            task_id,
+            pending_episodes,
+            resolve=partial(_resolve_episode, anime_id),
+            download=partial(_download_episode, task_id, anime_id),
+            on_done=lambda downloaded: _finish_task(task_id, total_episodes, success_count + downloaded)
+        )
+        submitted = True
+        logger.info(f"任务 {task_id} 已提交 {len(pending_episodes)} 集到下载队列")
         
     except Exception as e:
         logger.error(f"任务 {task_id} 执行出错: {str(e)}")
@@ -116,11 +203,6 @@ def execute_task(task_id):
         operations.update_task_status(task_id, 'failed')
     
     finally:
-        # 从主应用的运行任务列表中移除
-        try:
-            from app import running_tasks, task_lock
-            with task_lock:
-                if task_id in running_tasks:
-                    del running_tasks[task_id]
-        except Exception as e:
-            logger.error(f"清理任务状态时出错: {str(e)}")
\ No newline at end of file
+        # 没有交给调度器时立即从运行任务列表中移除
+        if not submitted:
+            _release_task(task_id)
\ No newline at end of file
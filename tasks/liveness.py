@@ -0,0 +1,182 @@
+"""
+任务存活状态模块
+
+执行器在视频地址解析完成后登记开始下载的剧集，下载线程每写入数据就更新剧集的进度时间；
+监控线程只读取内存中的时间戳，发现长时间没有进度的剧集时记录日志并在状态接口中标记，
+不修改数据库中的进度，下载本身的超时和重试决定剧集最终是否失败
+"""
+import time
+import threading
+from config import LIVENESS_CHECK_INTERVAL, EPISODE_STALL_TIMEOUT
+from utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+class LivenessRegistry:
+    """进程内运行中任务和剧集的心跳登记表"""
+
+    def __init__(self):
+        # {task_id: {'started_at': 时间戳, 'heartbeat_at': 时间戳, 'episodes': {episode_number: 剧集状态}}}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def register(self, task_id):
+        """
+        登记开始执行的任务
+
+        Args:
+            task_id: 任务ID
+        """
+        now = time.time()
+        with self._lock:
+            self._tasks.setdefault(task_id, {'started_at': now, 'heartbeat_at': now, 'episodes': {}})
+
+    def unregister(self, task_id):
+        """
+        移除执行结束的任务
+
+        Args:
+            task_id: 任务ID
+        """
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def episode_started(self, task_id, episode_number):
+        """
+        登记开始下载的剧集
+
+        Args:
+            task_id: 任务ID
+            episode_number: 剧集编号
+        """
+        now = time.time()
+        with self._lock:
+            task = self._tasks.setdefault(task_id, {'started_at': now, 'heartbeat_at': now, 'episodes': {}})
+            task['heartbeat_at'] = now
+            task['episodes'][episode_number] = {'started_at': now, 'progress_at': now, 'stalled': False}
+
+    def episode_finished(self, task_id, episode_number):
+        """
+        移除下载结束的剧集
+
+        Args:
+            task_id: 任务ID
+            episode_number: 剧集编号
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task:
+                task['heartbeat_at'] = time.time()
+                task['episodes'].pop(episode_number, None)
+
+    def beat(self, task_id, episode_number):
+        """
+        记录剧集有新的进度，由下载线程频繁调用
+
+        Args:
+            task_id: 任务ID
+            episode_number: 剧集编号
+        """
+        now = time.time()
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task:
+                return
+            task['heartbeat_at'] = now
+            episode = task['episodes'].get(episode_number)
+            if episode is None:
+                return
+            episode['progress_at'] = now
+            if episode['stalled']:
+                episode['stalled'] = False
+                logger.info(f"剧集恢复下载: 任务 {task_id}, 剧集 {episode_number}")
+
+    def find_stalled(self, timeout, now=None):
+        """
+        找出超过timeout秒没有进度且尚未报告过的剧集，并标记为已停滞
+
+        Args:
+            timeout: 停滞判定时间(秒)
+            now: 当前时间戳，默认为当前时间
+
+        Returns:
+            列表，包含(任务ID, 剧集编号, 无进度的秒数)
+        """
+        now = now or time.time()
+        stalled = []
+        with self._lock:
+            for task_id, task in self._tasks.items():
+                for episode_number, episode in task['episodes'].items():
+                    idle = now - episode['progress_at']
+                    if not episode['stalled'] and idle >= timeout:
+                        episode['stalled'] = True
+                        stalled.append((task_id, episode_number, int(idle)))
+        return stalled
+
+    def task_ids(self):
+        """
+        获取运行中的任务ID
+
+        Returns:
+            列表，任务ID
+        """
+        with self._lock:
+            return list(self._tasks)
+
+    def snapshot(self):
+        """
+        获取所有运行中任务的状态
+
+        Returns:
+            字典，键为任务ID，值包含心跳时间和各剧集距上次进度的秒数
+        """
+        now = time.time()
+        with self._lock:
+            return {
+                task_id: {
+                    'started_at': int(task['started_at']),
+                    'heartbeat_at': int(task['heartbeat_at']),
+                    'episodes': {
+                        episode_number: {
+                            'idle_seconds': int(now - episode['progress_at']),
+                            'stalled': episode['stalled']
+                        }
+                        for episode_number, episode in task['episodes'].items()
+                    }
+                }
+                for task_id, task in self._tasks.items()
+            }
+
+# 全局登记表实例
+liveness = LivenessRegistry()
+
+def _monitor(interval, timeout, stopped):
+    """
+    监控线程主循环，只报告停滞的剧集
+
+    停滞的下载仍在执行，写入失败状态会与之后的正常进度互相覆盖，
+    停滞状态通过日志和/api/downloads/queue中的stalled标记报告
+    """
+    while not stopped.wait(interval):
+        try:
+            for task_id, episode_number, idle in liveness.find_stalled(timeout):
+                logger.warning(f"剧集下载停滞: 任务 {task_id}, 剧集 {episode_number}, 已 {idle} 秒没有进度")
+        except Exception as e:
+            logger.error(f"监控任务时出错: {str(e)}")
+
+def start_monitor(interval=LIVENESS_CHECK_INTERVAL, timeout=EPISODE_STALL_TIMEOUT):
+    """
+    启动停滞剧集监控线程
+
+    Args:
+        interval: 检查间隔(秒)
+        timeout: 剧集无进度多久判定为停滞(秒)
+
+    Returns:
+        threading.Event，设置后监控线程退出
+    """
+    stopped = threading.Event()
+    thread = threading.Thread(target=_monitor, args=(interval, timeout, stopped), name='liveness-monitor')
+    thread.daemon = True
+    thread.start()
+    return stopped
@@ -1,26 +1,92 @@
 """
 任务调度器模块
 """
+import heapq
 import threading
 import time
+from collections import deque
 from database import operations
+from config import SCHEDULER_RESYNC_INTERVAL, PERIODIC_MAX_CONCURRENT, EXECUTION_MODE, LEASE_DURATION, LEASE_HEARTBEAT_INTERVAL
 from utils.logging import setup_logger
-from datetime import datetime, timedelta, timezone
+from tasks.download_scheduler import submit_task, lease_owner, PRIORITY_PERIODIC
 logger = setup_logger(__name__)
 
+class LeaseHeartbeat:
+    """定期续约本进程持有的任务和作业租约，并回收失效节点遗留的任务"""
+    
+    def __init__(self, interval=LEASE_HEARTBEAT_INTERVAL, reclaim=None):
+        """
+        初始化续约线程
+        
+        Args:
+            interval: 续约间隔(秒)
+            reclaim: 重新执行租约过期任务的函数，参数为任务ID，返回是否已提交；为None时不回收
+        """
+        self.interval = interval
+        self.reclaim = reclaim
+        self.thread = None
+        self._stopped = threading.Event()
+    
+    def start(self):
+        """启动续约线程"""
+        if self.thread:
+            return
+        self._stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='lease-heartbeat')
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        """停止续约线程"""
+        self._stopped.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+    
+    def _run(self):
+        """续约主循环"""
+        while not self._stopped.is_set():
+            try:
+                operations.renew_leases(lease_owner(), LEASE_DURATION)
+                if self.reclaim is not None:
+                    self._reclaim_expired()
+            except Exception as e:
+                logger.error(f"续约租约时出错: {str(e)}")
+            self._stopped.wait(self.interval)
+    
+    def _reclaim_expired(self):
+        """重新执行租约已过期的任务，获取租约成功的节点才会执行"""
+        for task_id, previous_owner in operations.get_expired_task_leases():
+            if self.reclaim(task_id):
+                logger.warning(f"回收租约过期的任务 {task_id}, 原节点: {previous_owner}")
+
 class TaskScheduler:
     """任务调度器，管理周期性任务"""
     
-    def __init__(self, check_interval=60):
+    def __init__(self, resync_interval=SCHEDULER_RESYNC_INTERVAL, max_concurrent=PERIODIC_MAX_CONCURRENT):
         """
         初始化调度器
         
         Args:
-            check_interval: 检查任务的间隔(秒)
+            resync_interval: 从数据库重建运行计划的间隔(秒)
+            max_concurrent: 同时运行的周期任务上限
         """
-        self.check_interval = check_interval
+        self.resync_interval = resync_interval
+        self.max_concurrent = max_concurrent
         self.is_running = False
         self.thread = None
+        # 按下次运行时间排序的最小堆，元素为(next_run, task_id)
+        self._heap = []
+        # 每个任务当前有效的下次运行时间，堆中与之不一致的元素视为过期
+        self._next_runs = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._synced_at = 0
+        # 已到期但因并发上限等待执行的任务，以及正在执行的周期任务
+        self._ready = deque()
+        self._active = set()
+        # worker模式下作业由worker进程续约和回收
+        self._heartbeat = LeaseHeartbeat(reclaim=self._reclaim_task if EXECUTION_MODE != 'worker' else None)
     
     def start(self):
         """启动调度器"""
@@ -29,61 +95,167 @@ class TaskScheduler:
             return False
         
         self.is_running = True
+        self._rebuild()
         self.thread = threading.Thread(target=self._run)
         self.thread.daemon = True  # 守护线程，主程序退出时自动结束
         self.thread.start()
-        logger.info("任务调度器已启动")
+        self._heartbeat.start()
+        logger.info(f"任务调度器已启动, 周期任务数: {len(self._next_runs)}")
         return True
     
     def stop(self):
         """停止调度器"""
         self.is_running = False
+        self._wakeup.set()
+        self._heartbeat.stop()
         if self.thread:
             self.thread.join(timeout=5)
             self.thread = None
         logger.info("任务调度器已停止")
     
+    def _rebuild(self):
+        """从数据库重建运行计划"""
+        schedule = operations.get_periodic_schedule()
+        with self._lock:
+            self._next_runs = {task_id: next_run for task_id, next_run in schedule}
+            self._heap = [(next_run, task_id) for task_id, next_run in schedule]
+            heapq.heapify(self._heap)
+        self._synced_at = time.time()
+    
+    def _schedule(self, task_id, next_run):
+        """设置任务的下次运行时间，next_run为None时取消，调用方需持有锁"""
+        if next_run is None:
+            self._next_runs.pop(task_id, None)
+            return
+        self._next_runs[task_id] = next_run
+        heapq.heappush(self._heap, (next_run, task_id))
+    
+    def notify_task_changed(self, task_id):
+        """
+        任务创建、修改或删除后更新运行计划，并唤醒调度线程重新计算等待时间
+        
+        Args:
+            task_id: 任务ID
+        """
+        task = operations.get_task(task_id)
+        next_run = task['next_run'] if task and task['is_periodic'] else None
+        with self._lock:
+            self._schedule(task_id, next_run)
+        self._wakeup.set()
+    
+    def _seconds_until_next(self):
+        """丢弃过期的堆顶元素，返回距下一个任务到期的秒数"""
+        with self._lock:
+            while self._heap:
+                next_run, task_id = self._heap[0]
+                if self._next_runs.get(task_id) == next_run:
+                    return next_run - time.time()
+                heapq.heappop(self._heap)
+        return None
+    
     def _run(self):
-        """运行调度器主循环"""
+        """运行调度器主循环，睡眠到下一个任务到期或被唤醒"""
         while self.is_running:
             try:
-                self._check_pending_tasks()
+                if time.time() - self._synced_at >= self.resync_interval:
+                    self._rebuild()
+                self._run_due_tasks()
+                self._dispatch_ready()
             except Exception as e:
                 logger.error(f"检查待执行任务时出错: {str(e)}")
             
-            # 等待下一次检查
-            time.sleep(self.check_interval)
+            # 有任务排队时只需等待运行中的任务结束，由结束回调唤醒
+            delay = self._seconds_until_next()
+            resync_delay = self._synced_at + self.resync_interval - time.time()
+            timeout = resync_delay if delay is None else min(delay, resync_delay)
+            self._wakeup.wait(max(0, timeout))
+            self._wakeup.clear()
+    
+    def _pop_due(self, now):
+        """取出一个已到期的任务，返回(任务ID, 到期时间)，没有时返回None"""
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                next_run, task_id = heapq.heappop(self._heap)
+                if self._next_runs.get(task_id) == next_run:
+                    del self._next_runs[task_id]
+                    return task_id, next_run
+        return None
     
-    def _check_pending_tasks(self):
-        """检查待执行的任务"""
+    def _run_due_tasks(self):
+        """把所有已到期的任务放入待执行队列并安排下次运行"""
         current_time = int(time.time())
-        tz_beijing = timezone(timedelta(hours=8))
-        zero_time = datetime.now(tz_beijing).replace(hour=0, minute=0, second=0, microsecond=0)
-        tasks = operations.get_tasks()
+        while True:
+            due = self._pop_due(current_time)
+            if due is None:
+                return
+            task_id, due_next_run = due
+            try:
+                task = operations.get_task(task_id)
+                if not task or not task['is_periodic']:
+                    continue
+                
+                # 更新下次运行时间，每次运行在更新时间后的窗口内随机延后
+                jitter_window = operations.get_jitter_window(task.get('jitter_window'))
+                next_run = operations.compute_next_run(task['daily_update_time'], current_time, grace=0, jitter_window=jitter_window)
+                if not operations.advance_next_run(task_id, due_next_run, next_run):
+                    # 其他节点已经调度了这次运行，按数据库中的时间重新安排
+                    logger.info(f"任务 {task_id} 的本次运行已由其他节点调度")
+                    self.notify_task_changed(task_id)
+                    continue
+                
+                with self._lock:
+                    self._schedule(task_id, next_run)
+                    if task_id not in self._active and task_id not in self._ready:
+                        self._ready.append(task_id)
+                
+                logger.info(f"任务已到期: {task_id}, 下次执行时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_run))}")
+            except Exception as e:
+                logger.error(f"调度任务执行失败: {task_id}, 错误: {str(e)}")
+    
+    def _dispatch_ready(self):
+        """在并发上限内把排队的任务交给全局下载调度器"""
+        while True:
+            with self._lock:
+                if not self._ready or len(self._active) >= self.max_concurrent:
+                    return
+                task_id = self._ready.popleft()
+                self._active.add(task_id)
+            
+            # 以定时任务优先级交给全局下载调度器，不会抢占手动执行的任务
+            if submit_task(task_id, PRIORITY_PERIODIC, on_finish=self._on_task_finished):
+                logger.info(f"已调度任务执行: {task_id}")
+            else:
+                # 任务已被手动执行，不占用周期任务的名额
+                with self._lock:
+                    self._active.discard(task_id)
+    
+    def _reclaim_task(self, task_id):
+        """
+        重新执行租约过期的任务，与周期任务一样占用名额并在结束后回调
+        
+        任务状态由execute_task重新标记为running，结束时写入最终状态
         
-        for task in tasks:
-            if task['is_periodic'] and task['next_run'] and task['next_run'] <= current_time:
-                try:
-                    # 标记任务为运行中
-                    operations.update_task_status(task['id'], 'running')
-                    
-                    # 创建新线程执行任务
-                    from tasks.executor import execute_task
-                    task_thread = threading.Thread(target=execute_task, args=(task['id'],))
-                    task_thread.daemon = True
-                    task_thread.start()
-                    #今天时间已经过去了,那么制定明天计划,否则制定今天计划
-                    if(current_time >= task['daily_update_time'] + 600):
-                        next_run = zero_time + timedelta(days=1) + timedelta(seconds=task['daily_update_time'])
-                    else:
-                        next_run = zero_time + timedelta(seconds=task['daily_update_time'])
-                    
-                    # 更新下次运行时间
-                    operations.update_task_next_run(task['id'], int(next_run.timestamp()))
-                    
-                    logger.info(f"已调度任务执行: {task['id']}, 下次执行时间: {next_run}")
-                except Exception as e:
-                    logger.error(f"调度任务执行失败: {task['id']}, 错误: {str(e)}")
+        Args:
+            task_id: 任务ID
+            
+        Returns:
+            布尔值，获取租约并提交成功时返回True
+        """
+        with self._lock:
+            if task_id in self._active:
+                return False
+            self._active.add(task_id)
+        if submit_task(task_id, PRIORITY_PERIODIC, on_finish=self._on_task_finished):
+            return True
+        with self._lock:
+            self._active.discard(task_id)
+        return False
+    
+    def _on_task_finished(self, task_id):
+        """周期任务结束回调，释放名额并唤醒调度线程"""
+        with self._lock:
+            self._active.discard(task_id)
+        self._wakeup.set()
 
 # 全局调度器实例
 scheduler = TaskScheduler()
@@ -94,4 +266,8 @@ def init_scheduler():
 
 def stop_scheduler():
     """停止调度器"""
-    return scheduler.stop() 
\ No newline at end of file
+    return scheduler.stop()
+
+def notify_task_changed(task_id):
+    """通知调度器任务已创建、修改或删除"""
+    return scheduler.notify_task_changed(task_id)
@@ -0,0 +1,21 @@
+"""
+测试公共配置
+
+在项目根目录执行: python -m pytest tests
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """使用临时数据库，测试结束后关闭当前线程的连接"""
+    from database import connection
+    from database.models import init_db
+    connection.close_connection()
+    monkeypatch.setattr(connection, 'DB_PATH', str(tmp_path / 'test.db'))
+    init_db()
+    yield
+    connection.close_connection()
@@ -0,0 +1,114 @@
+"""
+TTLCache和SingleFlight测试
+"""
+import time
+import threading
+import pytest
+from utils import cache
+from utils.cache import TTLCache, normalize_url
+from utils.singleflight import SingleFlight
+
+class Clock:
+    """可手动推进的time.time替代"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+def test_normalize_url_drops_domain_and_sorts_query():
+    assert normalize_url('https://a.test/search?q=x&b=1#top') == normalize_url('/search?b=1&q=x')
+
+def test_fresh_entry_is_served_from_cache(clock):
+    ttl_cache = TTLCache('test', ttl=10, stale_ttl=0, persist=False)
+    calls = []
+    loader = lambda: calls.append(1) or {'items': [1]}
+
+    assert ttl_cache.get_or_load('/a', loader) == {'items': [1]}
+    clock.now += 5
+    value = ttl_cache.get_or_load('/a', loader)
+    assert value == {'items': [1]} and len(calls) == 1
+
+    # 返回的是副本，调用方修改不影响缓存
+    value['items'].append(2)
+    assert ttl_cache.get_or_load('/a', loader) == {'items': [1]}
+
+def test_expired_entry_is_reloaded(clock):
+    ttl_cache = TTLCache('test', ttl=10, stale_ttl=0, persist=False)
+    values = iter([1, 2])
+    loader = lambda: next(values)
+    assert ttl_cache.get_or_load('/a', loader) == 1
+    clock.now += 11
+    assert ttl_cache.get_or_load('/a', loader) == 2
+
+def test_stale_entry_is_returned_and_refreshed(clock, monkeypatch):
+    ttl_cache = TTLCache('test', ttl=10, stale_ttl=100, persist=False)
+    refreshed = []
+    monkeypatch.setattr(ttl_cache, '_refresh', lambda key, loader: refreshed.append(key))
+    ttl_cache.set('/a', 1)
+    clock.now += 50
+    assert ttl_cache.get_or_load('/a', lambda: 2) == 1
+    assert refreshed == ['/a']
+
+def test_failed_load_is_not_cached(clock):
+    ttl_cache = TTLCache('test', ttl=10, stale_ttl=0, persist=False)
+    assert ttl_cache.get_or_load('/a', lambda: None) is None
+    assert ttl_cache.get_or_load('/a', lambda: 1) == 1
+
+def test_lru_eviction(clock):
+    ttl_cache = TTLCache('test', ttl=10, stale_ttl=0, maxsize=2, persist=False)
+    ttl_cache.set('/a', 1)
+    ttl_cache.set('/b', 2)
+    ttl_cache.get_or_load('/a', lambda: None)  # /a变为最近使用
+    ttl_cache.set('/c', 3)
+    assert ttl_cache.get_or_load('/a', lambda: 'reloaded') == 1
+    assert ttl_cache.get_or_load('/b', lambda: 'reloaded') == 'reloaded'
+
+def test_singleflight_coalesces_concurrent_calls():
+    flight = SingleFlight('test')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'value': 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('k', load))) for _ in range(8)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # 等待其余线程都进入等待状态后再放行
+    deadline = time.monotonic() + 5
+    while flight._calls['k'].waiters < 7 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [{'value': 1}] * 8
+    # 每个调用方拿到独立的副本
+    assert len({id(result) for result in results}) == 8
+    assert flight.in_flight() == 0
+
+def test_singleflight_propagates_errors_and_forgets_key():
+    flight = SingleFlight('test')
+
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        flight.do('k', fail)
+    assert flight.do('k', lambda: 2) == 2
@@ -0,0 +1,19 @@
+"""
+镜像域名评分和选择测试
+"""
+from utils.domain_health import DomainHealthTracker
+
+def test_unmeasured_mirror_is_scored_with_average_latency():
+    tracker = DomainHealthTracker(domains=['a', 'b', 'c'])
+    tracker.record_success('a', 0.5)
+    # 得分相同时先尝试未测量的域名
+    assert tracker.choose() == 'b'
+    tracker.record_success('b', 0.2)
+    # c按平均值0.35评分，比b慢
+    assert tracker.choose() == 'b'
+
+def test_failure_lowers_unmeasured_mirror():
+    tracker = DomainHealthTracker(domains=['a', 'b'])
+    tracker.record_failure('a')
+    assert tracker.choose() == 'b'
+    assert [state['domain'] for state in tracker.snapshot()] == ['b', 'a']
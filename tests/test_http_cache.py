@@ -0,0 +1,29 @@
+"""
+HTTP条件请求缓存测试
+"""
+from types import SimpleNamespace
+from utils.http_cache import HttpCache, CachedResponse, body_hash
+
+def response(text, encoding, url='https://a.test/detail/1.html'):
+    """与requests.Response具有相同属性的响应"""
+    content = text.encode(encoding)
+    return SimpleNamespace(url=url, content=content, encoding=encoding, headers={'ETag': '"v1"'})
+
+def test_cached_response_keeps_bytes_encoding_and_url(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    res = response('<title>进击的巨人</title>', 'gbk')
+    cache.store('/detail/1.html', res, body_hash(res.content))
+
+    entry = cache.get('https://b.test/detail/1.html')
+    assert cache.conditional_headers(entry) == {'If-None-Match': '"v1"'}
+    cached = CachedResponse(entry)
+    assert cached.content == res.content
+    assert cached.text == '<title>进击的巨人</title>'
+    assert cached.url == 'https://a.test/detail/1.html'
+
+def test_response_without_validators_is_not_stored(tmp_path):
+    cache = HttpCache(str(tmp_path))
+    res = response('a', 'utf-8')
+    res.headers = {}
+    cache.store('/a', res, body_hash(res.content))
+    assert cache.get('/a') is None
@@ -0,0 +1,54 @@
+"""
+/video接口Range和If-Range处理测试
+"""
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from utils.http_range import resolve_ranges, if_range_matches, RangeFile
+
+ETAG = 'abc-64-1'
+LAST_MODIFIED = 1700000000
+
+def if_range(etag=None, date=None):
+    """与werkzeug解析出的IfRange对象具有相同属性"""
+    return SimpleNamespace(etag=etag, date=date)
+
+def test_resolve_ranges():
+    # werkzeug的stop不包含，结果为闭区间
+    assert resolve_ranges([(0, 100)], 1000) == [(0, 99)]
+    assert resolve_ranges([(900, None)], 1000) == [(900, 999)]
+    assert resolve_ranges([(900, 2000)], 1000) == [(900, 999)]
+
+def test_resolve_suffix_range():
+    assert resolve_ranges([(-100, None)], 1000) == [(900, 999)]
+    assert resolve_ranges([(-5000, None)], 1000) == [(0, 999)]
+
+def test_resolve_ranges_drops_unsatisfiable():
+    assert resolve_ranges([(1000, None)], 1000) == []
+    assert resolve_ranges([(0, 10), (2000, 3000), (20, 30)], 1000) == [(0, 9), (20, 29)]
+
+def test_if_range_absent_matches():
+    assert if_range_matches(if_range(), None, ETAG, LAST_MODIFIED)
+
+def test_if_range_strong_etag():
+    assert if_range_matches(if_range(etag=ETAG), f'"{ETAG}"', ETAG, LAST_MODIFIED)
+    assert not if_range_matches(if_range(etag='other'), '"other"', ETAG, LAST_MODIFIED)
+    # If-Range只允许强比较，弱ETag一律视为不匹配
+    assert not if_range_matches(if_range(etag=ETAG), f'W/"{ETAG}"', ETAG, LAST_MODIFIED)
+
+def test_if_range_date():
+    date = datetime.fromtimestamp(LAST_MODIFIED, timezone.utc)
+    assert if_range_matches(if_range(date=date), None, ETAG, LAST_MODIFIED)
+    assert not if_range_matches(if_range(date=date), None, ETAG, LAST_MODIFIED + 1)
+
+def test_range_file_reads_only_the_range(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(bytes(range(100)))
+    f = RangeFile(open(path, 'rb'), 10, 25)
+    try:
+        # sendfile从当前位置开始发送
+        assert os.lseek(f.fileno(), 0, os.SEEK_CUR) == 10
+        chunks = list(iter(lambda: f.read(10), b''))
+    finally:
+        f.close()
+    assert chunks == [bytes(range(10, 20)), bytes(range(20, 30)), bytes(range(30, 35))]
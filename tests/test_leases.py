@@ -0,0 +1,65 @@
+"""
+作业队列领取和任务租约测试
+"""
+from database import operations
+from database.connection import db_cursor
+
+def expire(table, row_id):
+    """把租约改为已过期"""
+    with db_cursor(commit=True) as cursor:
+        cursor.execute(f"UPDATE {table} SET lease_expires = 0 WHERE id = ?", (row_id,))
+
+def test_claim_job_by_priority(db):
+    low = operations.enqueue_job(1, 20)
+    high = operations.enqueue_job(2, 0)
+    assert operations.claim_job('w1', 60)['id'] == high
+    assert operations.claim_job('w2', 60)['id'] == low
+    assert operations.claim_job('w3', 60) is None
+
+def test_enqueue_same_task_only_raises_priority(db):
+    job_id = operations.enqueue_job(1, 20)
+    assert operations.enqueue_job(1, 5) is None
+    assert operations.claim_job('w1', 60)['priority'] == 5
+    assert operations.get_job_statuses([job_id]) == {job_id: 'running'}
+
+def test_expired_job_is_reclaimed(db):
+    job_id = operations.enqueue_job(1, 10)
+    assert operations.claim_job('w1', 60)['id'] == job_id
+    assert operations.claim_job('w2', 60) is None
+
+    expire('jobs', job_id)
+    job = operations.claim_job('w2', 60)
+    assert job['id'] == job_id and job['lease_owner'] == 'w2'
+    # 原worker的租约已被回收，不能再结束作业
+    assert not operations.finish_job(job_id, 'w1')
+    assert operations.finish_job(job_id, 'w2', 'failed')
+    assert operations.get_job_statuses([job_id]) == {job_id: 'failed'}
+
+def test_task_lease_is_exclusive(db):
+    task_id = operations.create_task('1000', 1, 3)
+    assert operations.acquire_task_lease(task_id, 'node-a', 60)
+    # 持有者可以重复获取，其他节点不能
+    assert operations.acquire_task_lease(task_id, 'node-a', 60)
+    assert not operations.acquire_task_lease(task_id, 'node-b', 60)
+
+    # 只有持有者能释放
+    operations.release_task_lease(task_id, 'node-b')
+    assert not operations.acquire_task_lease(task_id, 'node-b', 60)
+    operations.release_task_lease(task_id, 'node-a')
+    assert operations.acquire_task_lease(task_id, 'node-b', 60)
+
+def test_expired_task_lease_can_be_taken_over(db):
+    task_id = operations.create_task('1000', 1, 3)
+    assert operations.acquire_task_lease(task_id, 'node-a', 60)
+    expire('tasks', task_id)
+    assert operations.acquire_task_lease(task_id, 'node-b', 60)
+
+def test_renew_leases(db):
+    task_id = operations.create_task('1000', 1, 3)
+    operations.acquire_task_lease(task_id, 'node-a', 60)
+    operations.enqueue_job(task_id, 10)
+    operations.claim_job('node-a', 60)
+    expire('tasks', task_id)
+
+    assert operations.renew_leases('node-a', 60) == 2
+    assert not operations.acquire_task_lease(task_id, 'node-b', 60)
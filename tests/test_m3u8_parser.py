@@ -0,0 +1,113 @@
+"""
+m3u8播放列表解析、子流选择和字节范围合并测试
+"""
+from utils.m3u8 import parse_playlist, select_variant, plan_ranges
+
+MASTER = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.4d401e,mp4a.40.2"
+low/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=3000000,RESOLUTION=1280x720
+high/index.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=8000000,RESOLUTION=3840x2160
+https://other.test/4k/index.m3u8
+"""
+
+MEDIA = """#EXTM3U
+#EXT-X-VERSION:4
+#EXT-X-TARGETDURATION:10
+#EXT-X-MEDIA-SEQUENCE:7
+#EXT-X-KEY:METHOD=AES-128,URI="/keys/a.key"
+#EXT-X-MAP:URI="init.mp4",BYTERANGE="720@0"
+#EXTINF:9.5,first
+0.ts
+#EXT-X-DISCONTINUITY
+#EXTINF:10,
+1.ts
+#EXT-X-KEY:METHOD=AES-128,URI="/keys/b.key",IV=0x01
+#EXTINF:10,
+2.ts
+#EXT-X-ENDLIST
+"""
+
+def test_master_playlist_variants():
+    playlist = parse_playlist(MASTER, 'https://cdn.test/v/master.m3u8')
+    assert playlist.is_master
+    assert [v.uri for v in playlist.variants] == [
+        'https://cdn.test/v/low/index.m3u8',
+        'https://cdn.test/v/high/index.m3u8',
+        'https://other.test/4k/index.m3u8',
+    ]
+    assert playlist.variants[0].resolution == (640, 360)
+    assert playlist.variants[0].codecs == 'avc1.4d401e,mp4a.40.2'
+
+def test_select_variant_policy():
+    variants = parse_playlist(MASTER, 'https://cdn.test/v/master.m3u8').variants
+    assert select_variant(variants, 'highest', max_height=1080, max_bandwidth=0).bandwidth == 3000000
+    assert select_variant(variants, 'highest', max_height=0, max_bandwidth=0).bandwidth == 8000000
+    assert select_variant(variants, 'highest', max_height=0, max_bandwidth=1000000).bandwidth == 800000
+    assert select_variant(variants, 'lowest', max_height=1080, max_bandwidth=0).bandwidth == 800000
+
+def test_media_playlist_segments():
+    playlist = parse_playlist(MEDIA, 'https://cdn.test/v/high/index.m3u8')
+    assert not playlist.is_master
+    assert playlist.version == 4
+    assert playlist.target_duration == 10
+    assert playlist.endlist
+
+    segments = playlist.segments
+    assert [s.sequence for s in segments] == [7, 8, 9]
+    assert [s.uri for s in segments] == [
+        'https://cdn.test/v/high/0.ts',
+        'https://cdn.test/v/high/1.ts',
+        'https://cdn.test/v/high/2.ts',
+    ]
+    assert segments[0].duration == 9.5 and segments[0].title == 'first'
+    assert [s.discontinuity for s in segments] == [False, True, False]
+    # key轮换只影响之后的分片
+    assert segments[0].key is segments[1].key
+    assert segments[0].key.uri == 'https://cdn.test/keys/a.key'
+    assert segments[2].key.uri == 'https://cdn.test/keys/b.key'
+    assert segments[2].key.iv == '0x01'
+    assert segments[0].map.uri == 'https://cdn.test/v/high/init.mp4'
+    assert segments[0].map.byterange == (720, 0)
+
+def test_byterange_without_offset_continues_previous_range():
+    text = """#EXTM3U
+#EXTINF:10,
+#EXT-X-BYTERANGE:1000@500
+main.mp4
+#EXTINF:10,
+#EXT-X-BYTERANGE:2000
+main.mp4
+#EXTINF:10,
+#EXT-X-BYTERANGE:300
+other.mp4
+"""
+    segments = parse_playlist(text, 'https://cdn.test/v/index.m3u8').segments
+    assert [s.byterange for s in segments] == [(1000, 500), (2000, 1500), (300, 0)]
+
+def test_malformed_tag_is_skipped():
+    text = "#EXTM3U\n#EXT-X-TARGETDURATION:10\n#EXTINF:abc,\na.ts\n#EXTINF:5,\nb.ts\n"
+    segments = parse_playlist(text, 'https://cdn.test/v/index.m3u8').segments
+    assert [(s.uri, s.duration) for s in segments] == [
+        ('https://cdn.test/v/a.ts', None),
+        ('https://cdn.test/v/b.ts', 5.0),
+    ]
+
+def _ranged(*ranges, uri='https://cdn.test/v/main.mp4'):
+    text = '#EXTM3U\n' + ''.join(f'#EXTINF:10,\n#EXT-X-BYTERANGE:{length}@{offset}\n{uri}\n' for length, offset in ranges)
+    return parse_playlist(text, 'https://cdn.test/v/index.m3u8').segments
+
+def test_plan_ranges_merges_adjacent_ranges():
+    segments = _ranged((100, 0), (100, 100), (100, 210), (100, 1000))
+    plans = plan_ranges(segments, chunk_size=1024, merge_gap=16)
+    assert plans == {'https://cdn.test/v/main.mp4': [(0, 310, [0, 1, 2]), (1000, 1100, [3])]}
+
+def test_plan_ranges_respects_chunk_size():
+    segments = _ranged((100, 0), (100, 100), (100, 200), (100, 300))
+    plans = plan_ranges(segments, chunk_size=200, merge_gap=0)
+    assert plans['https://cdn.test/v/main.mp4'] == [(0, 200, [0, 1]), (200, 400, [2, 3])]
+
+def test_plan_ranges_ignores_whole_file_segments():
+    segments = parse_playlist('#EXTM3U\n#EXTINF:10,\na.ts\n', 'https://cdn.test/v/index.m3u8').segments
+    assert plan_ranges(segments) == {}
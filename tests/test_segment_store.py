@@ -0,0 +1,148 @@
+"""
+SegmentStore断点续传和校验测试
+"""
+import os
+import pytest
+from utils.m3u8 import SegmentStore, RangeChunk, RangedResource
+
+URI = 'https://cdn.test/v/high/0.ts?token=1'
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def download(store, name, uri, data):
+    """模拟一次完整下载: 确定续传位置、写入.part并提交"""
+    offset = store.resume_offset(name, uri)
+    with open(name + '.ts.part', 'ab') as f:
+        f.write(data[offset:])
+    store.commit(name, len(data), uri)
+
+@pytest.fixture
+def segment(tmp_path):
+    return str(tmp_path / '0')
+
+def test_committed_segment_is_complete_after_reload(tmp_path, segment):
+    download(SegmentStore(str(tmp_path)), segment, URI, b'a' * 100)
+
+    store = SegmentStore(str(tmp_path))
+    assert store.is_complete(segment, URI)
+    # 签名等查询参数变化不影响续传
+    assert store.is_complete(segment, 'https://cdn.test/v/high/0.ts?token=2')
+
+def test_segment_from_other_playlist_is_discarded(tmp_path, segment):
+    store = SegmentStore(str(tmp_path))
+    download(store, segment, URI, b'a' * 100)
+
+    other = 'https://cdn.test/v/low/0.ts'
+    assert not store.is_complete(segment, other)
+    assert store.resume_offset(segment, other) == 0
+    assert not os.path.exists(segment + '.ts')
+    assert not os.path.exists(segment + '.ts.part')
+
+def test_segment_without_manifest_entry_is_discarded(tmp_path, segment):
+    write(segment + '.ts', b'a' * 100)
+    store = SegmentStore(str(tmp_path))
+
+    assert not store.is_complete(segment, URI)
+    assert store.resume_offset(segment, URI) == 0
+    assert not os.path.exists(segment + '.ts')
+
+def test_checksum_mismatch_refetches_from_start(tmp_path, segment):
+    store = SegmentStore(str(tmp_path), checksum=True)
+    download(store, segment, URI, b'a' * 100)
+    # 大小相同但内容损坏
+    write(segment + '.ts', b'b' * 100)
+
+    store = SegmentStore(str(tmp_path), checksum=True)
+    assert not store.is_complete(segment, URI)
+    assert not os.path.exists(segment + '.ts')
+    assert store.resume_offset(segment, URI) == 0
+
+    download(store, segment, URI, b'a' * 100)
+    assert SegmentStore(str(tmp_path), checksum=True).is_complete(segment, URI)
+
+def test_partial_segment_resumes_with_range(tmp_path, segment):
+    store = SegmentStore(str(tmp_path))
+    assert store.resume_offset(segment, URI) == 0
+    write(segment + '.ts.part', b'a' * 40)
+
+    store = SegmentStore(str(tmp_path))
+    offset = store.resume_offset(segment, URI)
+    assert offset == 40
+    assert store.request_headers({'User-Agent': 'x'}, offset) == {'User-Agent': 'x', 'Range': 'bytes=40-'}
+    assert store.request_headers({'User-Agent': 'x'}, 0) == {'User-Agent': 'x'}
+
+def test_truncated_segment_is_resumed(tmp_path, segment):
+    store = SegmentStore(str(tmp_path))
+    download(store, segment, URI, b'a' * 100)
+    write(segment + '.ts', b'a' * 60)
+
+    assert not store.is_complete(segment, URI)
+    assert store.resume_offset(segment, URI) == 60
+    assert os.path.exists(segment + '.ts.part')
+
+def test_open_mode(tmp_path, segment):
+    store = SegmentStore(str(tmp_path))
+    assert store.open_mode(segment, 200, {'Content-Length': '100'}, 0) == ('wb', 100)
+    # 压缩传输时Content-Length不是写入的大小
+    assert store.open_mode(segment, 200, {'Content-Length': '30', 'Content-Encoding': 'gzip'}, 0) == ('wb', None)
+    assert store.open_mode(segment, 206, {'Content-Range': 'bytes 40-99/100'}, 40) == ('ab', 100)
+    assert store.open_mode(segment, 416, {'Content-Range': 'bytes */100'}, 100) == (None, 100)
+
+def test_open_mode_rejects_mismatched_range(tmp_path, segment):
+    store = SegmentStore(str(tmp_path))
+    write(segment + '.ts.part', b'a' * 40)
+    with pytest.raises(IOError):
+        store.open_mode(segment, 206, {'Content-Range': 'bytes 0-99/100'}, 40)
+    assert not os.path.exists(segment + '.ts.part')
+
+    write(segment + '.ts.part', b'a' * 40)
+    with pytest.raises(IOError):
+        store.open_mode(segment, 416, {'Content-Range': 'bytes */30'}, 40)
+    assert not os.path.exists(segment + '.ts.part')
+
+def test_commit_rejects_incomplete_segment(tmp_path, segment):
+    store = SegmentStore(str(tmp_path))
+    store.resume_offset(segment, URI)
+    write(segment + '.ts.part', b'a' * 60)
+    with pytest.raises(IOError):
+        store.commit(segment, 100, URI)
+    assert not store.is_complete(segment, URI)
+
+def test_resource_is_replaced_atomically_and_verified(tmp_path):
+    key_uri = 'https://cdn.test/keys/a.key?token=1'
+    store = SegmentStore(str(tmp_path))
+    assert not store.is_resource_complete('key', key_uri)
+    store.commit_resource('key', key_uri, None, b'k' * 16)
+    assert not os.path.exists(str(tmp_path / 'key.part'))
+
+    store = SegmentStore(str(tmp_path))
+    assert store.is_resource_complete('key', 'https://cdn.test/keys/a.key?token=2')
+    # 链接或字节范围变化时重新下载
+    assert not store.is_resource_complete('key', 'https://cdn.test/keys/b.key')
+    assert not os.path.exists(str(tmp_path / 'key'))
+
+def test_corrupted_resource_is_discarded(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    store.commit_resource('init0.mp4', URI, (720, 0), b'a' * 720)
+    assert store.is_resource_complete('init0.mp4', URI, (720, 0))
+    assert not store.is_resource_complete('init0.mp4', URI, (720, 720))
+
+    store.commit_resource('init0.mp4', URI, (720, 0), b'a' * 720)
+    write(str(tmp_path / 'init0.mp4'), b'b' * 720)
+    assert not SegmentStore(str(tmp_path)).is_resource_complete('init0.mp4', URI, (720, 0))
+
+def test_range_chunks_are_tracked_per_resource(tmp_path):
+    chunk = RangeChunk(0, 100, [0, 1])
+    resource = RangedResource('https://cdn.test/v/main.mp4', 'media0.mp4', [chunk])
+    write(str(tmp_path / 'media0.mp4'), b'\0' * 100)
+
+    store = SegmentStore(str(tmp_path))
+    assert not store.is_range_complete(resource, chunk)
+    store.commit_range(resource, chunk)
+
+    store = SegmentStore(str(tmp_path))
+    assert store.is_range_complete(resource, chunk)
+    other = RangedResource('https://cdn.test/v/other.mp4', 'media0.mp4', [chunk])
+    assert not store.is_range_complete(other, chunk)
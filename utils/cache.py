@@ -0,0 +1,171 @@
+"""
+页面解析结果缓存模块
+
+按规范化后的URL缓存详情页、搜索页和列表页的解析结果：
+- 内存中使用带过期时间的LRU，超过容量时淘汰最久未使用的条目
+- 过期但仍在stale窗口内的结果直接返回，同时在后台刷新(stale-while-revalidate)
+- 可选把结果写入sqlite，进程重启后仍可命中
+- 同一个键并发的加载合并为一次请求
+"""
+import copy
+import json
+import time
+import threading
+import urllib.parse
+from collections import OrderedDict
+from database import operations
+from config import PAGE_CACHE_SIZE, PAGE_CACHE_STALE_TTL, PAGE_CACHE_PERSIST
+from utils.logging import setup_logger
+from utils.singleflight import SingleFlight
+
+logger = setup_logger(__name__)
+
+def normalize_url(url):
+    """
+    规范化URL作为缓存键：去掉域名和片段，查询参数按名称排序
+
+    站点域名会轮换，同一页面在不同域名下使用同一个缓存键
+
+    Args:
+        url: 完整URL或以/开头的路径
+
+    Returns:
+        字符串，规范化后的路径和查询参数
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or '/'
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{path}?{query}" if query else path
+
+class TTLCache:
+    """带过期时间和后台刷新的LRU缓存"""
+
+    def __init__(self, namespace, ttl, stale_ttl=PAGE_CACHE_STALE_TTL, maxsize=PAGE_CACHE_SIZE, persist=PAGE_CACHE_PERSIST):
+        """
+        初始化缓存
+
+        Args:
+            namespace: 缓存名称，用于日志和sqlite中区分不同类型的页面
+            ttl: 结果保持新鲜的秒数
+            stale_ttl: 过期后仍可返回旧结果的秒数
+            maxsize: 内存中最多保存的条目数
+            persist: 是否写入sqlite
+        """
+        self.namespace = namespace
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.persist = persist
+        # {key: (stored_at, value)}，按最近使用排序
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight(namespace)
+
+    def _lookup(self, key):
+        """从内存或sqlite中查找条目，返回(stored_at, value)或None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        if not self.persist:
+            return None
+        entry = operations.get_page_cache(self.namespace, key)
+        if entry is None:
+            return None
+        stored_at, raw = entry
+        entry = (stored_at, json.loads(raw))
+        self._store(key, entry, persist=False)
+        return entry
+
+    def _store(self, key, entry, persist=True):
+        """保存条目，超过容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        if persist and self.persist:
+            operations.save_page_cache(self.namespace, key, json.dumps(entry[1], ensure_ascii=False), entry[0])
+
+    def set(self, key, value):
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            value: 可JSON序列化的结果
+        """
+        self._store(key, (time.time(), copy.deepcopy(value)))
+
+    def invalidate(self, key):
+        """
+        删除缓存条目
+
+        Args:
+            key: 缓存键
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.persist:
+            operations.delete_page_cache(self.namespace, key)
+
+    def _load(self, key, loader):
+        """调用loader获取结果，结果不为None时写入缓存；同一个键正在加载时等待该次结果"""
+        def load():
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+            return value
+
+        return self._flight.do(key, load)
+
+    def _refresh(self, key, loader):
+        """后台刷新过期条目，同一个键同时只有一个刷新线程"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._load(key, loader)
+            except Exception as e:
+                logger.error(f"后台刷新缓存失败: {self.namespace} {key}, 错误: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        thread = threading.Thread(target=run, name=f'cache-refresh-{self.namespace}')
+        thread.daemon = True
+        thread.start()
+
+    def get_or_load(self, key, loader, refresh=False):
+        """
+        获取缓存结果，未命中时调用loader加载
+
+        Args:
+            key: 缓存键
+            loader: 无参数的加载函数，返回None表示加载失败，失败结果不缓存
+            refresh: 为True时忽略缓存直接加载，并用新结果更新缓存
+
+        Returns:
+            缓存或新加载的结果
+        """
+        if not refresh:
+            entry = self._lookup(key)
+            if entry is not None:
+                stored_at, value = entry
+                age = time.time() - stored_at
+                if age < self.ttl:
+                    logger.debug(f"缓存命中: {self.namespace} {key}")
+                    return copy.deepcopy(value)
+                if age < self.ttl + self.stale_ttl:
+                    logger.debug(f"返回过期缓存并后台刷新: {self.namespace} {key}")
+                    self._refresh(key, loader)
+                    return copy.deepcopy(value)
+
+        return self._load(key, loader)
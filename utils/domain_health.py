@@ -0,0 +1,211 @@
+"""
+域名健康状态模块
+
+记录BASE_DOMAINS中每个镜像域名的响应时间和错误率(指数加权平均)，
+连续失败达到阈值后熔断该域名一段时间，冷却结束后只放行一个探测请求，
+探测成功恢复，失败则加倍冷却时间；相对URL的请求优先发往最快的可用镜像
+"""
+import time
+import threading
+import logging
+from config import BASE_DOMAINS, DOMAIN_HEALTH_EWMA_ALPHA, DOMAIN_FAILURE_THRESHOLD, DOMAIN_COOLDOWN, DOMAIN_COOLDOWN_MAX, DOMAIN_LATENCY_PRIOR
+
+logger = logging.getLogger(__name__)
+
+class DomainState:
+    """单个域名的健康状态"""
+
+    def __init__(self, domain, index):
+        """
+        初始化域名状态
+
+        Args:
+            domain: 域名
+            index: 在BASE_DOMAINS中的顺序，状态相同时按配置顺序选择
+        """
+        self.domain = domain
+        self.index = index
+        self.latency = None  # 响应时间的加权平均(秒)，没有成功请求前为None
+        self.error_rate = 0.0
+        self.failures = 0  # 连续失败次数
+        self.open_until = 0  # 熔断结束时间
+        self.cooldown = 0  # 本次熔断的时长
+        self.probing = False  # 冷却结束后是否已有探测请求在进行
+
+    def is_open(self, now):
+        """是否处于熔断期内"""
+        return now < self.open_until
+
+    def score(self, prior):
+        """
+        选择域名时的得分，越小越优先
+
+        Args:
+            prior: 还没有成功请求时使用的响应时间(秒)
+
+        Returns:
+            浮点数，响应时间按错误率放大后的值，失败过的域名即使没有测量数据也会被降低优先级
+        """
+        latency = prior if self.latency is None else self.latency
+        return latency / max(1 - self.error_rate, 0.05)
+
+class DomainHealthTracker:
+    """所有镜像域名共享的健康状态和熔断器"""
+
+    def __init__(self, domains=BASE_DOMAINS, alpha=DOMAIN_HEALTH_EWMA_ALPHA, threshold=DOMAIN_FAILURE_THRESHOLD,
+                 cooldown=DOMAIN_COOLDOWN, cooldown_max=DOMAIN_COOLDOWN_MAX):
+        """
+        初始化健康状态
+
+        Args:
+            domains: 镜像域名列表
+            alpha: 加权平均中新样本的权重
+            threshold: 连续失败多少次后熔断
+            cooldown: 首次熔断的时长(秒)
+            cooldown_max: 熔断时长上限(秒)
+        """
+        self.alpha = alpha
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown_max = cooldown_max
+        self._states = {domain: DomainState(domain, i) for i, domain in enumerate(domains)}
+        self._lock = threading.Lock()
+
+    def _prior(self):
+        """
+        没有测量数据的域名使用的响应时间：其他域名响应时间的平均值，
+        比平均快的域名仍然优先，比平均慢的域名会让位给未测量的域名；都没有测量数据时使用配置值
+        """
+        measured = [state.latency for state in self._states.values() if state.latency is not None]
+        return sum(measured) / len(measured) if measured else DOMAIN_LATENCY_PRIOR
+
+    @staticmethod
+    def _rank(state, prior):
+        """排序键：得分相同时先尝试没有测量数据的域名，再按配置顺序"""
+        return state.score(prior), state.latency is not None, state.index
+
+    def _usable(self, state, now):
+        """域名当前是否可以接收请求：未熔断，或冷却已结束且没有探测请求在进行"""
+        if state.open_until == 0:
+            return True
+        return not state.is_open(now) and not state.probing
+
+    def choose(self, exclude=()):
+        """
+        选择最快的可用域名
+
+        冷却结束的域名被选中时作为探测请求，结束前不会再被选中
+
+        Args:
+            exclude: 本次请求已经失败过的域名，只有没有其他可用域名时才会再次选择
+
+        Returns:
+            字符串，域名；所有域名都在熔断期内时返回None
+        """
+        now = time.monotonic()
+        with self._lock:
+            usable = [state for state in self._states.values() if self._usable(state, now)]
+            if not usable:
+                return None
+            fresh = [state for state in usable if state.domain not in exclude]
+            prior = self._prior()
+            state = min(fresh or usable, key=lambda s: self._rank(s, prior))
+            if state.open_until:
+                state.probing = True
+                logger.info(f"熔断冷却结束，探测域名: {state.domain}")
+            return state.domain
+
+    def preferred(self):
+        """
+        获取当前首选域名，不占用探测机会，用于拼接页面中的链接
+
+        Returns:
+            字符串，域名
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [state for state in self._states.values() if state.open_until == 0]
+            if not healthy:
+                # 全部熔断时返回最早恢复的域名
+                return min(self._states.values(), key=lambda s: (s.open_until, s.index)).domain
+            prior = self._prior()
+            return min(healthy, key=lambda s: self._rank(s, prior)).domain
+
+    def record_success(self, domain, latency):
+        """
+        记录成功的请求
+
+        Args:
+            domain: 域名
+            latency: 响应时间(秒)
+        """
+        with self._lock:
+            state = self._states.get(domain)
+            if state is None:
+                return
+            state.latency = latency if state.latency is None else state.latency + self.alpha * (latency - state.latency)
+            state.error_rate -= self.alpha * state.error_rate
+            state.failures = 0
+            if state.open_until:
+                logger.info(f"域名恢复可用: {domain}, 响应时间 {latency:.2f} 秒")
+            state.open_until = 0
+            state.cooldown = 0
+            state.probing = False
+
+    def record_failure(self, domain):
+        """
+        记录失败的请求，连续失败达到阈值或探测失败时熔断
+
+        Args:
+            domain: 域名
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(domain)
+            if state is None:
+                return
+            state.error_rate += self.alpha * (1 - state.error_rate)
+            state.failures += 1
+            if state.probing or (state.open_until == 0 and state.failures >= self.threshold):
+                state.cooldown = min(state.cooldown * 2 or self.base_cooldown, self.cooldown_max)
+                state.open_until = now + state.cooldown
+                state.probing = False
+                logger.warning(f"域名熔断 {state.cooldown} 秒: {domain}, 连续失败 {state.failures} 次")
+
+    def release(self, domain):
+        """
+        探测请求没有得出结果时(如被限速)归还探测机会
+
+        Args:
+            domain: 域名
+        """
+        with self._lock:
+            state = self._states.get(domain)
+            if state is not None:
+                state.probing = False
+
+    def snapshot(self):
+        """
+        获取所有域名的健康状态
+
+        Returns:
+            列表，按选择顺序排列的域名状态字典
+        """
+        now = time.monotonic()
+        with self._lock:
+            prior = self._prior()
+            states = sorted(self._states.values(), key=lambda s: (s.is_open(now),) + self._rank(s, prior))
+            return [
+                {
+                    'domain': state.domain,
+                    'latency': round(state.latency, 3) if state.latency is not None else None,
+                    'error_rate': round(state.error_rate, 3),
+                    'failures': state.failures,
+                    'open': state.is_open(now),
+                    'retry_in': max(0, int(state.open_until - now))
+                }
+                for state in states
+            ]
+
+# 全局健康状态实例
+domain_health = DomainHealthTracker()
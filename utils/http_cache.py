@@ -0,0 +1,235 @@
+"""
+HTTP条件请求缓存模块
+
+站内页面的响应内容和ETag/Last-Modified按规范化后的URL保存在磁盘上，
+再次请求时带上If-None-Match/If-Modified-Since，服务器返回304时直接使用保存的内容。
+每次得到的页面内容都计算sha256，内容与上次相同时复用上次的解析结果，不再重新解析
+"""
+import os
+import copy
+import json
+import base64
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from config import HTTP_CACHE_DIR, PAGE_CACHE_SIZE
+from utils.cache import normalize_url
+from utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+def body_hash(content):
+    """
+    计算响应内容的哈希值
+
+    Args:
+        content: 响应内容的字节串
+
+    Returns:
+        字符串，sha256十六进制摘要
+    """
+    return hashlib.sha256(content).hexdigest()
+
+class CachedResponse:
+    """由缓存内容构造的响应，提供解析代码用到的requests.Response属性"""
+
+    def __init__(self, entry, headers=None):
+        """
+        初始化响应
+
+        Args:
+            entry: 缓存条目字典
+            headers: 304响应的响应头
+        """
+        self.content = base64.b64decode(entry['content'])
+        self.encoding = entry.get('encoding') or 'utf-8'
+        self.status_code = 200
+        self.headers = headers or {}
+        self.url = entry['url']
+
+    @property
+    def text(self):
+        """与requests相同，按响应的编码解码，无法解码的字节替换"""
+        try:
+            return self.content.decode(self.encoding, errors='replace')
+        except LookupError:
+            return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+class HttpCache:
+    """保存在磁盘上的页面响应缓存"""
+
+    def __init__(self, directory=HTTP_CACHE_DIR):
+        """
+        初始化缓存
+
+        Args:
+            directory: 缓存目录，首次写入时创建
+        """
+        self.directory = directory
+
+    def _path(self, key):
+        """缓存键对应的文件路径"""
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def get(self, url):
+        """
+        读取缓存条目
+
+        Args:
+            url: 完整URL或以/开头的路径
+
+        Returns:
+            字典，包含url、etag、last_modified、body_hash、stored_at、content和encoding，不存在时返回None
+        """
+        path = self._path(normalize_url(url))
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # 旧版本只保存了解码后的文本，无法还原原始内容，当作没有缓存
+            return entry if 'content' in entry else None
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取HTTP缓存失败: {url}, 错误: {str(e)}")
+            return None
+
+    def conditional_headers(self, entry):
+        """
+        根据缓存条目生成条件请求头
+
+        Args:
+            entry: 缓存条目字典
+
+        Returns:
+            字典，If-None-Match和If-Modified-Since请求头
+        """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, response, digest, previous=None):
+        """
+        保存响应，没有ETag和Last-Modified的响应无法发起条件请求，不保存
+
+        Args:
+            url: 完整URL或以/开头的路径
+            response: requests.Response对象
+            digest: 响应内容的哈希值
+            previous: 请求前读取的缓存条目，内容和验证器都没有变化时不重写文件
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        if previous and (previous['body_hash'], previous['etag'], previous['last_modified']) == (digest, etag, last_modified):
+            return
+        key = normalize_url(url)
+        entry = {
+            'url': response.url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'body_hash': digest,
+            'stored_at': int(time.time()),
+            # 保存原始字节和编码，304时还原的text与直接请求时一致
+            'content': base64.b64encode(response.content).decode('ascii'),
+            'encoding': response.encoding or getattr(response, 'apparent_encoding', None)
+        }
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，并发读取时不会读到写了一半的内容
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"写入HTTP缓存失败: {url}, 错误: {str(e)}")
+
+    def invalidate(self, url):
+        """
+        删除缓存条目
+
+        Args:
+            url: 完整URL或以/开头的路径
+        """
+        try:
+            os.remove(self._path(normalize_url(url)))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"删除HTTP缓存失败: {url}, 错误: {str(e)}")
+
+class ParsedMemo:
+    """按页面URL保存最近一次的内容哈希和解析结果"""
+
+    def __init__(self, maxsize=PAGE_CACHE_SIZE):
+        """
+        初始化解析结果缓存
+
+        Args:
+            maxsize: 最多保存的页面数
+        """
+        self.maxsize = maxsize
+        # {规范化URL: (内容哈希, 解析结果)}，按最近使用排序
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, url, result):
+        """
+        页面内容与上次解析时相同时返回上次的解析结果
+
+        Args:
+            url: 页面URL
+            result: make_request的返回值
+
+        Returns:
+            上次解析结果的副本，内容有变化或没有记录时返回None
+        """
+        digest = result.get('body_hash')
+        if not digest:
+            return None
+        key = normalize_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != digest:
+                return None
+            self._entries.move_to_end(key)
+            value = entry[1]
+        logger.info(f"页面内容没有变化，使用上次的解析结果: {key}")
+        return copy.deepcopy(value)
+
+    def store(self, url, result, value):
+        """
+        记录页面的解析结果
+
+        Args:
+            url: 页面URL
+            result: make_request的返回值
+            value: 解析结果，为None时不记录
+
+        Returns:
+            传入的解析结果，方便在return语句中使用
+        """
+        digest = result.get('body_hash')
+        if value is None or not digest:
+            return value
+        key = normalize_url(url)
+        with self._lock:
+            self._entries[key] = (digest, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+# 全局实例
+http_cache = HttpCache()
+parsed_memo = ParsedMemo()
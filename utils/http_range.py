@@ -0,0 +1,85 @@
+"""
+HTTP范围请求工具模块
+
+/video接口使用的Range和If-Range处理，不依赖Flask请求上下文
+"""
+import calendar
+
+def resolve_ranges(ranges, file_size):
+    """
+    把Range头中的范围转换为闭区间列表，丢弃无法满足的范围
+    
+    Args:
+        ranges: werkzeug解析出的(start, stop)列表，stop不包含，后缀范围的start为负数
+        file_size: 文件大小
+        
+    Returns:
+        列表，包含(起始字节, 结束字节)
+    """
+    resolved = []
+    for start, stop in ranges:
+        if start < 0:
+            start = max(0, file_size + start)
+            stop = file_size
+        else:
+            stop = file_size if stop is None else min(stop, file_size)
+        if start < stop:
+            resolved.append((start, stop - 1))
+    return resolved
+
+def if_range_matches(if_range, raw_header, etag, last_modified):
+    """
+    检查If-Range条件，没有If-Range或与当前文件一致时才返回部分内容
+    
+    Args:
+        if_range: werkzeug解析出的IfRange对象
+        raw_header: If-Range请求头的原始值，用于识别弱ETag
+        etag: 当前文件的强ETag
+        last_modified: 当前文件的修改时间戳
+        
+    Returns:
+        布尔值
+    """
+    if if_range.etag:
+        # If-Range只能使用强比较
+        return if_range.etag == etag and not (raw_header or '').startswith('W/')
+    if if_range.date:
+        return calendar.timegm(if_range.date.utctimetuple()) == last_modified
+    return True
+
+class RangeFile:
+    """
+    只能读取文件中一段范围的文件对象，交给wsgi.file_wrapper发送
+
+    保留fileno()，gunicorn等服务器从当前位置按Content-Length调用os.sendfile；
+    不支持sendfile的服务器逐块调用read()，读到范围末尾即结束
+    """
+
+    def __init__(self, f, start, length):
+        """
+        Args:
+            f: 以二进制模式打开的文件
+            start: 起始字节
+            length: 可读取的字节数
+        """
+        f.seek(start)
+        self._file = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        """读取不超过剩余长度的内容"""
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        """底层文件描述符"""
+        return self._file.fileno()
+
+    def close(self):
+        """关闭底层文件"""
+        self._file.close()
@@ -4,20 +4,32 @@
 import os
 import re
 import sys
+import time
 import queue
 import base64
+import hashlib
+import threading
 import platform
-import requests
 import urllib3
 import subprocess
+from urllib.parse import urljoin, urlparse
 from concurrent.futures import ThreadPoolExecutor
 from database import operations
-from config import VIDEO_DIR
+from config import (
+    VIDEO_DIR, M3U8_ENGINE, M3U8_RESUME, M3U8_SEGMENT_CHECKSUM, MAX_SEGMENT_CONCURRENCY,
+    M3U8_VARIANT_POLICY, M3U8_MAX_HEIGHT, M3U8_MAX_BANDWIDTH, M3U8_RANGE_CHUNK_SIZE, M3U8_RANGE_MERGE_GAP
+)
 from utils.logging import setup_logger
+from utils.network import get_session
+from utils.progress import progress_writer
+from tasks.liveness import liveness
 
 # 配置日志
 logger = setup_logger(__name__)
 
+# 所有剧集共享的分片下载名额，多集并行时总并发不超过该值
+segment_slots = threading.BoundedSemaphore(MAX_SEGMENT_CONCURRENCY)
+
 
 class ThreadPoolExecutorWithQueueSizeLimit(ThreadPoolExecutor):
     """
@@ -30,11 +42,606 @@ class ThreadPoolExecutorWithQueueSizeLimit(ThreadPoolExecutor):
         self._work_queue = queue.Queue(max_workers * 2)
 
 
-def make_sum():
-    ts_num = 0
-    while True:
-        yield ts_num
-        ts_num += 1
+# 属性列表中的一项，如 METHOD=AES-128 或 URI="key.key"
+ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+URI_ATTRIBUTE_RE = re.compile(r'URI="[^"]*"')
+
+
+def parse_attributes(value):
+    """
+    解析标签的属性列表
+
+    :param value: 标签冒号之后的文本
+    :return: 字典，带引号的值会去掉引号
+    """
+    return {name: raw[1:-1] if len(raw) >= 2 and raw[0] == raw[-1] == '"' else raw
+            for name, raw in ATTRIBUTE_RE.findall(value)}
+
+
+def parse_byterange(value):
+    """
+    解析 <长度>[@<偏移>] 形式的字节范围
+
+    :param value: 字节范围文本
+    :return: (长度, 偏移)，省略偏移时偏移为None
+    """
+    length, _, offset = value.strip().partition('@')
+    return int(length), int(offset) if offset else None
+
+
+class M3u8Key:
+    """
+    EXT-X-KEY 加密信息
+
+    :param method: 加密方式，如 AES-128
+    :param uri: key的完整链接
+    :param iv: 初始向量文本
+    :param raw: 标签原始属性文本，写入本地播放列表时只替换其中的URI
+    """
+
+    def __init__(self, method, uri=None, iv=None, raw=''):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.raw = raw
+
+
+class M3u8Map:
+    """
+    EXT-X-MAP 初始化分片
+
+    :param uri: 初始化分片的完整链接
+    :param byterange: (长度, 偏移)，没有时为None
+    """
+
+    def __init__(self, uri, byterange=None):
+        self.uri = uri
+        self.byterange = byterange
+
+
+class M3u8Segment:
+    """
+    媒体分片
+
+    :param sequence: 分片序号
+    :param uri: 分片的完整链接
+    :param duration: 时长(秒)
+    :param title: EXTINF中的标题
+    :param byterange: (长度, 偏移)，分片只是资源中的一段时使用，没有时为None
+    :param key: 适用的M3u8Key，未加密时为None
+    :param map: 适用的M3u8Map，没有时为None
+    :param discontinuity: 分片前是否有EXT-X-DISCONTINUITY
+    """
+
+    def __init__(self, sequence, uri, duration, title='', byterange=None, key=None, map=None, discontinuity=False):
+        self.sequence = sequence
+        self.uri = uri
+        self.duration = duration
+        self.title = title
+        self.byterange = byterange
+        self.key = key
+        self.map = map
+        self.discontinuity = discontinuity
+
+
+class M3u8Variant:
+    """
+    主播放列表中的子流
+
+    :param uri: 子播放列表的完整链接
+    :param bandwidth: 峰值带宽(bit/s)
+    :param average_bandwidth: 平均带宽(bit/s)
+    :param resolution: (宽, 高)，没有时为None
+    :param codecs: 编码
+    """
+
+    def __init__(self, uri, bandwidth=0, average_bandwidth=0, resolution=None, codecs=''):
+        self.uri = uri
+        self.bandwidth = bandwidth
+        self.average_bandwidth = average_bandwidth
+        self.resolution = resolution
+        self.codecs = codecs
+
+
+class M3u8Playlist:
+    """
+    解析后的播放列表，主播放列表只有variants，媒体播放列表只有segments
+
+    :param url: 播放列表的完整链接(重定向后)，相对链接以它为基准
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.version = None
+        self.target_duration = None
+        self.media_sequence = 0
+        self.playlist_type = None
+        self.endlist = False
+        self.variants = []
+        self.segments = []
+
+    @property
+    def is_master(self):
+        return bool(self.variants)
+
+
+class M3u8Parser:
+    """
+    逐行解析m3u8播放列表，可以边下载边解析
+
+    :param url: 播放列表的完整链接，用于把相对链接转换为完整链接
+    """
+
+    def __init__(self, url):
+        self._playlist = M3u8Playlist(url)
+        self._sequence = 0
+        self._duration = None
+        self._title = ''
+        self._byterange = None
+        self._discontinuity = False
+        self._key = None
+        self._map = None
+        self._stream_inf = None
+        # 上一个带字节范围的分片的(链接, 结束位置)，省略偏移的范围紧接其后
+        self._last_range = (None, 0)
+
+    def _resolve(self, uri):
+        return urljoin(self._playlist.url, uri)
+
+    def feed(self, line):
+        """
+        解析一行
+
+        :param line: 播放列表中的一行
+        """
+        line = line.strip()
+        if not line:
+            return
+        if line.startswith('#'):
+            try:
+                self._tag(line)
+            except (ValueError, KeyError) as e:
+                # 单个标签格式错误时只忽略该标签，不影响整个播放列表
+                logger.warning(f"忽略格式错误的标签: {line}, 错误: {str(e)}")
+        elif self._stream_inf is not None:
+            self._add_variant(self._resolve(line))
+        else:
+            self._add_segment(self._resolve(line))
+
+    def _tag(self, line):
+        """解析标签行，不认识的标签忽略"""
+        name, _, value = line.partition(':')
+        playlist = self._playlist
+        if name == '#EXTINF':
+            duration, _, title = value.partition(',')
+            self._duration = float(duration)
+            self._title = title.strip()
+        elif name == '#EXT-X-BYTERANGE':
+            self._byterange = parse_byterange(value)
+        elif name == '#EXT-X-KEY':
+            attributes = parse_attributes(value)
+            method = attributes.get('METHOD', 'NONE')
+            if method == 'NONE':
+                self._key = None
+            else:
+                uri = attributes.get('URI')
+                self._key = M3u8Key(method, self._resolve(uri) if uri else None, attributes.get('IV'), value)
+        elif name == '#EXT-X-MAP':
+            attributes = parse_attributes(value)
+            byterange = parse_byterange(attributes['BYTERANGE']) if 'BYTERANGE' in attributes else None
+            if byterange and byterange[1] is None:
+                byterange = (byterange[0], 0)
+            self._map = M3u8Map(self._resolve(attributes['URI']), byterange)
+        elif name == '#EXT-X-DISCONTINUITY':
+            self._discontinuity = True
+        elif name == '#EXT-X-STREAM-INF':
+            self._stream_inf = parse_attributes(value)
+        elif name == '#EXT-X-TARGETDURATION':
+            playlist.target_duration = int(float(value))
+        elif name == '#EXT-X-MEDIA-SEQUENCE':
+            playlist.media_sequence = self._sequence = int(value)
+        elif name == '#EXT-X-VERSION':
+            playlist.version = int(value)
+        elif name == '#EXT-X-PLAYLIST-TYPE':
+            playlist.playlist_type = value.strip()
+        elif name == '#EXT-X-ENDLIST':
+            playlist.endlist = True
+
+    def _add_variant(self, uri):
+        """记录EXT-X-STREAM-INF之后的子播放列表"""
+        attributes = self._stream_inf
+        self._stream_inf = None
+        resolution = None
+        width, _, height = attributes.get('RESOLUTION', '').partition('x')
+        if width.isdigit() and height.isdigit():
+            resolution = (int(width), int(height))
+        self._playlist.variants.append(M3u8Variant(
+            uri,
+            bandwidth=int(attributes.get('BANDWIDTH') or 0),
+            average_bandwidth=int(attributes.get('AVERAGE-BANDWIDTH') or 0),
+            resolution=resolution,
+            codecs=attributes.get('CODECS', '')
+        ))
+
+    def _add_segment(self, uri):
+        """记录分片，EXTINF、BYTERANGE和DISCONTINUITY只作用于下一个分片"""
+        byterange = self._byterange
+        if byterange is not None:
+            length, offset = byterange
+            if offset is None:
+                last_uri, last_end = self._last_range
+                offset = last_end if last_uri == uri else 0
+            byterange = (length, offset)
+            self._last_range = (uri, offset + length)
+        self._playlist.segments.append(M3u8Segment(
+            self._sequence, uri, self._duration, self._title, byterange,
+            self._key, self._map, self._discontinuity
+        ))
+        self._sequence += 1
+        self._duration = None
+        self._title = ''
+        self._byterange = None
+        self._discontinuity = False
+
+    def close(self):
+        """
+        结束解析
+
+        :return: M3u8Playlist
+        """
+        return self._playlist
+
+
+def parse_playlist(text, url):
+    """
+    解析完整的播放列表文本
+
+    :param text: 播放列表内容
+    :param url: 播放列表的完整链接
+    :return: M3u8Playlist
+    """
+    parser = M3u8Parser(url)
+    for line in text.splitlines():
+        parser.feed(line)
+    return parser.close()
+
+
+def select_variant(variants, policy=M3U8_VARIANT_POLICY, max_height=M3U8_MAX_HEIGHT, max_bandwidth=M3U8_MAX_BANDWIDTH):
+    """
+    按策略选择子流
+
+    先排除分辨率或带宽超过限制的子流(全部超过时只保留带宽最低的)，
+    highest选择剩余中分辨率最高、带宽最高的，lowest选择带宽最低的
+
+    :param variants: M3u8Variant列表
+    :param policy: highest 或 lowest
+    :param max_height: 最大分辨率高度，0表示不限制
+    :param max_bandwidth: 最大带宽，0表示不限制
+    :return: M3u8Variant，列表为空时返回None
+    """
+    if not variants:
+        return None
+
+    def fits(variant):
+        if max_height and variant.resolution and variant.resolution[1] > max_height:
+            return False
+        if max_bandwidth and variant.bandwidth and variant.bandwidth > max_bandwidth:
+            return False
+        return True
+
+    candidates = [variant for variant in variants if fits(variant)]
+    if not candidates:
+        candidates = [min(variants, key=lambda v: v.bandwidth)]
+    if policy == 'lowest':
+        return min(candidates, key=lambda v: v.bandwidth)
+    return max(candidates, key=lambda v: (v.resolution[1] if v.resolution else 0, v.bandwidth))
+
+
+class RangeChunk:
+    """
+    合并后的一次Range请求
+
+    :param start: 起始字节
+    :param end: 结束字节(不含)
+    :param segments: 覆盖的分片序号列表
+    """
+
+    def __init__(self, start, end, segments):
+        self.start = start
+        self.end = end
+        self.segments = segments
+        self.done = False
+
+    @property
+    def key(self):
+        return f"{self.start}-{self.end}"
+
+
+class RangedResource:
+    """
+    通过EXT-X-BYTERANGE引用的单个大文件，下载到预分配的本地文件中的相同位置
+
+    :param uri: 资源的完整链接
+    :param local_name: 保存在分片目录中的文件名
+    :param chunks: RangeChunk列表
+    """
+
+    def __init__(self, uri, local_name, chunks):
+        self.uri = uri
+        self.local_name = local_name
+        self.chunks = chunks
+        self.size = max(chunk.end for chunk in chunks)
+        self.full = False  # 服务器不支持Range时已下载整个文件
+        self.lock = threading.Lock()
+
+
+def plan_ranges(segments, chunk_size=M3U8_RANGE_CHUNK_SIZE, merge_gap=M3U8_RANGE_MERGE_GAP):
+    """
+    把带字节范围的分片按资源分组，相邻或间隔很小的范围合并为一次请求
+
+    :param segments: M3u8Segment列表
+    :param chunk_size: 合并后单次请求的最大字节数，超过该大小的单个分片不拆分
+    :param merge_gap: 两个范围之间的间隔不超过该字节数时合并，间隔部分也会被下载
+    :return: 字典，{资源链接: [(起始字节, 结束字节(不含), [分片序号])]}，按起始字节排序
+    """
+    ranges = {}
+    for k, segment in enumerate(segments):
+        if segment.byterange:
+            length, offset = segment.byterange
+            ranges.setdefault(segment.uri, []).append((offset, offset + length, k))
+
+    plans = {}
+    for uri, items in ranges.items():
+        merged = []
+        for start, end, k in sorted(items):
+            if merged:
+                last_start, last_end, indexes = merged[-1]
+                if start - last_end <= merge_gap and max(end, last_end) - last_start <= chunk_size:
+                    merged[-1] = (last_start, max(end, last_end), indexes + [k])
+                    continue
+            merged.append((start, end, [k]))
+        plans[uri] = merged
+    return plans
+
+
+class SegmentStore:
+    """
+    管理剧集目录下已下载的ts分片，支持断点续传
+
+    完整的分片保存为 k.ts，并在清单文件中记录大小、分片链接(可选sha256)；
+    未完成的分片保存为 k.ts.part，开始下载时先在清单中记录分片链接，
+    下次通过HTTP Range请求从已写入的位置继续下载。
+    清单中的链接与本次播放列表不一致(换了子流或播放列表有变化)的本地文件会被删除后重新下载。
+    多线程下载和asyncio下载共用这里的校验和提交逻辑。
+
+    :param file_path: 剧集分片目录
+    :param checksum: 是否记录并校验分片的sha256
+    """
+
+    MANIFEST_NAME = '.manifest'
+    PARTIAL = -1  # 清单中未完成分片的大小
+
+    def __init__(self, file_path, checksum=M3U8_SEGMENT_CHECKSUM):
+        self._file_path = file_path
+        self._checksum = checksum
+        self._manifest_path = os.path.join(file_path, self.MANIFEST_NAME)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._load_manifest()
+
+    def _load_manifest(self):
+        """读取清单文件，同一分片以最后一条记录为准，没有链接的旧记录视为不匹配"""
+        if not os.path.exists(self._manifest_path):
+            return
+        with open(self._manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) not in (3, 4):
+                    continue
+                try:
+                    size = int(parts[1])
+                except ValueError:
+                    continue
+                digest = None if parts[2] == '-' else parts[2]
+                uri = parts[3] if len(parts) == 4 else None
+                self._entries[parts[0]] = (size, digest, uri)
+
+    @staticmethod
+    def _identity(uri):
+        """分片链接去掉查询参数，签名、时间戳等参数变化不影响续传"""
+        return uri.split('?', 1)[0] if uri else uri
+
+    def _matches(self, key, uri):
+        """清单中的记录是否属于该分片链接"""
+        entry = self._entries.get(key)
+        return entry is not None and entry[2] is not None and entry[2] == self._identity(uri)
+
+    @staticmethod
+    def _sha256(path):
+        """计算文件的sha256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def is_complete(self, name, uri):
+        """
+        检查分片是否已完整下载，校验失败的分片会被删除
+
+        :param name: 不含扩展名的分片路径
+        :param uri: 分片链接
+        :return: 布尔值
+        """
+        key = os.path.basename(name)
+        path = name + '.ts'
+        if not self._matches(key, uri) or not os.path.exists(path):
+            return False
+        size, digest, _ = self._entries[key]
+        if os.path.getsize(path) != size:
+            return False
+        if self._checksum and digest and self._sha256(path) != digest:
+            logger.warning(f"分片校验失败，重新下载: {path}")
+            self.discard(name)
+            return False
+        return True
+
+    def resume_offset(self, name, uri):
+        """
+        获取未完成分片已写入的字节数
+
+        清单中没有该链接记录的本地文件会被删除，从头下载；
+        链接一致但大小不符的 k.ts 当作未完成分片，通过Range请求确认其完整性
+
+        :param name: 不含扩展名的分片路径
+        :param uri: 分片链接
+        :return: 整数，续传起始位置
+        """
+        key = os.path.basename(name)
+        if not self._matches(key, uri):
+            self.discard(name)
+            self._record(key, self.PARTIAL, None, uri)
+            return 0
+        part = name + '.ts.part'
+        if os.path.exists(name + '.ts'):
+            os.replace(name + '.ts', part)
+        if os.path.exists(part):
+            return os.path.getsize(part)
+        return 0
+
+    @staticmethod
+    def request_headers(headers, offset):
+        """生成分片请求头，续传时附带Range"""
+        if not offset:
+            return headers
+        headers = dict(headers)
+        headers['Range'] = f'bytes={offset}-'
+        return headers
+
+    def open_mode(self, name, status_code, headers, offset):
+        """
+        根据响应确定分片文件的写入方式
+
+        :param name: 不含扩展名的分片路径
+        :param status_code: HTTP状态码
+        :param headers: 响应头
+        :param offset: 请求的续传起始位置
+        :return: (写入模式, 分片总大小)，写入模式为 "wb"、"ab" 或 None(已完整，无需写入)
+        """
+        content_range = headers.get('Content-Range', '')
+        if status_code == 200:
+            length = headers.get('Content-Length')
+            if headers.get('Content-Encoding', 'identity') != 'identity':
+                # Content-Length是压缩后的大小，写入的是解压后的内容，无法用于校验
+                return 'wb', None
+            return 'wb', int(length) if length and length.isdigit() else None
+        if status_code == 206:
+            match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', content_range)
+            if match and int(match.group(1)) == offset:
+                total = match.group(2)
+                return 'ab', int(total) if total.isdigit() else None
+            self.discard(name)
+            raise IOError(f"续传范围不匹配: {content_range}")
+        if status_code == 416:
+            match = re.match(r'bytes \*/(\d+)', content_range)
+            if match and int(match.group(1)) == offset:
+                return None, offset
+            self.discard(name)
+            raise IOError(f"续传范围无效: {content_range}")
+        raise IOError(f"分片请求失败，状态码: {status_code}")
+
+    def commit(self, name, expected_size, uri):
+        """
+        校验未完成分片的大小并将其标记为完整分片
+
+        :param name: 不含扩展名的分片路径
+        :param expected_size: 服务器声明的分片大小，未知时为None
+        :param uri: 分片链接
+        """
+        part = name + '.ts.part'
+        size = os.path.getsize(part)
+        if expected_size is not None and size != expected_size:
+            raise IOError(f"分片大小不完整: {size}/{expected_size}")
+        digest = self._sha256(part) if self._checksum else None
+        os.replace(part, name + '.ts')
+        self._record(os.path.basename(name), size, digest, uri)
+
+    def _record(self, key, size, digest, uri):
+        """在清单中追加一条记录"""
+        uri = self._identity(uri)
+        with self._lock:
+            self._entries[key] = (size, digest, uri)
+            with open(self._manifest_path, 'a', encoding='utf-8') as f:
+                f.write(f"{key}\t{size}\t{digest or '-'}\t{uri}\n")
+
+    @classmethod
+    def _resource_identity(cls, uri, byterange):
+        """小文件的清单链接，只下载其中一段时附带字节范围"""
+        uri = cls._identity(uri)
+        return f'{uri}#{byterange[0]}@{byterange[1]}' if byterange else uri
+
+    def is_resource_complete(self, local_name, uri, byterange=None):
+        """
+        检查key、初始化分片等小文件是否已下载，链接或sha256不一致的文件会被删除
+
+        :param local_name: 分片目录中的文件名
+        :param uri: 文件链接
+        :param byterange: (长度, 偏移)，只下载资源中的这一段
+        :return: 布尔值
+        """
+        path = os.path.join(self._file_path, local_name)
+        if not os.path.exists(path):
+            return False
+        entry = self._entries.get(local_name)
+        if (entry is None or entry[2] != self._resource_identity(uri, byterange)
+                or os.path.getsize(path) != entry[0] or self._sha256(path) != entry[1]):
+            logger.warning(f"文件与清单记录不一致，重新下载: {path}")
+            os.remove(path)
+            return False
+        return True
+
+    def commit_resource(self, local_name, uri, byterange, content):
+        """
+        先写入临时文件再替换，并在清单中记录小文件的链接和sha256
+
+        :param local_name: 分片目录中的文件名
+        :param uri: 文件链接
+        :param byterange: (长度, 偏移)，只下载资源中的这一段
+        :param content: 文件内容
+        """
+        path = os.path.join(self._file_path, local_name)
+        with open(path + '.part', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.part', path)
+        self._record(local_name, len(content), hashlib.sha256(content).hexdigest(),
+                     self._resource_identity(uri, byterange))
+
+    def is_range_complete(self, resource, chunk):
+        """
+        检查大文件中的一段字节范围是否已下载
+
+        :param resource: RangedResource
+        :param chunk: RangeChunk
+        :return: 布尔值
+        """
+        path = os.path.join(self._file_path, resource.local_name)
+        return (self._matches(f"{resource.local_name}@{chunk.key}", resource.uri)
+                and os.path.exists(path) and os.path.getsize(path) >= chunk.end)
+
+    def commit_range(self, resource, chunk):
+        """
+        记录大文件中的一段字节范围已下载完成
+
+        :param resource: RangedResource
+        :param chunk: RangeChunk
+        """
+        self._record(f"{resource.local_name}@{chunk.key}", chunk.end - chunk.start, None, resource.uri)
+
+    def discard(self, name):
+        """删除分片的所有本地数据"""
+        for path in (name + '.ts', name + '.ts.part'):
+            if os.path.exists(path):
+                os.remove(path)
 
 
 class M3u8Download:
@@ -47,9 +654,11 @@ class M3u8Download:
     :param max_workers: 多线程最大线程数
     :param num_retries: 重试次数
     :param base64_key: base64编码的字符串
+    :param engine: 分片下载引擎 "thread" 或 "asyncio"，默认使用配置 M3U8_ENGINE
+    :param resume: 是否保留已下载的分片断点续传，默认使用配置 M3U8_RESUME
     """
 
-    def __init__(self, url, anime_id, episode_id_clean, task_id, episode_number, max_workers=64, num_retries=5, base64_key=None):
+    def __init__(self, url, anime_id, episode_id_clean, task_id, episode_number, max_workers=64, num_retries=5, base64_key=None, engine=None, resume=None):
         self._url = url
         self._anime_id = anime_id
         self._episode_id_clean = episode_id_clean
@@ -58,31 +667,52 @@ class M3u8Download:
         self._episode_number = episode_number
         self._max_workers = max_workers
         self._num_retries = num_retries
+        self._engine = engine or M3U8_ENGINE
         # VIDEO_DIR
         self._file_path = os.path.join(VIDEO_DIR,f"{self._anime_id}", f"ep{self._episode_id_clean}")
         self._short_file_path = os.path.join( f"{self._anime_id}", f"ep{self._episode_id_clean}")
-        self._front_url = None
+        self._segments = []
         self._ts_url_list = []
+        # {资源链接: RangedResource}，带EXT-X-BYTERANGE的分片按资源整体下载
+        self._range_resources = {}
         self._success_sum = 0
         self._ts_sum = 0
         self._progress = 0
+        self._beat_at = 0
         self._key = base64.b64decode(base64_key.encode()) if base64_key else None
         self._headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_6) \
         AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.105 Safari/537.36'}
 
         urllib3.disable_warnings()
-        #避免下载过程出现异常
-        self.delete_file()
+        if resume is None:
+            resume = M3U8_RESUME
+        if not resume:
+            self.delete_file()
+        if not os.path.exists(self._file_path):
+            os.makedirs(self._file_path)
+        self._store = SegmentStore(self._file_path)
         self.get_m3u8_info(self._url, self._num_retries)
-        logger.info('Downloading: %s' % self._name, 'Save path: %s' % self._file_path, 'task_id: %s' % self._task_id, 'episode_number: %s' % self._episode_number, sep='\n')
-        with ThreadPoolExecutorWithQueueSizeLimit(self._max_workers) as pool:
-            for k, ts_url in enumerate(self._ts_url_list):
-                pool.submit(self.download_ts, ts_url, os.path.join(self._file_path, str(k)), self._num_retries)
-        if self._success_sum == self._ts_sum:
+        logger.info(f"Downloading: {self._name}, Save path: {self._file_path}, task_id: {self._task_id}, episode_number: {self._episode_number}, engine: {self._engine}")
+        # 各线程只在内存中累加进度，由progress_writer统一写入数据库
+        self._tracker = progress_writer.track(self._task_id, self._episode_number, self._ts_sum)
+        try:
+            with ThreadPoolExecutorWithQueueSizeLimit(self._max_workers) as pool:
+                # 字节范围请求总是由线程池下载，普通分片按引擎选择下载方式
+                self.submit_ranges(pool)
+                if not (self._engine == 'asyncio' and self.download_async()):
+                    for k, ts_url in self.segment_jobs():
+                        pool.submit(self.download_ts, ts_url, os.path.join(self._file_path, str(k)), self._num_retries)
+        finally:
+            progress_writer.untrack(self._tracker)
+        self._success_sum = self._tracker.completed
+        if self._ts_sum and self._success_sum == self._ts_sum:
             # self.output_mp4()
             # self.delete_file()
             file_size = os.path.getsize(self._file_path + '.m3u8')
             for file in os.listdir(self._file_path):
+                # 只统计分片、大文件和key等视频文件，不包括清单和未完成的分片
+                if file.startswith('.') or file.endswith('.part'):
+                    continue
                 file_size += os.path.getsize(os.path.join(self._file_path, file))
             self._progress = 100
             operations.update_download_progress(self._task_id, self._episode_number, self._progress , self._short_file_path + '.m3u8', file_size)
@@ -92,65 +722,262 @@ class M3u8Download:
 
     def get_m3u8_info(self, m3u8_url, num_retries):
         """
-        获取m3u8信息
+        获取m3u8信息，主播放列表按 M3U8_VARIANT_POLICY 选择子流
         """
         try:
-            with requests.get(m3u8_url, timeout=(3, 30), verify=False, headers=self._headers) as res:
-                self._front_url = res.url.split(res.request.path_url)[0]
-                if "EXT-X-STREAM-INF" in res.text:  # 判定为顶级M3U8文件
-                    for line in res.text.split('\n'):
-                        if "#" in line:
-                            continue
-                        elif line.startswith('http'):
-                            self._url = line
-                        elif line.startswith('/'):
-                            self._url = self._front_url + line
-                        else:
-                            self._url = self._url.rsplit("/", 1)[0] + '/' + line
-                    self.get_m3u8_info(self._url, self._num_retries)
-                else:
-                    m3u8_text_str = res.text
-                    self.get_ts_url(m3u8_text_str)
+            with get_session(m3u8_url).get(m3u8_url, stream=True, timeout=(3, 30), verify=False, headers=self._headers) as res:
+                if res.status_code != 200:
+                    raise IOError(f"播放列表请求失败，状态码: {res.status_code}")
+                res.encoding = res.encoding or 'utf-8'
+                # 相对链接以重定向后的地址为基准
+                parser = M3u8Parser(res.url)
+                for line in res.iter_lines(decode_unicode=True):
+                    parser.feed(line)
+                playlist = parser.close()
         except Exception as e:
-            print(e)
+            logger.warning(f"获取m3u8信息失败: {m3u8_url}, 错误: {str(e)}")
             if num_retries > 0:
                 self.get_m3u8_info(m3u8_url, num_retries - 1)
+            return
 
-    def get_ts_url(self, m3u8_text_str):
+        if playlist.is_master:  # 判定为顶级M3U8文件
+            variant = select_variant(playlist.variants)
+            logger.info(f"选择子流: {variant.uri}, 带宽: {variant.bandwidth}, 分辨率: {variant.resolution}, "
+                        f"共 {len(playlist.variants)} 个子流")
+            self._url = variant.uri
+            self.get_m3u8_info(self._url, self._num_retries)
+        else:
+            self._url = playlist.url
+            self.get_ts_url(playlist)
+
+    def get_ts_url(self, playlist):
         """
-        获取每一个ts文件的链接
+        获取每一个ts文件的链接，下载key和初始化分片，并写入指向本地文件的播放列表
+
+        :param playlist: 解析后的媒体播放列表
         """
         if not os.path.exists(self._file_path):
             os.mkdir(self._file_path)
-        new_m3u8_str = ''
-        ts = make_sum()
-        for line in m3u8_text_str.split('\n'):
-            if "#" in line:
-                if "EXT-X-KEY" in line and "URI=" in line:
-                    if os.path.exists(os.path.join(self._file_path, 'key')):
-                        continue
-                    key = self.download_key(line, 5)
-                    if key:
-                        new_m3u8_str += f'{key}\n'
-                        continue
-                new_m3u8_str += f'{line}\n'
-                if "EXT-X-ENDLIST" in line:
-                    break
-            else:
-                if line.startswith('http'):
-                    self._ts_url_list.append(line)
-                elif line.startswith('/'):
-                    self._ts_url_list.append(self._front_url + line)
-                else:
-                    self._ts_url_list.append(self._url.rsplit("/", 1)[0] + '/' + line)
-                # new_m3u8_str += (os.path.join(self._file_path, str(next(ts))) + '\n')
-                new_m3u8_str += (os.path.join(".\\", self._name, str(next(ts))) + '.ts\n')
-        self._ts_sum = next(ts)
+        self._segments = playlist.segments
+        self._ts_url_list = [segment.uri for segment in playlist.segments]
+        self._ts_sum = len(playlist.segments)
+        self.prepare_ranges()
+
+        # 同一个链接的key或初始化分片只下载一次，key轮换时依次保存为key、key1、key2...
+        key_paths = {}
+        map_paths = {}
+        for segment in playlist.segments:
+            key = segment.key
+            if key is not None and key.uri and key.uri not in key_paths:
+                local_name = 'key' if not key_paths else f'key{len(key_paths)}'
+                key_paths[key.uri] = self.download_key(key, local_name, 5)
+            init = segment.map
+            if init is not None and (init.uri, init.byterange) not in map_paths:
+                local_name = 'init.mp4' if not map_paths else f'init{len(map_paths)}.mp4'
+                map_paths[(init.uri, init.byterange)] = self.download_resource(init.uri, local_name, init.byterange, 5)
+
         with open(self._file_path + '.m3u8', "wb") as f:
+            content = self.render_playlist(playlist, key_paths, map_paths)
             if platform.system() == 'Windows':
-                f.write(new_m3u8_str.encode('gbk'))
+                f.write(content.encode('gbk'))
             else:
-                f.write(new_m3u8_str.encode('utf-8'))
+                f.write(content.encode('utf-8'))
+
+    def render_playlist(self, playlist, key_paths, map_paths):
+        """
+        生成指向本地分片的播放列表，路径相对于播放列表所在目录
+
+        :param playlist: 解析后的媒体播放列表
+        :param key_paths: {key链接: 本地路径}，下载失败的为None，保留原链接
+        :param map_paths: {(初始化分片链接, 字节范围): 本地路径}
+        :return: 播放列表文本
+        """
+        lines = ['#EXTM3U']
+        if playlist.version:
+            lines.append(f'#EXT-X-VERSION:{playlist.version}')
+        if playlist.target_duration is not None:
+            lines.append(f'#EXT-X-TARGETDURATION:{playlist.target_duration}')
+        lines.append(f'#EXT-X-MEDIA-SEQUENCE:{playlist.media_sequence}')
+        if playlist.playlist_type:
+            lines.append(f'#EXT-X-PLAYLIST-TYPE:{playlist.playlist_type}')
+        current_key = current_map = None
+        for k, segment in enumerate(playlist.segments):
+            if segment.discontinuity:
+                lines.append('#EXT-X-DISCONTINUITY')
+            if segment.key is not current_key:
+                current_key = segment.key
+                if current_key is None:
+                    lines.append('#EXT-X-KEY:METHOD=NONE')
+                else:
+                    local_path = key_paths.get(current_key.uri)
+                    raw = current_key.raw
+                    if local_path:
+                        raw = URI_ATTRIBUTE_RE.sub(f'URI="{local_path}"', raw)
+                    lines.append(f'#EXT-X-KEY:{raw}')
+            if segment.map is not None and segment.map is not current_map:
+                current_map = segment.map
+                local_path = map_paths.get((current_map.uri, current_map.byterange))
+                lines.append(f'#EXT-X-MAP:URI="{local_path or current_map.uri}"')
+            duration = segment.duration if segment.duration is not None else playlist.target_duration or 0
+            lines.append(f'#EXTINF:{duration},{segment.title}')
+            if segment.byterange:
+                # 大文件按原位置保存，播放时按原范围读取
+                lines.append(f'#EXT-X-BYTERANGE:{segment.byterange[0]}@{segment.byterange[1]}')
+                lines.append(f'{self._name}/{self._range_resources[segment.uri].local_name}')
+            else:
+                lines.append(f'{self._name}/{k}.ts')
+        if playlist.endlist:
+            lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def segment_jobs(self):
+        """
+        获取需要单独下载的普通分片
+
+        :return: 列表，(分片序号, 分片链接)，带字节范围的分片不在其中
+        """
+        return [(k, segment.uri) for k, segment in enumerate(self._segments) if not segment.byterange]
+
+    def prepare_ranges(self):
+        """
+        规划带字节范围的分片的合并请求，并为每个资源预分配本地文件
+        """
+        self._range_resources = {}
+        for i, (uri, merged) in enumerate(plan_ranges(self._segments).items()):
+            ext = os.path.splitext(urlparse(uri).path)[1] or '.ts'
+            chunks = [RangeChunk(start, end, indexes) for start, end, indexes in merged]
+            resource = RangedResource(uri, f'media{i}{ext}', chunks)
+            path = os.path.join(self._file_path, resource.local_name)
+            # 截断到资源大小，未下载的部分不占用磁盘空间
+            with open(path, 'ab') as f:
+                if f.tell() < resource.size:
+                    f.truncate(resource.size)
+            self._range_resources[uri] = resource
+            ranged = sum(len(chunk.segments) for chunk in chunks)
+            logger.info(f"字节范围分片: {uri}, {ranged} 个分片合并为 {len(chunks)} 次请求, 文件大小: {resource.size}")
+
+    def submit_ranges(self, pool):
+        """
+        把所有未完成的字节范围请求提交到线程池，已完成的直接计入进度
+
+        :param pool: 线程池
+        """
+        for resource in self._range_resources.values():
+            for chunk in resource.chunks:
+                if self._store.is_range_complete(resource, chunk):
+                    chunk.done = True
+                    for _ in chunk.segments:
+                        self.segment_done()
+                else:
+                    pool.submit(self.download_range, resource, chunk, self._num_retries)
+
+    def download_range(self, resource, chunk, num_retries):
+        """
+        下载合并后的一段字节范围，写入预分配文件中的相同位置
+        """
+        path = os.path.join(self._file_path, resource.local_name)
+        headers = dict(self._headers, Range=f'bytes={chunk.start}-{chunk.end - 1}')
+        for attempt in range(num_retries + 1):
+            if resource.full or chunk.done:
+                return
+            try:
+                with segment_slots, get_session(resource.uri).get(resource.uri, stream=True, timeout=(5, 60), verify=False, headers=headers) as res:
+                    if res.status_code == 200:
+                        # 服务器忽略Range，整个文件只下载一次
+                        self.download_whole(resource, res, path)
+                        return
+                    match = re.match(r'bytes (\d+)-\d+/', res.headers.get('Content-Range', ''))
+                    if res.status_code != 206 or not match or int(match.group(1)) != chunk.start:
+                        raise IOError(f"范围请求失败，状态码: {res.status_code}, Content-Range: {res.headers.get('Content-Range')}")
+                    written = 0
+                    with open(path, 'r+b') as f:
+                        f.seek(chunk.start)
+                        for data in res.iter_content(chunk_size=64 * 1024):
+                            if data:
+                                f.write(data)
+                                written += len(data)
+                                self.heartbeat()
+                if written != chunk.end - chunk.start:
+                    raise IOError(f"范围大小不完整: {written}/{chunk.end - chunk.start}")
+                self.finish_chunks(resource, [chunk])
+                return
+            except Exception as e:
+                logger.warning(f"范围下载失败(第{attempt + 1}次): {resource.uri} {chunk.key}, 错误: {str(e)}")
+
+    def download_whole(self, resource, res, path):
+        """
+        服务器不支持Range时下载整个资源，并把所有范围标记为完成
+
+        :param resource: RangedResource
+        :param res: 返回完整内容的响应
+        :param path: 本地文件路径
+        """
+        with resource.lock:
+            if resource.full:
+                return
+            logger.warning(f"服务器不支持Range请求，下载整个文件: {resource.uri}")
+            with open(path, 'r+b') as f:
+                for data in res.iter_content(chunk_size=64 * 1024):
+                    if data:
+                        f.write(data)
+                        self.heartbeat()
+                size = f.tell()
+            if size < resource.size:
+                raise IOError(f"文件大小不完整: {size}/{resource.size}")
+            resource.full = True
+        self.finish_chunks(resource, resource.chunks)
+
+    def finish_chunks(self, resource, chunks):
+        """
+        记录范围请求完成并计入进度，每个范围只计一次
+
+        :param resource: RangedResource
+        :param chunks: 完成的RangeChunk列表
+        """
+        finished = []
+        with resource.lock:
+            for chunk in chunks:
+                if not chunk.done:
+                    chunk.done = True
+                    self._store.commit_range(resource, chunk)
+                    finished.append(chunk)
+        for chunk in finished:
+            for _ in chunk.segments:
+                self.segment_done()
+
+    def download_async(self):
+        """
+        使用asyncio引擎下载所有ts分片
+
+        Returns:
+            布尔值，引擎不可用时返回False，由调用方回退到多线程下载
+        """
+        try:
+            from utils.m3u8_async import get_engine
+        except ImportError as e:
+            logger.warning(f"asyncio下载引擎不可用，回退到多线程下载: {str(e)}")
+            return False
+        get_engine().download(self)
+        return True
+
+    def heartbeat(self):
+        """
+        记录剧集有数据写入，单个大分片下载期间也不会被判定为停滞；每秒最多更新一次
+        """
+        now = time.monotonic()
+        if now - self._beat_at >= 1:
+            self._beat_at = now
+            liveness.beat(self._task_id, self._episode_number)
+
+    def segment_done(self):
+        """
+        记录一个ts分片下载完成并输出进度，数据库由progress_writer批量更新
+        """
+        success_sum = self._tracker.advance()
+        self.heartbeat()
+        sys.stdout.write('\r[%-25s](%d/%d)' % ("*" * (100 * success_sum // self._ts_sum // 4),
+                                               success_sum, self._ts_sum))
+        sys.stdout.flush()
 
     def download_ts(self, ts_url, name, num_retries):
         """
@@ -158,63 +985,75 @@ class M3u8Download:
         """
         ts_url = ts_url.split('\n')[0]
         try:
-            if not os.path.exists(name + '.ts' ):
-                with requests.get(ts_url, stream=True, timeout=(5, 60), verify=False, headers=self._headers) as res:
-                    if res.status_code == 200:
-                        with open(name + '.ts', "wb") as ts:
-                            for chunk in res.iter_content(chunk_size=1024):
-                                if chunk:
-                                    ts.write(chunk)
-                        self._success_sum += 1
-                        sys.stdout.write('\r[%-25s](%d/%d)' % ("*" * (100 * self._success_sum // self._ts_sum // 4),
-                                                               self._success_sum, self._ts_sum))
-                        sys.stdout.flush()
-                        pro = int(100 * self._success_sum // self._ts_sum)
-                        if(self._progress != pro):
-                            self._progress = pro
-                            operations.update_download_progress(self._task_id, self._episode_number, pro)
-                    else:
-                        self.download_ts(ts_url, name, num_retries - 1)
-            else:
-                self._success_sum += 1
-                pro = int(100 * self._success_sum // self._ts_sum)
-                if(self._progress != pro):
-                    self._progress = pro
-                    operations.update_download_progress(self._task_id, self._episode_number, pro)
-        except Exception:
-            if os.path.exists(name + '.ts'):
-                os.remove(name + '.ts')
+            if self._store.is_complete(name, ts_url):
+                self.segment_done()
+                return
+            offset = self._store.resume_offset(name, ts_url)
+            headers = self._store.request_headers(self._headers, offset)
+            with segment_slots, get_session(ts_url).get(ts_url, stream=True, timeout=(5, 60), verify=False, headers=headers) as res:
+                mode, expected_size = self._store.open_mode(name, res.status_code, res.headers, offset)
+                if mode:
+                    with open(name + '.ts.part', mode) as ts:
+                        for chunk in res.iter_content(chunk_size=1024):
+                            if chunk:
+                                ts.write(chunk)
+                                self.heartbeat()
+            self._store.commit(name, expected_size, ts_url)
+            self.segment_done()
+        except Exception as e:
+            # 保留已写入的部分，下次重试时通过Range续传
+            logger.warning(f"分片下载失败: {ts_url}, 错误: {str(e)}")
             if num_retries > 0:
                 self.download_ts(ts_url, name, num_retries - 1)
 
-    def download_key(self, key_line, num_retries):
+    def download_resource(self, url, local_name, byterange=None, num_retries=5):
+        """
+        下载初始化分片等小文件，清单中链接和sha256一致的已有文件直接沿用
+
+        :param url: 完整链接
+        :param local_name: 保存在分片目录中的文件名
+        :param byterange: (长度, 偏移)，只下载资源中的这一段
+        :param num_retries: 重试次数
+        :return: 播放列表中引用的相对路径，下载失败时返回None
+        """
+        if self._store.is_resource_complete(local_name, url, byterange):
+            return f'{self._name}/{local_name}'
+        headers = self._headers
+        if byterange:
+            length, offset = byterange
+            headers = dict(headers, Range=f'bytes={offset}-{offset + length - 1}')
+        for attempt in range(num_retries + 1):
+            try:
+                with get_session(url).get(url, timeout=(5, 30), verify=False, headers=headers) as res:
+                    if res.status_code not in (200, 206):
+                        raise IOError(f"状态码: {res.status_code}")
+                    content = res.content
+                    if byterange and res.status_code == 200:
+                        # 服务器忽略Range时自行截取
+                        content = content[byterange[1]:byterange[1] + byterange[0]]
+                self._store.commit_resource(local_name, url, byterange, content)
+                return f'{self._name}/{local_name}'
+            except Exception as e:
+                logger.warning(f"下载失败(第{attempt + 1}次): {url}, 错误: {str(e)}")
+        return None
+
+    def download_key(self, key, local_name, num_retries):
         """
         下载key文件
+
+        :param key: M3u8Key
+        :param local_name: 保存在分片目录中的文件名
+        :param num_retries: 重试次数
+        :return: 播放列表中引用的相对路径，下载失败时返回None，播放列表保留原链接
         """
-        mid_part = re.search(r"URI=[\'|\"].*?[\'|\"]", key_line).group()
-        may_key_url = mid_part[5:-1]
-        if self._key:
-            with open(os.path.join(self._file_path, 'key'), 'wb') as f:
-                f.write(self._key)
-            return f'{key_line.split(mid_part)[0]}URI="./{self._name}/key"'
-        if may_key_url.startswith('http'):
-            true_key_url = may_key_url
-        elif may_key_url.startswith('/'):
-            true_key_url = self._front_url + may_key_url
-        else:
-            true_key_url = self._url.rsplit("/", 1)[0] + '/' + may_key_url
-        try:
-            with requests.get(true_key_url, timeout=(5, 30), verify=False, headers=self._headers) as res:
-                with open(os.path.join(self._file_path, 'key'), 'wb') as f:
-                    f.write(res.content)
-            return f'{key_line.split(mid_part)[0]}URI="./{self._name}/key"{key_line.split(mid_part)[-1]}'
-        except Exception as e:
-            print(e)
-            if os.path.exists(os.path.join(self._file_path, 'key')):
-                os.remove(os.path.join(self._file_path, 'key'))
-            print("加密视频,无法加载key,揭秘失败")
-            if num_retries > 0:
-                self.download_key(key_line, num_retries - 1)
+        if self._key and local_name == 'key':
+            # 手动指定的key用于第一个key，不下载
+            self._store.commit_resource(local_name, key.uri, None, self._key)
+            return f'{self._name}/{local_name}'
+        local_path = self.download_resource(key.uri, local_name, None, num_retries)
+        if local_path is None:
+            logger.error(f"加密视频，无法下载key: {key.uri}")
+        return local_path
                 
     '''
     run cmd
@@ -240,14 +1079,16 @@ class M3u8Download:
         self.shell_run_cmd_block(cmd)
 
     def delete_file(self):
-        file = os.listdir(self._file_path)
-        for item in file:
-            logger.info(f"删除文件: {os.path.join(self._file_path, item)}")
-            os.remove(os.path.join(self._file_path, item))
-        logger.info(f"删除文件夹: {self._file_path}")
-        os.removedirs(self._file_path)
-        logger.info(f"删除文件: {self._file_path + '.m3u8'}")
-        os.remove(self._file_path + '.m3u8')
+        if os.path.exists(self._file_path):
+            file = os.listdir(self._file_path)
+            for item in file:
+                logger.info(f"删除文件: {os.path.join(self._file_path, item)}")
+                os.remove(os.path.join(self._file_path, item))
+            logger.info(f"删除文件夹: {self._file_path}")
+            os.rmdir(self._file_path)
+        if os.path.exists(self._file_path + '.m3u8'):
+            logger.info(f"删除文件: {self._file_path + '.m3u8'}")
+            os.remove(self._file_path + '.m3u8')
         
         
 # def proc(url_list, name_list):
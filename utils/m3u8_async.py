@@ -0,0 +1,149 @@
+"""
+asyncio分片下载引擎
+
+在单个事件循环中并发下载多个剧集的ts分片，与多线程下载共用 segment_slots 全局并发上限，
+输出的目录结构和进度上报与M3u8Download的多线程下载完全一致
+"""
+import os
+import asyncio
+import threading
+import aiohttp
+from config import MAX_SEGMENT_CONCURRENCY, M3U8_ASYNC_READ_BUFFER, M3U8_ASYNC_LIMIT_PER_HOST, M3U8_ASYNC_SLOT_POLL_INTERVAL
+from utils.logging import setup_logger
+from utils.m3u8 import segment_slots
+
+logger = setup_logger(__name__)
+
+class AsyncSegmentEngine:
+    """运行在后台线程事件循环上的分片下载引擎"""
+    
+    def __init__(self, max_inflight=MAX_SEGMENT_CONCURRENCY, read_buffer=M3U8_ASYNC_READ_BUFFER,
+                 limit_per_host=M3U8_ASYNC_LIMIT_PER_HOST):
+        """
+        初始化下载引擎
+        
+        Args:
+            max_inflight: 事件循环内等待全局名额的分片请求数上限，实际并发还受segment_slots限制
+            read_buffer: 每次读取响应体的字节数
+            limit_per_host: 每个主机的最大连接数
+        """
+        self.max_inflight = max_inflight
+        self.read_buffer = read_buffer
+        self.limit_per_host = limit_per_host
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+    
+    def _ensure_loop(self):
+        """启动后台事件循环线程"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._run_loop, args=(loop,), name='m3u8-async-engine')
+                thread.daemon = True
+                thread.start()
+                self._loop = loop
+                self._thread = thread
+                logger.info(f"asyncio下载引擎已启动，全局并发上限: {MAX_SEGMENT_CONCURRENCY}")
+        return self._loop
+    
+    @staticmethod
+    def _run_loop(loop):
+        """事件循环线程入口"""
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+    
+    async def _get_session(self):
+        """在事件循环内创建共享的HTTP会话和全局信号量"""
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_inflight, limit_per_host=self.limit_per_host, ssl=False)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+        return self._session
+    
+    @staticmethod
+    async def _acquire_slot():
+        """获取与多线程下载共用的全局分片名额，不阻塞事件循环"""
+        while not segment_slots.acquire(blocking=False):
+            await asyncio.sleep(M3U8_ASYNC_SLOT_POLL_INTERVAL)
+    
+    def download(self, downloader):
+        """
+        下载一个剧集的全部分片，阻塞直到完成
+        
+        Args:
+            downloader: 已解析出分片列表的M3u8Download实例
+        """
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self._download_all(downloader), loop)
+        return future.result()
+    
+    async def _download_all(self, downloader):
+        """并发下载剧集的所有分片"""
+        session = await self._get_session()
+        jobs = [
+            self._download_segment(session, downloader, ts_url, os.path.join(downloader._file_path, str(k)))
+            for k, ts_url in downloader.segment_jobs()
+        ]
+        await asyncio.gather(*jobs)
+    
+    async def _download_segment(self, session, downloader, ts_url, name):
+        """
+        下载单个ts分片
+        
+        Args:
+            session: aiohttp会话
+            downloader: 所属的M3u8Download实例
+            ts_url: 分片URL
+            name: 不含扩展名的本地文件路径
+        """
+        ts_url = ts_url.split('\n')[0]
+        store = downloader._store
+        # 文件读写和sha256计算都放到线程池执行，不阻塞事件循环上的其他分片
+        loop = asyncio.get_running_loop()
+        timeout = aiohttp.ClientTimeout(sock_connect=5, sock_read=60)
+        for attempt in range(downloader._num_retries + 1):
+            try:
+                # 检查已有分片时的读取或校验出错同样按失败重试，不中断同一剧集的其他分片
+                if await loop.run_in_executor(None, store.is_complete, name, ts_url):
+                    downloader.segment_done()
+                    return
+                offset = await loop.run_in_executor(None, store.resume_offset, name, ts_url)
+                headers = store.request_headers(downloader._headers, offset)
+                async with self._semaphore:
+                    await self._acquire_slot()
+                    try:
+                        async with session.get(ts_url, headers=headers, timeout=timeout) as res:
+                            mode, expected_size = await loop.run_in_executor(
+                                None, store.open_mode, name, res.status, res.headers, offset)
+                            if mode:
+                                ts = await loop.run_in_executor(None, open, name + '.ts.part', mode)
+                                try:
+                                    async for chunk in res.content.iter_chunked(self.read_buffer):
+                                        await loop.run_in_executor(None, ts.write, chunk)
+                                        downloader.heartbeat()
+                                finally:
+                                    await loop.run_in_executor(None, ts.close)
+                    finally:
+                        segment_slots.release()
+                await loop.run_in_executor(None, store.commit, name, expected_size, ts_url)
+                downloader.segment_done()
+                return
+            except Exception as e:
+                # 保留已写入的部分，下次重试时通过Range续传
+                logger.warning(f"分片下载失败(第{attempt + 1}次): {ts_url}, 错误: {str(e)}")
+                await asyncio.sleep(min(2 ** attempt, 10) * 0.5)
+
+# 全局引擎实例，首次使用时创建
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """获取全局asyncio下载引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncSegmentEngine()
+    return _engine
@@ -6,10 +6,15 @@ import ssl
 import random
 import time
 import logging
+import threading
 import urllib3
+from urllib.parse import urlparse
 from urllib3.util.ssl_ import create_urllib3_context
 from requests.adapters import HTTPAdapter
-from config import BASE_DOMAINS, USER_AGENTS, BASE_URL
+from config import USER_AGENTS, HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_POOL_BLOCK, HTTP_CACHE_ENABLED
+from utils.ratelimit import rate_limiter
+from utils.domain_health import domain_health
+from utils.http_cache import http_cache, body_hash, CachedResponse
 
 # 禁用SSL警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -21,33 +26,57 @@ def get_random_ua():
     return random.choice(USER_AGENTS)
 
 def get_domain():
-    """获取域名"""
-    return BASE_URL.replace('https://', '')
+    """获取域名，返回当前最快的未熔断镜像"""
+    return domain_health.preferred()
     
 def get_base_url():
     """获取基础URL"""
-    return BASE_URL
+    return f"https://{get_domain()}"
+
+# 按主机缓存的共享会话
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# 所有连接池共用的SSL上下文
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+def get_ssl_context():
+    """
+    获取进程内共享的SSL上下文
+    
+    Returns:
+        ssl.SSLContext实例
+    """
+    global _ssl_context
+    if _ssl_context is None:
+        with _ssl_context_lock:
+            if _ssl_context is None:
+                context = create_urllib3_context()
+                # 禁用SSL验证
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                # 设置安全协议版本
+                context.options |= ssl.OP_NO_SSLv2
+                context.options |= ssl.OP_NO_SSLv3
+                # 启用所有TLS协议
+                context.options |= 0x4  # SSL_OP_LEGACY_SERVER_CONNECT
+                _ssl_context = context
+    return _ssl_context
 
 class EOFHandlingSSLAdapter(HTTPAdapter):
     """处理EOF错误的SSL适配器"""
     def init_poolmanager(self, *args, **kwargs):
-        context = create_urllib3_context()
-        # 禁用SSL验证
-        kwargs['ssl_context'] = context
-        context.check_hostname = False
-        context.verify_mode = ssl.CERT_NONE
-        # 设置安全协议版本
-        context.options |= ssl.OP_NO_SSLv2
-        context.options |= ssl.OP_NO_SSLv3
-        # 启用所有TLS协议
-        context.options |= 0x4  # SSL_OP_LEGACY_SERVER_CONNECT
+        # 共用同一个SSL上下文，配合长连接复用减少TLS握手
+        kwargs['ssl_context'] = get_ssl_context()
         kwargs['assert_hostname'] = False
         
         # 允许更宽松的SSL握手行为
         kwargs['retries'] = urllib3.Retry(
             total=3,
             backoff_factor=0.5,
-            status_forcelist=[500, 502, 503, 504],
+            # 503由make_request交给限速器处理，不在连接池内重试
+            status_forcelist=[500, 502, 504],
             allowed_methods=frozenset(['GET', 'POST', 'HEAD']),
             respect_retry_after_header=False
         )
@@ -56,99 +85,173 @@ class EOFHandlingSSLAdapter(HTTPAdapter):
         kwargs['timeout'] = urllib3.Timeout(connect=30, read=kwargs.get('timeout', 20))
         return super().init_poolmanager(*args, **kwargs)
 
-def make_request(url, headers=None, retry=3, timeout=20, verify=False):
+def get_session(url):
+    """
+    获取指定主机的共享会话
+    
+    会话按主机在进程内复用并保持长连接，可以被多个线程同时使用。
+    调用方不要修改会话上的headers等共享状态，请求头应在每次请求时传入。
+    
+    Args:
+        url: 完整URL、相对URL或主机名
+        
+    Returns:
+        requests.Session实例
+    """
+    if url.startswith('http'):
+        host = urlparse(url).netloc or get_domain()
+    elif url.startswith('/'):
+        host = get_domain()
+    else:
+        host = url
+    
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+    
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            session.verify = False
+            session.mount('https://', EOFHandlingSSLAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                pool_block=HTTP_POOL_BLOCK
+            ))
+            session.mount('http://', HTTPAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                pool_block=HTTP_POOL_BLOCK
+            ))
+            _sessions[host] = session
+            logger.info(f"创建共享会话: {host}")
+    return session
+
+def close_sessions():
+    """关闭所有共享会话，释放连接池"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+def _record_health(host, status_code, latency):
+    """根据响应状态更新域名健康状态，限速响应由rate_limiter处理，不计入健康状态"""
+    if status_code in (429, 503):
+        domain_health.release(host)
+    elif status_code >= 500:
+        domain_health.record_failure(host)
+    else:
+        domain_health.record_success(host, latency)
+
+def make_request(url, headers=None, retry=3, timeout=20, verify=False, conditional=False):
     """
     发起HTTP请求，自动重试
     
+    相对URL每次尝试都发往最快的可用镜像，失败后优先换用本次还没有失败过的镜像；
+    处于熔断期的镜像直接跳过，所有镜像都熔断时立即返回失败
+    
     Args:
         url: 请求的URL
         headers: 请求头
         retry: 重试次数
         timeout: 超时时间(秒)
         verify: 是否验证SSL证书
+        conditional: 是否使用HTTP缓存发起条件请求，并在结果中附带内容哈希body_hash
         
     Returns:
-        字典包含status_code和response
+        字典包含status_code和response，服务器返回304时response为由缓存内容构造的响应
     """
     if headers is None:
         headers = {
             'User-Agent': get_random_ua(),
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Connection': 'close', # 使用短连接，避免持久连接可能导致的问题
             'Upgrade-Insecure-Requests': '1',
             'Cache-Control': 'no-cache' # 避免缓存问题
         }
     
-    # 添加随机延迟
-    time.sleep(random.uniform(1, 3))
+    # 有缓存的页面带上验证器发起条件请求，不修改调用方传入的请求头；
+    # 条件请求不带Cache-Control: no-cache，以免代理和CDN跳过验证直接返回完整页面
+    cache_entry = None
+    if conditional:
+        headers = {k: v for k, v in headers.items() if k.lower() != 'cache-control'}
+    if conditional and HTTP_CACHE_ENABLED:
+        cache_entry = http_cache.get(url)
+        if cache_entry:
+            headers = {**headers, **http_cache.conditional_headers(cache_entry)}
     
-    # 固定顺序尝试所有域名
-    if not url.startswith('http'):
-        # 如果相对URL，先尝试主域名
-        domain_to_try = get_domain()
-        base_url = f"https://{domain_to_try}"
-        full_url = f"{base_url}{url if url.startswith('/') else '/' + url}"
-    else:
-        full_url = url
-        
-    # 创建一个Session以重用连接，提高效率
-    session = requests.Session()
-    
-    # 对于每个域名尝试连接
-    all_domains_to_try = BASE_DOMAINS.copy()
-    tried_domains = []
-    
-    # 使用自定义适配器
-    session.mount('https://', EOFHandlingSSLAdapter())
-    
-    # 设置会话级别的请求配置
-    session.verify = verify
-    session.headers.update(headers)
-    session.timeout = timeout
+    relative = not url.startswith('http')
+    path = url if url.startswith('/') else '/' + url
+    full_url = url
+    # 本次请求中失败过的镜像
+    failed_domains = []
     
     for attempt in range(retry * 2):  # 增加总重试次数以适应域名切换
+        host = None
         try:
-            # 如果尝试次数超过最初设置，可能需要切换域名
-            if attempt >= retry and not url.startswith('http'):
-                # 切换到下一个可用域名
-                if all_domains_to_try:
-                    next_domain = next((d for d in all_domains_to_try if d not in tried_domains), None)
-                    if next_domain:
-                        tried_domains.append(next_domain)
-                        base_url = f"https://{next_domain}"
-                        full_url = f"{base_url}{url if url.startswith('/') else '/' + url}"
-                        logger.info(f"尝试切换到新域名: {next_domain}")
-                    else:
-                        # 所有域名都尝试过了，放弃
-                        break
+            if relative:
+                domain = domain_health.choose(exclude=failed_domains)
+                if domain is None:
+                    logger.error(f"所有域名都处于熔断状态，放弃请求: {url}")
+                    break
+                full_url = f"https://{domain}{path}"
             
             logger.info(f"请求URL: {full_url} (第{attempt+1}次尝试)")
             
+            # 按主机限速，替代固定的随机延迟
+            host = urlparse(full_url).netloc
+            rate_limiter.acquire(host)
+            
             # 配置额外的安全选项
             ssl_options = {
+                'headers': headers,
                 'verify': verify,
                 'timeout': timeout,
                 'allow_redirects': True
             }
             
-            # 开启单次请求模式，每次请求后关闭连接
-            session.headers.update({'Connection': 'close'})
+            # 使用按主机共享的会话发起请求，复用长连接
+            started = time.monotonic()
+            response = get_session(full_url).get(full_url, **ssl_options)
+            _record_health(host, response.status_code, time.monotonic() - started)
+            
+            # 429/503时退避，成功时重置退避状态
+            rate_limiter.on_response(host, response.status_code, response.headers.get('Retry-After'))
             
-            # 使用会话发起请求
-            response = session.get(full_url, **ssl_options)
+            # 页面没有变化，使用缓存的内容
+            if response.status_code == 304 and cache_entry:
+                logger.info(f"页面未修改 (304): {full_url}")
+                return {
+                    "status_code": 200,
+                    "response": CachedResponse(cache_entry, response.headers),
+                    "body_hash": cache_entry['body_hash'],
+                    "not_modified": True
+                }
             
             # 如果状态码是404，立即返回，表示资源确实不存在
             if response.status_code == 404:
                 logger.warning(f"资源不存在 (404): {full_url}")
+                if conditional:
+                    http_cache.invalidate(url)
                 return {"status_code": 404, "response": None}
             
             # 如果请求成功，返回响应
             if response.status_code == 200:
-                return {"status_code": 200, "response": response}
+                if not conditional:
+                    return {"status_code": 200, "response": response}
+                digest = body_hash(response.content)
+                if HTTP_CACHE_ENABLED:
+                    http_cache.store(url, response, digest, cache_entry)
+                return {"status_code": 200, "response": response, "body_hash": digest}
             
             logger.warning(f"请求失败，状态码: {response.status_code}，正在重试...")
+            if response.status_code >= 500 and host not in failed_domains:
+                failed_domains.append(host)
         except (requests.exceptions.SSLError, ssl.SSLError) as e:
+            if host:
+                domain_health.record_failure(host)
+                failed_domains.append(host)
             # 特殊处理SSLEOFError - 意外EOF错误
             eof_error = False
             if "EOF occurred in violation of protocol" in str(e) or "UNEXPECTED_EOF_WHILE_READING" in str(e):
@@ -170,6 +273,9 @@ def make_request(url, headers=None, retry=3, timeout=20, verify=False):
                 time.sleep(random.uniform(2, 5))
         except Exception as e:
             logger.error(f"请求出错: {str(e)}, 类型: {type(e).__name__}")
+            if host:
+                domain_health.record_failure(host)
+                failed_domains.append(host)
             time.sleep(random.uniform(2, 5))
     
     # 所有尝试都失败了
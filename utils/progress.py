@@ -0,0 +1,155 @@
+"""
+下载进度汇总模块
+
+各下载线程只在内存中累加完成的分片数，由单个后台线程按固定频率把进度写入数据库
+"""
+import time
+import threading
+from database import operations
+from config import PROGRESS_FLUSH_INTERVAL, PROGRESS_FLUSH_STEP
+from utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+class ProgressTracker:
+    """单个剧集的进度计数器"""
+    
+    def __init__(self, task_id, episode_number, total):
+        """
+        初始化进度计数器
+        
+        Args:
+            task_id: 任务ID
+            episode_number: 剧集编号
+            total: 分片总数
+        """
+        self.task_id = task_id
+        self.episode_number = episode_number
+        self.total = total
+        self.completed = 0
+        self.flushed_progress = None
+        self.flushed_at = 0
+        self._lock = threading.Lock()
+    
+    def advance(self, count=1):
+        """
+        记录分片完成，可被多个线程同时调用
+        
+        Args:
+            count: 完成的分片数
+            
+        Returns:
+            整数，累计完成的分片数
+        """
+        with self._lock:
+            self.completed += count
+            return self.completed
+    
+    @property
+    def progress(self):
+        """当前进度百分比(0-100)"""
+        if not self.total:
+            return 0
+        return min(100, 100 * self.completed // self.total)
+
+class ProgressWriter:
+    """把所有剧集的进度合并后写入数据库的后台线程"""
+    
+    def __init__(self, interval=PROGRESS_FLUSH_INTERVAL, step=PROGRESS_FLUSH_STEP):
+        """
+        初始化进度写入器
+        
+        Args:
+            interval: 最长写入间隔(秒)，进度有变化时至少每隔这么久写入一次
+            step: 进度变化达到该百分比时在下一次检查时立即写入
+        """
+        self.interval = interval
+        self.step = step
+        self._trackers = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+    
+    def _ensure_thread(self):
+        """启动后台写入线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='progress-writer')
+            self._thread.daemon = True
+            self._thread.start()
+    
+    def track(self, task_id, episode_number, total):
+        """
+        开始跟踪一个剧集的进度
+        
+        Args:
+            task_id: 任务ID
+            episode_number: 剧集编号
+            total: 分片总数
+            
+        Returns:
+            ProgressTracker实例
+        """
+        tracker = ProgressTracker(task_id, episode_number, total)
+        with self._lock:
+            self._trackers[(task_id, episode_number)] = tracker
+            self._ensure_thread()
+        return tracker
+    
+    def untrack(self, tracker, flush=True):
+        """
+        停止跟踪剧集进度，返回后不会再有该剧集的进度写入
+        
+        Args:
+            tracker: ProgressTracker实例
+            flush: 是否先写入最后的进度，写入失败只记录日志，不影响调用方
+        """
+        with self._lock:
+            key = (tracker.task_id, tracker.episode_number)
+            if self._trackers.get(key) is tracker:
+                del self._trackers[key]
+        if not flush:
+            return
+        with self._flush_lock:
+            try:
+                self._flush_tracker(tracker, time.monotonic(), force=True)
+            except Exception as e:
+                # 通常在finally中调用，不能用写入错误掩盖下载本身的异常
+                logger.error(f"写入下载进度失败: {tracker.task_id}/{tracker.episode_number}, 错误: {str(e)}")
+    
+    def _flush_tracker(self, tracker, now, force=False):
+        """按写入策略把单个剧集的进度写入数据库"""
+        progress = tracker.progress
+        last = tracker.flushed_progress
+        if progress == last:
+            return
+        if not force and last is not None and progress - last < self.step and now - tracker.flushed_at < self.interval:
+            return
+        # 100%由下载器在确认文件完整后连同文件信息一起写入
+        if progress >= 100:
+            progress = 99
+            if progress == last:
+                return
+        operations.update_download_progress(tracker.task_id, tracker.episode_number, progress)
+        tracker.flushed_progress = progress
+        tracker.flushed_at = now
+    
+    def flush(self):
+        """写入所有剧集的进度"""
+        with self._lock:
+            trackers = list(self._trackers.values())
+        with self._flush_lock:
+            now = time.monotonic()
+            for tracker in trackers:
+                try:
+                    self._flush_tracker(tracker, now)
+                except Exception as e:
+                    logger.error(f"写入下载进度失败: {tracker.task_id}/{tracker.episode_number}, 错误: {str(e)}")
+    
+    def _run(self):
+        """后台写入循环"""
+        while True:
+            time.sleep(min(1, self.interval))
+            self.flush()
+
+# 全局进度写入器
+progress_writer = ProgressWriter()
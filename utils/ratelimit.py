@@ -0,0 +1,151 @@
+"""
+请求限速模块
+
+按主机维护令牌桶，替代固定的随机等待；遇到429/503时按指数退避暂停该主机的请求
+"""
+import time
+import threading
+import logging
+from config import RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_RETRY_AFTER_MAX
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """单个主机的令牌桶"""
+    
+    def __init__(self, rate, burst):
+        """
+        初始化令牌桶
+        
+        Args:
+            rate: 每秒补充的令牌数
+            burst: 桶容量，即允许的最大突发请求数
+        """
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+        self.backoff = 0
+        self.lock = threading.Lock()
+    
+    def _refill(self, now):
+        """按流逝的时间补充令牌"""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+    
+    def acquire(self):
+        """
+        获取一个令牌，没有可用令牌时阻塞等待
+        
+        Returns:
+            浮点数，本次等待的秒数
+        """
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait_time = self.blocked_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+            waited += wait_time
+    
+    def penalize(self, retry_after=None):
+        """
+        服务器要求降速时暂停该主机的请求
+        
+        Args:
+            retry_after: 服务器给出的Retry-After秒数，没有时使用指数退避，
+                超过RATE_LIMIT_RETRY_AFTER_MAX时按上限处理
+            
+        Returns:
+            浮点数，暂停的秒数
+        """
+        with self.lock:
+            self.backoff = min(max(self.backoff * 2, RATE_LIMIT_BACKOFF_BASE), RATE_LIMIT_BACKOFF_MAX)
+            pause = min(retry_after, RATE_LIMIT_RETRY_AFTER_MAX) if retry_after is not None else self.backoff
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            # 暂停结束后从空桶开始，避免立即突发
+            self.tokens = 0
+            self.updated_at = self.blocked_until
+            return pause
+    
+    def reward(self):
+        """请求成功后重置退避时间"""
+        with self.lock:
+            self.backoff = 0
+
+class RateLimiter:
+    """按主机分配令牌桶的限速器"""
+    
+    def __init__(self, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST):
+        """
+        初始化限速器
+        
+        Args:
+            rate: 每个主机每秒允许的请求数
+            burst: 每个主机允许的最大突发请求数
+        """
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def _bucket(self, host):
+        """获取主机对应的令牌桶，不存在则创建"""
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(host)
+                if bucket is None:
+                    bucket = TokenBucket(self.rate, self.burst)
+                    self._buckets[host] = bucket
+        return bucket
+    
+    def acquire(self, host):
+        """
+        请求前获取主机的令牌
+        
+        Args:
+            host: 主机名
+            
+        Returns:
+            浮点数，等待的秒数
+        """
+        waited = self._bucket(host).acquire()
+        if waited > 1:
+            logger.info(f"限速等待 {waited:.2f} 秒: {host}")
+        return waited
+    
+    def on_response(self, host, status_code, retry_after=None):
+        """
+        根据响应状态调整主机的限速状态
+        
+        Args:
+            host: 主机名
+            status_code: HTTP状态码
+            retry_after: Retry-After响应头的原始值
+        """
+        bucket = self._bucket(host)
+        if status_code in (429, 503):
+            seconds = None
+            if retry_after:
+                try:
+                    seconds = max(0, float(retry_after))
+                except ValueError:
+                    seconds = None
+            pause = bucket.penalize(seconds)
+            logger.warning(f"主机 {host} 返回 {status_code}，暂停请求 {pause:.2f} 秒")
+        elif 200 <= status_code < 400:
+            bucket.reward()
+
+# 全局限速器实例
+rate_limiter = RateLimiter()
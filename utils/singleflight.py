@@ -0,0 +1,94 @@
+"""
+请求合并模块
+
+同一个键同时只执行一次加载：第一个调用方负责请求和解析，
+其余并发调用方等待该次结果，多个界面用户同时打开同一部动漫、
+或任务和界面同时解析同一集时，只向源站发出一次请求
+"""
+import copy
+import threading
+from utils.logging import setup_logger
+
+logger = setup_logger(__name__)
+
+class _Call:
+    """进行中的一次加载"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """按键合并并发的重复加载"""
+
+    def __init__(self, name):
+        """
+        初始化请求合并器
+
+        Args:
+            name: 名称，用于日志
+        """
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        执行加载，同一个键已有加载在进行时等待其结果
+
+        Args:
+            key: 合并键，通常为规范化后的URL
+            fn: 无参数的加载函数
+
+        Returns:
+            加载结果，等待方得到结果的深拷贝，调用方修改结果互不影响
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            logger.debug(f"等待进行中的请求: {self.name} {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.error = e
+            self._finish(key, call)
+            raise
+        call.result = result
+        if self._finish(key, call):
+            # 等待方会复制call.result，返回副本以免调用方修改结果时与复制同时进行
+            return copy.deepcopy(result)
+        return result
+
+    def _finish(self, key, call):
+        """移除进行中的加载并唤醒等待方，返回等待方数量"""
+        with self._lock:
+            del self._calls[key]
+            waiters = call.waiters
+        call.done.set()
+        if waiters:
+            logger.debug(f"合并了 {waiters} 个重复请求: {self.name} {key}")
+        return waiters
+
+    def in_flight(self):
+        """
+        获取进行中的加载数
+
+        Returns:
+            整数，进行中的键数量
+        """
+        with self._lock:
+            return len(self._calls)
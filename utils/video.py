@@ -11,12 +11,13 @@ import traceback
 import subprocess
 from urllib.parse import urlparse
 import requests
-from config import VIDEO_DIR, ARIA2_RPC_URL, ARIA2_RPC_TOKEN
+from config import VIDEO_DIR, ARIA2_RPC_URL, ARIA2_RPC_TOKEN, SEGMENT_THREADS_PER_EPISODE
 from utils.network import get_random_ua, get_base_url
 from utils.logging import setup_logger
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from database import operations  # 添加operations模块的导入
 from utils.m3u8 import M3u8Download
+from tasks.liveness import liveness
 
 # 配置日志
 logger = setup_logger(__name__)
@@ -715,6 +716,7 @@ def download_video(video_url, anime_id, episode_number, task_id=None):
         # 定义进度回调函数
         def update_progress(progress):
             if task_id:
+                liveness.beat(task_id, episode_number)
                 # 转为整数进度
                 int_progress = int(progress)
                 # 每2%或接近完成时更新数据库
@@ -724,11 +726,10 @@ def download_video(video_url, anime_id, episode_number, task_id=None):
         
         #首先尝试使用m3u8下载
         logger.info(f"尝试使用m3u8下载...{video_url} {anime_id} {episode_number} {task_id}")
-        downloaer = M3u8Download(video_url, anime_id, episode_id_clean, task_id, episode_number, max_workers=64, num_retries=10)
+        downloaer = M3u8Download(video_url, anime_id, episode_id_clean, task_id, episode_number, max_workers=SEGMENT_THREADS_PER_EPISODE, num_retries=10)
         if downloaer._progress == 100:
             return os.path.join(f"{anime_id}", f"ep{episode_id_clean}.m3u8")
-        logger.error(f"下载视频异常: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.error(f"m3u8下载未完成: {video_url}")
         return None
         # 1. 首先尝试使用yt-dlp下载m3u8
         logger.info("尝试使用yt-dlp下载m3u8...")
@@ -0,0 +1,101 @@
+"""
+下载worker进程入口
+
+从数据库的jobs队列领取任务并在独立进程中下载，Web进程只负责接口和视频服务。
+需要在config.py中设置EXECUTION_MODE = 'worker'，然后运行:
+
+    python worker.py [进程数]
+"""
+import sys
+import time
+import signal
+import threading
+import multiprocessing
+from config import WORKER_PROCESSES, WORKER_POLL_INTERVAL, LEASE_DURATION
+from database.models import init_db
+from database import operations
+from utils.logging import setup_logger
+
+# 配置日志
+logger = setup_logger(__name__)
+
+def run_job(job):
+    """
+    在当前进程中执行一个作业，等待任务所有剧集结束后返回
+    
+    Args:
+        job: 作业信息
+    """
+    from tasks.download_scheduler import download_scheduler
+    
+    finished = threading.Event()
+    task_id = job['task_id']
+    if not download_scheduler.submit_task(task_id, job['priority'], on_finish=lambda _: finished.set()):
+        logger.warning(f"任务 {task_id} 已在本进程中执行")
+        return
+    finished.wait()
+
+def worker_loop(index):
+    """
+    worker进程主循环
+    
+    Args:
+        index: 进程序号
+    """
+    from tasks.download_scheduler import lease_owner
+    from tasks.scheduler import LeaseHeartbeat
+    from tasks.liveness import start_monitor
+    
+    worker = lease_owner()
+    logger.info(f"worker {index} 已启动: {worker}")
+    init_db()
+    
+    # 定期续约领取的作业，进程失效后作业会被其他worker回收
+    LeaseHeartbeat().start()
+    # 监控本进程中停滞的剧集
+    start_monitor()
+    
+    while True:
+        job = operations.claim_job(worker, LEASE_DURATION)
+        if not job:
+            time.sleep(WORKER_POLL_INTERVAL)
+            continue
+        
+        logger.info(f"worker {worker} 领取作业 {job['id']}, 任务: {job['task_id']}")
+        try:
+            run_job(job)
+            operations.finish_job(job['id'], worker, 'done')
+        except Exception as e:
+            logger.error(f"作业 {job['id']} 执行出错: {str(e)}")
+            operations.finish_job(job['id'], worker, 'failed')
+
+def main():
+    """启动多个worker进程，收到终止信号时一并结束"""
+    processes_count = int(sys.argv[1]) if len(sys.argv) > 1 else WORKER_PROCESSES
+    
+    # 数据库迁移只在主进程中执行一次
+    init_db()
+    
+    # 使用spawn避免子进程继承父进程的数据库连接和线程
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for index in range(processes_count):
+        process = context.Process(target=worker_loop, args=(index,), name=f'download-worker-{index}')
+        process.daemon = True
+        process.start()
+        processes.append(process)
+    
+    def signal_handler(signum, frame):
+        logger.info("收到终止信号，停止worker进程...")
+        for process in processes:
+            process.terminate()
+        sys.exit(0)
+    
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    
+    for process in processes:
+        process.join()
+
+if __name__ == '__main__':
+    main()